@@ -0,0 +1,9 @@
+import sys
+
+from src.experimentation.worker import get_work_queue_path, run_worker
+
+# Usage: python -m scripts.worker path/to/suite/output/folder
+# Joins the workers draining the work queue of a suite launched with "scheduler: queue"
+suite_folder_path = sys.argv[1]
+
+run_worker(queue_path=get_work_queue_path(suite_folder_path))
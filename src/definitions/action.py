@@ -31,63 +31,63 @@ class AAIActions:
             "noop",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[0, 0]], dtype=np.int32),
+                discrete=np.tile(np.array([[0, 0]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.LEFT = AAIAction(
             "left",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[0, 2]], dtype=np.int32),
+                discrete=np.tile(np.array([[0, 2]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.RIGHT = AAIAction(
             "right",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[0, 1]], dtype=np.int32),
+                discrete=np.tile(np.array([[0, 1]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.FORWARDS = AAIAction(
             "forwards",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[1, 0]], dtype=np.int32),
+                discrete=np.tile(np.array([[1, 0]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.FORWARDSLEFT = AAIAction(
             "forwards&left",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[1, 2]], dtype=np.int32),
+                discrete=np.tile(np.array([[1, 2]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.FORWARDSRIGHT = AAIAction(
             "forwards&right",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[1, 1]], dtype=np.int32),
+                discrete=np.tile(np.array([[1, 1]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.BACKWARDS = AAIAction(
             "backwards",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[2, 0]], dtype=np.int32),
+                discrete=np.tile(np.array([[2, 0]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.BACKWARDSLEFT = AAIAction(
             "backwards&left",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[2, 2]], dtype=np.int32),
+                discrete=np.tile(np.array([[2, 2]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.BACKWARDSRIGHT = AAIAction(
             "backwards&right",
             ActionTuple(
                 continuous=np.zeros((no_agents, 0)),
-                discrete=np.array([[2, 1]], dtype=np.int32),
+                discrete=np.tile(np.array([[2, 1]], dtype=np.int32), (no_agents, 1)),
             ),
         )
         self.allActions: list = [
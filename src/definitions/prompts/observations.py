@@ -6,6 +6,22 @@ IN_SESSION_MSG_TO_LLM = create_in_session_reward_text
 
 YIELD_OBS_MESSAGE = "Environment observation captured:"
 
+# Sent instead of an observation that looks the same as the previous one
+OBSERVATION_UNCHANGED_MESSAGE = " (unchanged since the previous observation)"
+
+
+def create_multi_frame_observation_text(num_frames: int) -> str:
+    return (f"Each observation shows {num_frames} consecutive frames side by side, from the oldest on the left to the "
+            f"most recent on the right.")
+
+
+MULTI_FRAME_OBSERVATION_PROMPT = create_multi_frame_observation_text
+
 PREVIOUS_RESPONSE_IS_INVALID = ("ENVIRONMENT: Your previous response is invalid. Remember to use commands from "
                                 "the scripting language only. You won't move until you do but your health will keep "
-                                "decreasing! ")
\ No newline at end of file
+                                "decreasing! ")
+# Sent instead when some commands of a streamed response (see the stream_actions option) were carried out as they
+# arrived, before the invalid part of the response did
+PREVIOUS_RESPONSE_IS_PARTLY_INVALID = ("ENVIRONMENT: Your previous response is invalid. The commands before its first "
+                                       "invalid one were carried out, the rest of it was not. Remember to use commands "
+                                       "from the scripting language only. ")
\ No newline at end of file
@@ -101,6 +101,21 @@ N_SHOT = {
     "character_prefix": lambda name: f"{name}: ",
 }
 
+def create_compaction_summary_request(level_outcomes: list[str]) -> str:
+    return ("Summarise the levels you have played so far for your own future reference, as your memory of them is about "
+            "to be replaced by this summary. For each level, give its outcome, the reward you garnered and what you "
+            "learnt, quoting the scripts that worked. Be concise. The outcomes of the levels were:\n"
+            + "\n".join(level_outcomes))
+
+
+COMPACTION = {
+    "summary_request": create_compaction_summary_request,
+    "level_outcome": lambda level_name, total_reward, ep_pass: (
+        f"- {level_name}: {'passed' if ep_pass else 'failed'} with a reward of {total_reward:.2f}"
+    ),
+    "summary_prefix": "Here is your own summary of the levels you have played so far:\n",
+}
+
 RESPONSE_PREFIX = "PLAYER:"
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from animalai.environment import AnimalAIEnvironment
+from mlagents_envs.exception import UnityException
+
+import user_settings
+from src.environment.ports import PortAllocator
+
+# Environments can only be shared between arenas which would have launched them identically
+EnvironmentKey = Tuple[int, int, bool, bool]  # (resolution, seed, play, inference)
+
+
+class EnvironmentManager:
+    """Hands out AnimalAIEnvironment instances for arena runs.
+
+    Note:
+    - With reuse enabled, one environment is kept alive per (resolution, seed, play, inference) and the next arena
+      config is swapped in with a reset rather than relaunching Unity. A relaunch only happens if the environment crashed.
+    - Environments are returned ready to be queried, i.e. the first step (which is a reset) has already been taken.
+    - Resetting does not re-seed the environment, so randomised arenas are not identical to a relaunch-per-arena run.
+    - Without reuse, the environment for the next arena can be launched in the background (see prewarm) while the
+      current arena is running.
+    - The base port passed in is a starting point: the first port not leased by any environment on this machine (see
+      PortAllocator) is taken. Closing an environment only returns once its port can be bound again.
+    """
+
+    def __init__(self, reuse: bool = False) -> None:
+        self._reuse = reuse
+        self._idle_environments: Dict[EnvironmentKey, AnimalAIEnvironment] = {}
+        self._environment_keys: Dict[int, EnvironmentKey] = {}
+        self._environment_ports: Dict[int, int] = {}
+        self._port_allocator = PortAllocator()
+        self._prewarmed_environments: Dict[Tuple[EnvironmentKey, str], Future] = {}
+        self._launcher = ThreadPoolExecutor(max_workers=1)
+
+    def acquire(self,
+                config_path: str,
+                seed: int,
+                play: bool,
+                inference: bool,
+                resolution: int,
+                base_port: int,
+                ) -> AnimalAIEnvironment:
+        key = (resolution, seed, play, inference)
+        prewarmed_environment = self._prewarmed_environments.pop((key, config_path), None)
+        if prewarmed_environment is not None:
+            try:
+                env = prewarmed_environment.result()
+                self._environment_keys[id(env)] = key
+                return env
+            except Exception:
+                print("Failed to prewarm the environment, launching it again")
+                print(traceback.format_exc())
+
+        env = self._idle_environments.pop(key, None)
+        if env is not None:
+            try:
+                env.reset(arenas_configurations=config_path)
+                self._environment_keys[id(env)] = key
+                return env
+            except UnityException:
+                print("Failed to reset the environment, relaunching it")
+                print(traceback.format_exc())
+                self._close(env)
+
+        env = self._launch(config_path, seed, play, inference, resolution, base_port)
+        self._environment_keys[id(env)] = key
+        return env
+
+    def prewarm(self,
+                config_path: str,
+                seed: int,
+                play: bool,
+                inference: bool,
+                resolution: int,
+                base_port: int,
+                ) -> None:
+        """Starts launching the environment for an upcoming arena in the background; acquire picks it up."""
+        key = (resolution, seed, play, inference)
+        if self._reuse or (key, config_path) in self._prewarmed_environments:
+            # A reused environment will be reset into the next arena instead
+            return
+        self._prewarmed_environments[(key, config_path)] = self._launcher.submit(
+            self._launch, config_path, seed, play, inference, resolution, base_port
+        )
+
+    def release(self, env: AnimalAIEnvironment, healthy: bool = True) -> None:
+        """Hands an environment back once its arena is over; unhealthy environments are always closed."""
+        key = self._environment_keys.pop(id(env))
+        if self._reuse and healthy and key not in self._idle_environments:
+            self._idle_environments[key] = env
+        else:
+            self._close(env)
+
+    def close_all(self) -> None:
+        while self._prewarmed_environments:
+            _, prewarmed_environment = self._prewarmed_environments.popitem()
+            if prewarmed_environment.exception() is None:
+                self._close(prewarmed_environment.result())
+        while self._idle_environments:
+            _, env = self._idle_environments.popitem()
+            self._close(env)
+
+    def _launch(self,
+                config_path: str,
+                seed: int,
+                play: bool,
+                inference: bool,
+                resolution: int,
+                base_port: int,
+                ) -> AnimalAIEnvironment:
+        port = self._port_allocator.lease(base_port)
+        try:
+            env = AnimalAIEnvironment(
+                file_name=user_settings.ENV_PATH,
+                arenas_configurations=config_path,
+                seed=seed,
+                play=play,
+                inference=inference,
+                log_folder=user_settings.LOG_FOLDER,
+                base_port=port,
+                resolution=resolution,
+            )
+        except Exception:
+            self._port_allocator.release(port)
+            raise
+        self._environment_ports[id(env)] = port
+        try:
+            env.step()  # Need to make a first step in order to get an observation.
+        except Exception:
+            self._close(env)
+            raise
+        return env
+
+    def _close(self, env: AnimalAIEnvironment) -> None:
+        try:
+            env.close()
+        except UnityException:
+            print(traceback.format_exc())
+        finally:
+            port = self._environment_ports.pop(id(env), None)
+            if port is not None:
+                self._port_allocator.release(port)
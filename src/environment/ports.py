@@ -0,0 +1,144 @@
+import os
+import socket
+import sys
+import tempfile
+import time
+from os.path import join
+
+DEFAULT_LEASE_FOLDER_PATH = join(tempfile.gettempdir(), "llm_aai_port_leases")
+MAX_PORTS_SEARCHED = 1000
+
+
+class PortAllocator:
+    """Leases ports for AnimalAIEnvironment instances across every process on this machine.
+
+    Note:
+    - A lease is a file named after the port, created exclusively, so two processes can never hold the same port.
+    - A port is only leased if it can also be bound, using the same check as mlagents does before launching Unity.
+    - Leases left behind by processes that died are reclaimed, by one process at a time (see _reclaim_lease).
+    """
+
+    def __init__(self, lease_folder_path: str = DEFAULT_LEASE_FOLDER_PATH) -> None:
+        self._lease_folder_path = lease_folder_path
+        os.makedirs(self._lease_folder_path, exist_ok=True)
+
+    def lease(self, base_port: int) -> int:
+        """Returns the first free port from base_port upwards, which is reserved until released."""
+        for port in range(base_port, base_port + MAX_PORTS_SEARCHED):
+            if not self._try_create_lease(port):
+                continue
+            if is_port_free(port):
+                return port
+            # Something outside of this allocator is using the port
+            self._remove_lease(port)
+        raise RuntimeError(f"No free port found in [{base_port}, {base_port + MAX_PORTS_SEARCHED})")
+
+    def release(self, port: int, timeout: float = 30, poll_interval: float = 0.1) -> bool:
+        """Waits for the port's socket to be freed (e.g. after env.close()) and gives up the lease.
+
+        Returns whether the port was seen to be free before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        released = is_port_free(port)
+        while not released and time.monotonic() < deadline:
+            time.sleep(poll_interval)
+            released = is_port_free(port)
+        if not released:
+            print(f"Port {port} was still in use {timeout}s after its environment was closed")
+        # Lease checks that the port can be bound anyway, so never hold on to a lease that is not needed any more
+        self._remove_lease(port)
+        return released
+
+    def _try_create_lease(self, port: int) -> bool:
+        if self._create_file_exclusively(self._get_lease_path(port)):
+            return True
+        return self._is_lease_stale(port) and self._reclaim_lease(port)
+
+    def _reclaim_lease(self, port: int) -> bool:
+        """Replaces a stale lease with this process's, holding the port's reclaim lock so that, of the processes that
+        found the lease stale, only the first takes the port.
+
+        The lock is only held while the lease is replaced; a process that dies in that moment leaves the port skipped
+        until its .reclaim file is deleted.
+        """
+        reclaim_lock_path = self._get_lease_path(port) + ".reclaim"
+        if not self._create_file_exclusively(reclaim_lock_path):
+            # Another process is reclaiming the lease
+            return False
+        try:
+            # Another process may have reclaimed the lease since it was found to be stale
+            if not self._is_lease_stale(port):
+                return False
+            self._remove_lease(port)
+            return self._create_file_exclusively(self._get_lease_path(port))
+        finally:
+            os.remove(reclaim_lock_path)
+
+    @staticmethod
+    def _create_file_exclusively(path: str) -> bool:
+        """Creates the file with this process's pid in it, unless it already exists."""
+        try:
+            file_descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(file_descriptor, "w") as file:
+            file.write(str(os.getpid()))
+        return True
+
+    def _is_lease_stale(self, port: int) -> bool:
+        try:
+            with open(self._get_lease_path(port), "r") as lease_file:
+                pid = int(lease_file.read())
+        except FileNotFoundError:
+            # Released in the meantime
+            return True
+        except ValueError:
+            # The owner has created the file but not written its pid yet
+            return False
+        return not is_process_alive(pid)
+
+    def _remove_lease(self, port: int) -> None:
+        try:
+            os.remove(self._get_lease_path(port))
+        except FileNotFoundError:
+            pass
+
+    def _get_lease_path(self, port: int) -> str:
+        return join(self._lease_folder_path, f"{port}.lease")
+
+
+def is_port_free(port: int) -> bool:
+    # Mirrors mlagents_envs.rpc_communicator.RpcCommunicator.check_port
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("localhost", port))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def is_process_alive(pid: int) -> bool:
+    if sys.platform == "win32":
+        # os.kill would terminate the process on Windows
+        import ctypes
+        process_query_limited_information = 0x1000
+        still_active = 259
+        handle = ctypes.windll.kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == still_active
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
@@ -1,5 +1,12 @@
+import threading
 from abc import abstractmethod, ABC
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+
+class ArenaJobStopped(Exception):
+    """Raised by a unit of work that was asked to stop (e.g. its work item was leased to another worker), which then
+    neither records its result nor writes its outputs."""
+    pass
 
 
 class Experiment(ABC):
@@ -7,5 +14,27 @@ class Experiment(ABC):
         self.options = options
 
     @abstractmethod
-    def run(self) -> None:
+    def run(self, stop_event: Optional[threading.Event] = None) -> None:
+        pass
+
+    @abstractmethod
+    def get_arena_job_indices(self) -> List[int]:
+        """Lists the independent units of work of this experiment, for the work-queue scheduler."""
+        pass
+
+    @abstractmethod
+    def run_arena_job(self,
+                      job_index: int,
+                      environment_manager,
+                      stop_event: Optional[threading.Event] = None,
+                      ) -> Tuple[float, str]:
+        """Runs one unit of work listed by get_arena_job_indices and returns its (total reward, episode end reason).
+
+        Once the stop event is set, the unit of work raises ArenaJobStopped.
+        """
+        pass
+
+    @abstractmethod
+    def save_arena_results(self) -> None:
+        """Exports the results that the units of work recorded, once all of them have finished."""
         pass
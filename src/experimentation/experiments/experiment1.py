@@ -1,18 +1,23 @@
-import pickle
+import base64
+import math
 from os import listdir
 from os.path import isfile, join
-from typing import Dict, List, Literal, Union
+from typing import Dict, List, Literal, Optional, Union
 import os
+import threading
+import time
 import traceback
 import random
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
 
 import numpy as np
 import yaml
 from animalai.environment import AnimalAIEnvironment
 
-import user_settings
 from src.definitions.prompts.observations import IN_SESSION_MSG_TO_LLM, YIELD_OBS_MESSAGE, \
-    PREVIOUS_RESPONSE_IS_INVALID
+    PREVIOUS_RESPONSE_IS_INVALID, PREVIOUS_RESPONSE_IS_PARTLY_INVALID
 from src.definitions.prompts.prompts import (
     CHAINS_OF_THOUGHT,
     COMMANDS,
@@ -21,22 +26,36 @@ from src.definitions.prompts.prompts import (
     OBSERVATIONS,
     PREAMBLES,
     create_background_prompt,
-    NUM_INITIAL_OBS, N_SHOT,
+    NUM_INITIAL_OBS, N_SHOT, COMPACTION,
 )
-from src.experimentation.experiments.experiment import Experiment
-from src.llm_scripting.minimal_parser import minimal_parser, YIELD_OBS, ActionTuple
-from src.llms.llm import PromptElement, PROMPT_CONTENTS
+from src.environment.env_manager import EnvironmentManager
+from src.experimentation.experiments.experiment import ArenaJobStopped, Experiment
+from src.experimentation.results_store import ArenaResult, ResultsStore, RESULTS_STORE_FILE_NAME, RESULT_FILE_NAMES
+from src.experimentation.work_queue import WHOLE_EXPERIMENT_JOB_INDEX
+from src.llm_scripting.minimal_parser import minimal_parser, YIELD_OBS, ActionTuple, IncrementalParser
+from src.llms.client_pool import HttpClientSettings, configure_client_pool
+from src.llms.hedging import HedgedSession, LatencyTracker, SECONDARY_REPLICA
+from src.llms.history import HistoryPolicy
+from src.llms.llm import PromptElement, PROMPT_CONTENTS, LLMSession, HISTORY_FILE_NAME_PREFIX
 from src.llms.human import \
     LLMMessageParam
-from src.llms.llm_to_api_key import llm_to_api_key
+from src.llms.llm_to_api_key import hedge_api_key, llm_to_api_key
+from src.llms.rate_limiter import DEFAULT_RATE_LIMIT_STATE_FOLDER_PATH, RateLimitedSession, RateLimiter
+from src.llms.response_cache import CachedSession, ResponseCache
 from src.llms.session_factory import LLMSessionFactory
-from src.utilities.utils import get_change_in_total_reward, populate_csv, try_mkdir, check_episode_pass
+from src.utilities.background_writer import BackgroundWriter
+from src.utilities.observation_store import ObservationStore, OBSERVATION_STORE_FOLDER_NAME, \
+    OBSERVATION_INDEX_FILE_NAME, OBSERVATION_INDEX_COLUMN_LABELS, load_history_file
+from src.utilities.utils import get_change_in_total_reward, populate_csv, try_mkdir, check_episode_pass, \
+    get_arena_time_limit
 from src.vision.camera import CameraSystem
+from src.vision.compression import DEFAULT_JPEG_QUALITY, ObservationCompressor
 from src.definitions.cardinal_directions import action_name_to_action_tuple
 from mlagents_envs.base_env import (
     DecisionSteps,
     TerminalSteps,
 )
+from mlagents_envs.exception import UnityException
 from src.definitions.constants import FRAMES_BETWEEN_OBS
 
 EpisodeEndReasons = Literal[
@@ -46,9 +65,27 @@ EpisodeEndReasons = Literal[
     "REASON_UNKNOWN",
     "MESSAGE_PARSING_ERROR"
 ]
+EPISODE_END_FAILURE_REASONS: Dict[EpisodeEndReasons, str] = {
+    "NON_ZERO_TERMINAL_REWARD": "Failure reason: Ran out of health.\n",
+    "CONVERSATION_TURNS_EXCEEDED": "Failure reason: No more scripts can be sent this level.\n",
+}
 ARENA_LOOP_SUFFIX = lambda loop: f"_loop_{loop}"
 MESSAGE_PARSING_ERROR_MESSAGE = "Parsing response fails: "
 
+# Each arena worker process keeps its own environments alive between the arenas it runs (see _init_arena_worker)
+_worker_environment_manager: Optional[EnvironmentManager] = None
+
+
+def _init_arena_worker(reuse_environment: bool) -> None:
+    global _worker_environment_manager
+    _worker_environment_manager = EnvironmentManager(reuse=reuse_environment)
+    # Pool workers do not run atexit handlers on shutdown, but they do run multiprocessing finalizers
+    Finalize(None, _worker_environment_manager.close_all, exitpriority=10)
+
+
+def _run_arena_job_in_worker(experiment: "Experiment1", job_index: int) -> tuple[float, "EpisodeEndReasons"]:
+    return experiment.run_arena_job(job_index, _worker_environment_manager)
+
 
 def append_text_to_prompt(prompt: PROMPT_CONTENTS, text: str) -> PROMPT_CONTENTS:
     """Append a string to the prompt
@@ -86,233 +123,735 @@ class Experiment1(Experiment):
             output_dir=self.options["output_folder_path"]
         )
 
-        # Initialise result arrays
-        self._arena_names = np.array([])
-        self._episode_rewards = np.array([])
-        self._episode_end_reasons = np.array([])
+        # Suites share one store between their experiments; a standalone experiment keeps its own
+        self._results_store = ResultsStore(self.options.get(
+            "results_store_path", join(self.options["output_folder_path"], RESULTS_STORE_FILE_NAME)
+        ))
+
+        # Results of a previous run of this experiment, if the suite is being resumed
+        self._previous_results = self._load_previous_results() if self.options.get("resume_from") is not None else {}
 
-    def run(self) -> None:
+        self._max_parallel_arenas = self.options.get("max_parallel_arenas", 1)
+        self._reuse_environment = self.options.get("reuse_environment", False)
+        self._prewarm_next_environment = self.options.get("prewarm_next_environment", False)
+
+        self._stream_actions = self.options.get("stream_actions", False)
+        # Observations, histories and cost arrays are written on a background thread, which keeps writing the turn's
+        # observations while the LLM is being prompted
+        self._background_writer: Optional[BackgroundWriter] = (
+            BackgroundWriter() if self.options.get("background_writes", False) else None
+        )
+        # Suites share one store between their experiments; a standalone experiment keeps its own
+        self._observation_store: Optional[ObservationStore] = ObservationStore(self.options.get(
+            "observation_store_path", join(self.options["output_folder_path"], OBSERVATION_STORE_FOLDER_NAME)
+        )) if self.options.get("deduplicate_observations", False) else None
+        self._response_cache: Optional[ResponseCache] = ResponseCache(
+            self.options["response_cache_path"],
+            max_size_bytes=self.options.get("response_cache_max_megabytes", 1024) * 2 ** 20,
+        ) if self.options.get("response_cache_mode", "bypass") != "bypass" else None
+        # Kept across the experiment's sessions, so that each one hedges from the latencies seen so far
+        self._latency_tracker: Optional[LatencyTracker] = LatencyTracker(
+            percentile=self.options.get("hedge_latency_percentile", 95),
+            initial_deadline_seconds=self.options.get("hedge_initial_deadline_seconds", 30),
+        ) if self.options.get("hedge_requests", False) else None
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> None:
+        stopped = False
+        try:
+            if self._max_parallel_arenas > 1:
+                self._run_arenas_in_parallel()
+                return
+
+            vision_system = self._create_vision_system()
+            background_prompt = self._create_background_prompt(vision_system)
+
+            environment_manager = EnvironmentManager(reuse=self._reuse_environment)
+            try:
+                self._run_arenas_sequentially(background_prompt, vision_system, environment_manager, stop_event)
+            finally:
+                environment_manager.close_all()
+        except ArenaJobStopped:
+            stopped = True
+            raise
+        finally:
+            # Results are appended to the store as arenas finish; the .npy files are only written once
+            if not stopped:
+                self.save_arena_results()
+            self._close_background_writer()
+
+    def _run_arenas_sequentially(self,
+                                 background_prompt: str,
+                                 vision_system: CameraSystem,
+                                 environment_manager: EnvironmentManager,
+                                 stop_event: Optional[threading.Event] = None,
+                                 ) -> None:
         session = self._get_llm_session()
         history_index = 0
-        vision_system = CameraSystem()
+        message: PROMPT_CONTENTS = self._create_initial_message(background_prompt)
 
-        background_prompt = create_background_prompt(
-            preamble=PREAMBLES[self.options["preamble"]],
-            observation=vision_system.observation_prompt,  # TODO: see discussion in VisionSystem.
-            goal=GOALS[self.options["goal"]],
-            commands=COMMANDS[self.options["commands"]](self.options["max_conversation_turns"]),
-            chain_of_thought=CHAINS_OF_THOUGHT[self.options["chain_of_thought"]],
-            misc=MISC[self.options["misc"]],
-        )
+        jobs = self._get_arena_jobs()
+        completed_results = self._get_completed_results()
+        job_indices_to_run = [job_index for job_index in range(len(jobs)) if job_index not in completed_results]
+        resumed_history_path: Optional[str] = None
+        # The arenas in the session's history, to be summarised when it is compacted
+        uncompacted_arenas: List[tuple[str, ArenaResult]] = []
+        for job_index, (loop_index, config_index, config_path) in enumerate(jobs):
+            if job_index in completed_results:
+                if self.options["verbose"]:
+                    print(f"Skipping {config_path}, which was completed by a previous run")
+                if self.options["learn_across_arenas"]:
+                    uncompacted_arenas.append((config_path, completed_results[job_index]))
+                    resumed_history_path = self._get_latest_history_path(
+                        self._get_config_output_path(config_path, loop_index)
+                    )
+                    message = self._append_end_of_episode_message([],
+                                                                  completed_results[job_index].total_reward,
+                                                                  config_path,
+                                                                  completed_results[job_index].episode_end_reason)
+                continue
 
-        message: PROMPT_CONTENTS = self._create_initial_message(background_prompt)
-        episode_end_reason: EpisodeEndReasons = "REASON_UNKNOWN"
+            if not self.options["learn_across_arenas"]:
+                message = self._create_initial_message(background_prompt)
+                session = self._get_llm_session()
+                history_index = 0
+            elif resumed_history_path is not None:
+                # Pick the conversation up where the last completed arena left it
+                session.load_from_history_file(resumed_history_path)
+                history_index = len(session.history)
+                resumed_history_path = None
+
+            next_job_indices = [next_job_index for next_job_index in job_indices_to_run if next_job_index > job_index]
+            if self._prewarm_next_environment and len(next_job_indices) > 0:
+                _, next_config_index, next_config_path = jobs[next_job_indices[0]]
+                environment_manager.prewarm(
+                    config_path=next_config_path,
+                    **self._get_environment_kwargs(port_offset=next_config_index),
+                )
 
-        for loop_index in range(self.options["num_arena_loops"]):
-            for config_index, config_path in enumerate(self._arena_config_paths):
-                config_name = os.path.basename(config_path).split(".")[-2]
+            message, result = self._run_arena(
+                session=session,
+                message=message,
+                vision_system=vision_system,
+                environment_manager=environment_manager,
+                job_index=job_index,
+                history_index=history_index,
+                stop_event=stop_event,
+            )
+            history_index = len(session.history)
+            self._results_store.append(self.options["output_folder_path"], result)
+            uncompacted_arenas.append((config_path, result))
 
-                # Only add a suffix to the arena folder name if there is more than one loop to perform over the arenas.
-                if self.options["num_arena_loops"] > 1:
-                    config_output_path = join(
-                        self.options["output_folder_path"],
-                        config_name + ARENA_LOOP_SUFFIX(loop_index),
-                    )
-                else:
-                    config_output_path = join(
-                        self.options["output_folder_path"], config_name
-                    )
-                try_mkdir(config_output_path)
+            if (self.options["learn_across_arenas"] and len(next_job_indices) > 0
+                    and self._should_compact_history(session)):
+                message = self._compact_history(session, background_prompt, uncompacted_arenas, job_index)
+                history_index = 0
+                uncompacted_arenas = []
 
-                if self.options["verbose"]:
-                    print(f"Starting to solve: {config_path}")
-
-                if not self.options["learn_across_arenas"]:
-                    message = self._create_initial_message(background_prompt)
-                    session = self._get_llm_session()
-                    history_index = 0
-                env = AnimalAIEnvironment(
-                    file_name=user_settings.ENV_PATH,
-                    arenas_configurations=config_path,
-                    seed=self.options["aai_seeds"],
-                    play=self.options["play"],
-                    inference=self.options["watch_agent_interact"],
-                    log_folder=user_settings.LOG_FOLDER,
-                    base_port=5005 + (self.options["aai_seeds"] % 100) + config_index,
-                    resolution=self.options["resolution"]
+            # TODO: Discuss whether this is the best way.
+            if not self.options["learn_across_arenas"] and config_index == len(self._arena_config_paths) - 1:
+                session.write_to_file(path=self.options["output_folder_path"],
+                                      writer=self._background_writer,
+                                      observation_store=self._observation_store)
+
+    def _should_compact_history(self, session: LLMSession) -> bool:
+        compaction_token_threshold = self.options.get("compaction_token_threshold")
+        if compaction_token_threshold is None or len(session.input_costs) == 0:
+            return False
+        return session.last_request_input_tokens >= compaction_token_threshold
+
+    def _compact_history(self,
+                         session: LLMSession,
+                         background_prompt: str,
+                         arenas: List[tuple[str, ArenaResult]],
+                         job_index: int,
+                         ) -> PROMPT_CONTENTS:
+        """Replaces the session's history by a summary of its arenas and returns the message to carry on with.
+
+        Note:
+        - The summary is written by compaction_llm_model (by default the session's own model), from a copy of the
+          history without its images.
+        - Every arena's raw history is already on disk; the summary's own history and costs are written to
+          compaction-<job index>/ in the experiment folder.
+        - The summary replaces the end of episode message of the last arena, whose outcome it includes.
+        """
+        llm_family = self.options["llm_family"] if self.options["llm_family_switch"] is None \
+            else self.options["llm_family_switch"]
+        llm_model = self.options["llm_model"] if self.options["llm_family_switch"] is None \
+            else self.options["llm_model_switch"]
+        summary_llm_model = self.options.get("compaction_llm_model") or llm_model
+        summary_session = self._limit_rate(
+            LLMSessionFactory.create_llm_session(name=llm_family, api_key=self._api_key, model=summary_llm_model),
+            llm_family=llm_family,
+            llm_model=summary_llm_model,
+        )
+        summary_session.reset_history(session.history)
+        summary_session.set_history_policy(HistoryPolicy(max_images=0))
+        level_outcomes = [
+            COMPACTION["level_outcome"](self._get_config_name(config_path),
+                                        result.total_reward,
+                                        check_episode_pass(result.total_reward, config_path, 0))
+            for config_path, result in arenas
+        ]
+        if self.options["verbose"]:
+            print(f"Compacting the history of {len(arenas)} arenas, after {session.last_request_input_tokens} input tokens")
+        summary = summary_session.prompt([(PromptElement.Text, COMPACTION["summary_request"](level_outcomes))])
+
+        compaction_output_path = join(self.options["output_folder_path"], f"compaction-{job_index}")
+        try_mkdir(compaction_output_path)
+        summary_session.write_to_file(
+            path=f"{compaction_output_path}/",
+            write_from_index=len(session.history),
+            writer=self._background_writer,
+            observation_store=self._observation_store,
+        )
+        summary_session.save_cost_arrays(cost_folder_path=compaction_output_path, writer=self._background_writer)
+
+        session.reset_history()
+        return append_text_to_prompt(self._create_initial_message(background_prompt),
+                                     COMPACTION["summary_prefix"] + summary)
+
+    def get_arena_job_indices(self) -> List[int]:
+        if self.options["learn_across_arenas"]:
+            # The arenas share one conversation, so they must be run in order by the same process
+            return [WHOLE_EXPERIMENT_JOB_INDEX]
+        return list(range(len(self._get_arena_jobs())))
+
+    def run_arena_job(self,
+                      job_index: int,
+                      environment_manager: EnvironmentManager,
+                      stop_event: Optional[threading.Event] = None,
+                      ) -> tuple[float, EpisodeEndReasons]:
+        """Runs a single arena with a fresh llm session and appends its result to the results store."""
+        completed_results = self._get_completed_results()
+        if job_index in completed_results:
+            return completed_results[job_index].total_reward, completed_results[job_index].episode_end_reason
+        vision_system = self._create_vision_system()
+        session = self._get_llm_session()
+        try:
+            _, result = self._run_arena(
+                session=session,
+                message=self._create_initial_message(self._create_background_prompt(vision_system)),
+                vision_system=vision_system,
+                environment_manager=environment_manager,
+                job_index=job_index,
+                history_index=0,
+                stop_event=stop_event,
+            )
+            # As in the sequential case, the last arena's history is also written to the experiment folder
+            _, config_index, _ = self._get_arena_jobs()[job_index]
+            if config_index == len(self._arena_config_paths) - 1:
+                session.write_to_file(path=self.options["output_folder_path"],
+                                      writer=self._background_writer,
+                                      observation_store=self._observation_store)
+        finally:
+            self._close_background_writer()
+        self._results_store.append(self.options["output_folder_path"], result)
+        return result.total_reward, result.episode_end_reason
+
+    def save_arena_results(self) -> None:
+        self._results_store.export_npy(self.options["output_folder_path"], self._result_folder_path)
+
+    def _run_arenas_in_parallel(self) -> None:
+        """Runs independent arenas (i.e. learn_across_arenas is false) in a pool of worker processes.
+
+        Note:
+        - Every arena run gets its own environment, llm session and output folder, exactly as in the sequential case.
+        - Workers append their results to the store as they finish; the store keys them by job index, so the exported
+          result arrays are in the same (deterministic) arena order as the sequential case.
+        """
+        completed_results = self._get_completed_results()
+        with ProcessPoolExecutor(max_workers=self._max_parallel_arenas,
+                                 initializer=_init_arena_worker,
+                                 initargs=(self._reuse_environment,)) as executor:
+            futures = [
+                executor.submit(_run_arena_job_in_worker, self, job_index)
+                for job_index in range(len(self._get_arena_jobs())) if job_index not in completed_results
+            ]
+            for future in futures:
+                # Surface the first failure, as the sequential case would
+                future.result()
+
+    def _run_arena(self,
+                   session: LLMSession,
+                   message: PROMPT_CONTENTS,
+                   vision_system: CameraSystem,
+                   environment_manager: EnvironmentManager,
+                   job_index: int,
+                   history_index: int,
+                   stop_event: Optional[threading.Event] = None,
+                   ) -> tuple[PROMPT_CONTENTS, ArenaResult]:
+        """Runs a single episode in the arena of the given job.
+
+        Returns the message to carry over to the next arena and the result of the arena run. Once the stop event is
+        set, ArenaJobStopped is raised before the next prompt, without writing the arena's history and costs.
+        """
+        loop_index, config_index, config_path = self._get_arena_jobs()[job_index]
+        config_output_path = self._get_config_output_path(config_path, loop_index)
+        try_mkdir(config_output_path)
+
+        if self.options["verbose"]:
+            print(f"Starting to solve: {config_path}")
+        # The first observation of every episode is always sent
+        vision_system.reset()
+        session.mark_arena_start()
+
+        start_time = time.monotonic()
+        input_tokens_before = int(np.sum(session.input_costs))
+        output_tokens_before = int(np.sum(session.output_costs))
+        total_reward = 0
+        episode_end_reason: EpisodeEndReasons = "REASON_UNKNOWN"
+        # The number of times the LLM has been prompted
+        turn = 0
+        env_healthy = True
+        stopped = False
+        env = environment_manager.acquire(
+            config_path=config_path,
+            **self._get_environment_kwargs(port_offset=config_index),
+        )
+        try:
+            behavior = list(env.behavior_specs.keys())[0]
+            if len(session.history) == 0:
+                # The message opens the conversation, so its blocks so far are the initial message that the other
+                # arenas' conversations start with too. Its last block is only ever extended by fixed text before
+                # the first observation's image.
+                session.set_prompt_caching(session.prompt_caching, shared_prefix_length=len(message))
+            message = append_text_to_prompt(message, MISC["send_off_with_start_of_episode_message"])
+            dec, term = env.get_steps(behavior)
+            total_reward = get_change_in_total_reward(dec,term)
+            if len(term.reward) > 0:
+                raise RuntimeError("Episode unexpectedly ended before taking any actions")
+            message, done, change_total_reward = self._update_message_with_obs(
+                message,
+                env,
+                vision_system,
+                f"{config_output_path}/obs-{0}.{0}.jpg",
+                behavior
+            )
+            total_reward += change_total_reward
+            if done:
+                raise RuntimeError("Episode unexpectedly ended during initial obs")
+            # Add any additional initial obs
+            for i in range(1, NUM_INITIAL_OBS):
+                message, done, change_total_reward = self._update_message_with_obs(
+                    message,
+                    env,
+                    vision_system,
+                    f"{config_output_path}/obs-{0}.{i}.jpg",
+                    behavior
                 )
-                try:
-                    behavior = list(env.behavior_specs.keys())[0]
-                    env.step()  # Need to make a first step in order to get an observation.
-                    message = append_text_to_prompt(message, MISC["send_off_with_start_of_episode_message"])
-                    dec, term = env.get_steps(behavior)
-                    total_reward = get_change_in_total_reward(dec,term)
-                    if len(term.reward) > 0:
-                        raise RuntimeError("Episode unexpectedly ended before taking any actions")
-                    message, done, change_total_reward = self._update_message_with_obs(
-                        message,
-                        env,
-                        vision_system,
-                        f"{config_output_path}/obs-{0}.{0}.jpg",
-                        behavior
-                    )
-                    total_reward += change_total_reward
-                    if done:
-                        raise RuntimeError("Episode unexpectedly ended during initial obs")
-                    # Add any additional initial obs
-                    for i in range(1, NUM_INITIAL_OBS):
+                total_reward += change_total_reward
+            if done:
+                raise RuntimeError("Episode ended unexpectedly immediately after initial obs")
+            done = False
+
+            while not done and turn < self.options["max_conversation_turns"]:
+                if stop_event is not None and stop_event.is_set():
+                    raise ArenaJobStopped(f"Stopped {config_path} before turn {turn}")
+                message = append_text_to_prompt(message,
+                                                IN_SESSION_MSG_TO_LLM(env.get_obs_dict(dec.obs)["health"],
+                                                                      self.options[
+                                                                          "max_conversation_turns"] - turn))
+                if self.options["manually_prompt_llm"]:
+                    input("Keep prompting LLM API?")
+                if self._stream_actions:
+                    # Commands are stepped as soon as they have streamed in, while the rest of the response streams
+                    parser = IncrementalParser()
+                    num_streamed_actions = 0
+                    for chunk in session.stream_prompt(message):
+                        for action in parser.feed(chunk):
+                            num_streamed_actions += 1
+                            # Once the episode is done, the response is still read to the end for the history
+                            if not done:
+                                dec, done, change_total_reward = self._step_action(env, behavior, action)
+                                total_reward += change_total_reward
+                    response = parser.script
+                    ok, actions = parser.finish()
+                else:
+                    response = session.prompt(message)
+                    ok, actions = minimal_parser(response)
+                    num_streamed_actions = 0
+                if self.options["verbose"]:
+                    print(f"LLM response: {response}")
+                # Reset the message since we've used its contents
+                message = []
+                turn += 1
+
+                if not ok:
+                    print(MESSAGE_PARSING_ERROR_MESSAGE+response)
+                    message = append_text_to_prompt(message, PREVIOUS_RESPONSE_IS_INVALID if num_streamed_actions == 0
+                                                    else PREVIOUS_RESPONSE_IS_PARTLY_INVALID)
+                    actions = [action_name_to_action_tuple["NOOP"]]
+                # Widen the type definition of actions to include YIELD_OBS()
+                actions: List[Union[ActionTuple, YIELD_OBS]]
+                # Always end in an observation
+                actions.append(YIELD_OBS())
+                i = -1
+                while not done and len(actions) > 0:
+                    i += 1
+                    action = actions.pop(0)
+                    if action == YIELD_OBS():
                         message, done, change_total_reward = self._update_message_with_obs(
                             message,
                             env,
                             vision_system,
-                            f"{config_output_path}/obs-{0}.{i}.jpg",
-                            behavior
+                            f"{config_output_path}/obs-{turn}.{i}.jpg",
+                            behavior,
+                            # Don't wait on the final timestep
+                            len(actions) > 0
                         )
                         total_reward += change_total_reward
-                    if done:
-                        raise RuntimeError("Episode ended unexpectedly immediately after initial obs")
-                    done = False
-                    # The number of times the LLM has been prompted
-                    turn = 0
-
-                    while not done and turn < self.options["max_conversation_turns"]:
-                        message = append_text_to_prompt(message,
-                                                        IN_SESSION_MSG_TO_LLM(env.get_obs_dict(dec.obs)["health"],
-                                                                              self.options[
-                                                                                  "max_conversation_turns"] - turn))
-                        if self.options["manually_prompt_llm"]:
-                            input("Keep prompting LLM API?")
-                        response = session.prompt(
-                            message
-                        )
-                        if self.options["verbose"]:
-                            print(f"LLM response: {response}")
-                        # Reset the message since we've used its contents
-                        message = []
-                        turn += 1
-
-                        ok, actions = minimal_parser(response)
-                        if not ok:
-                            print(MESSAGE_PARSING_ERROR_MESSAGE+response)
-                            message = append_text_to_prompt(message, PREVIOUS_RESPONSE_IS_INVALID)
-                            actions = [action_name_to_action_tuple["NOOP"]]
-                        # Widen the type definition of actions to include YIELD_OBS()
-                        actions: List[Union[ActionTuple, YIELD_OBS]]
-                        # Always end in an observation
-                        actions.append(YIELD_OBS())
-                        i = -1
-                        while not done and len(actions) > 0:
-                            i += 1
-                            action = actions.pop(0)
-                            if action == YIELD_OBS():
-                                message, done, change_total_reward = self._update_message_with_obs(
-                                    message,
-                                    env,
-                                    vision_system,
-                                    f"{config_output_path}/obs-{turn}.{i}.jpg",
-                                    behavior,
-                                    # Don't wait on the final timestep
-                                    len(actions) > 0
-                                )
-                                total_reward += change_total_reward
-                                continue
-                            env.set_actions(behavior, action)
-                            env.step()
-                            dec, term = env.get_steps(behavior)
-                            done = len(term.reward) > 0
-                            total_reward += get_change_in_total_reward(dec, term)
-                    if done:
-                        # TODO: Remove hardcoded 0 and handle multi arena configs
-                        ep_pass = check_episode_pass(total_reward, config_path, 0)
-                        episode_end_reason = "NON_ZERO_TERMINAL_REWARD"
-                        message = append_text_to_prompt(message, MISC["end_of_episode_message"](ep_pass))
-                        if not ep_pass:
-                            message = append_text_to_prompt(message, "Failure reason: Ran out of health.\n")
-
-                    elif turn >= self.options["max_conversation_turns"]:
-                        # Agents accrue a small -ve reward each timestep
-                        # So run down the clock on the episode so that agents don't benefit by running out of scripts
-                        # TODO: Handle the case where the the episode has no time limit
-                        if self.options["verbose"]:
-                            print("Reached max_conversation_turns: completing the level with NOOPs (note this will hang if the episode has no time limit)")
-                        while not done:
-                            env.set_actions(behavior, action=action_name_to_action_tuple["NOOP"])
-                            env.step()
-                            dec, term = env.get_steps(behavior)
-                            done = len(term.reward) > 0
-                            total_reward += get_change_in_total_reward(dec, term)
-                        ep_pass = check_episode_pass(total_reward, config_path, 0)
-                        episode_end_reason = "CONVERSATION_TURNS_EXCEEDED"
-                        message = append_text_to_prompt(message, MISC["end_of_episode_message"](ep_pass))
-                        if not ep_pass:
-                            message = append_text_to_prompt(message, "Failure reason: No more scripts can be sent this level.\n")
-
-                except Exception as e:
-                    # TODO: Discuss whether this is the best way.
-                    if not self.options["learn_across_arenas"]:
-                        session.write_to_file(path=self.options["output_folder_path"])
-                    if str(e).startswith(MESSAGE_PARSING_ERROR_MESSAGE):
-                        episode_end_reason = "MESSAGE_PARSING_ERROR"
-                    else:
-                        episode_end_reason = "RUNTIME_ERROR"
-                    print(traceback.format_exc())
-                finally:
-                    env.close()
-                    session.write_to_file(
-                        path=f"{config_output_path}/", write_from_index=history_index
-                    )
-                    history_index = len(session.history)
+                        continue
+                    dec, done, change_total_reward = self._step_action(env, behavior, action)
+                    total_reward += change_total_reward
+            if done:
+                episode_end_reason = "NON_ZERO_TERMINAL_REWARD"
+                message = self._append_end_of_episode_message(message, total_reward, config_path, episode_end_reason)
+
+            elif turn >= self.options["max_conversation_turns"]:
+                # Agents accrue a small -ve reward each timestep
+                # So run down the clock on the episode so that agents don't benefit by running out of scripts
+                if self.options["verbose"]:
+                    print("Reached max_conversation_turns: completing the level with NOOPs")
+                total_reward += self._run_down_the_clock(env, behavior, config_path)
+                episode_end_reason = "CONVERSATION_TURNS_EXCEEDED"
+                message = self._append_end_of_episode_message(message, total_reward, config_path, episode_end_reason)
+
+        except ArenaJobStopped:
+            stopped = True
+            raise
+        except Exception as e:
+            # TODO: Discuss whether this is the best way.
+            if not self.options["learn_across_arenas"]:
+                session.write_to_file(path=self.options["output_folder_path"],
+                                      writer=self._background_writer,
+                                      observation_store=self._observation_store)
+            if str(e).startswith(MESSAGE_PARSING_ERROR_MESSAGE):
+                episode_end_reason = "MESSAGE_PARSING_ERROR"
+            else:
+                episode_end_reason = "RUNTIME_ERROR"
+            # Only the environment's own failures stop it from being reused for the next arena
+            env_healthy = not isinstance(e, UnityException)
+            print(traceback.format_exc())
+        finally:
+            if not stopped:
+                session.write_to_file(
+                    path=f"{config_output_path}/",
+                    write_from_index=history_index,
+                    writer=self._background_writer,
+                    observation_store=self._observation_store,
+                )
+                session.save_cost_arrays(cost_folder_path=config_output_path, writer=self._background_writer)
+            environment_manager.release(env, healthy=env_healthy)
+            if self._background_writer is not None:
+                # The arena only counts as complete (e.g. when resuming) once its files are on disk
+                self._background_writer.flush()
+            if self.options["verbose"]:
+                print(f"Reward garnered for {config_path}: {total_reward}")
+                print(f"Episode end reason: {episode_end_reason}")
+                if self.options.get("prompt_caching", False):
+                    print(f"Prompt cache hit rate so far: {session.cache_hit_rate:.1%}")
+                if self._latency_tracker is not None:
+                    print(f"Prompts hedged so far: {session.num_hedged_prompts}, "
+                          f"of which answered by the secondary replica: {session.winners.count(SECONDARY_REPLICA)}")
+        return message, ArenaResult(
+            job_index=job_index,
+            arena_name=self._get_config_name(config_path),
+            loop_index=loop_index,
+            total_reward=float(total_reward),
+            episode_end_reason=episode_end_reason,
+            turns=turn,
+            input_tokens=int(np.sum(session.input_costs)) - input_tokens_before,
+            output_tokens=int(np.sum(session.output_costs)) - output_tokens_before,
+            wall_time=time.monotonic() - start_time,
+            seed=self.options["aai_seeds"],
+            llm_family=self.options["llm_family"],
+            llm_model=self.options["llm_model"],
+        )
 
-                    session.save_cost_arrays(cost_folder_path=config_output_path)
-                    if self.options["verbose"]:
-                        print(f"Reward garnered for {config_path}: {total_reward}")
+    @staticmethod
+    def _step_action(env: AnimalAIEnvironment, behavior: str, action: ActionTuple) -> tuple[DecisionSteps, bool, float]:
+        """Steps the action and returns the new decision steps, whether the episode is done and the change in reward."""
+        env.set_actions(behavior, action)
+        env.step()
+        dec, term = env.get_steps(behavior)
+        return dec, len(term.reward) > 0, get_change_in_total_reward(dec, term)
 
-                    self._arena_names = np.append(self._arena_names, config_name)
-                    self._episode_rewards = np.append(
-                        self._episode_rewards, total_reward
-                    )
-                    self._episode_end_reasons = np.append(
-                        self._episode_end_reasons, episode_end_reason
-                    )
+    def _close_background_writer(self) -> None:
+        if self._background_writer is not None:
+            self._background_writer.close()
 
-                    np.save(
-                        join(self._result_folder_path, "arena_names.npy"),
-                        self._arena_names,
-                    )
-                    np.save(
-                        join(self._result_folder_path, "episode_rewards.npy"),
-                        self._episode_rewards,
-                    )
+    def _run_down_the_clock(self, env: AnimalAIEnvironment, behavior: str, config_path: str) -> float:
+        """Completes the episode with NOOPs and returns the reward accrued while doing so.
 
-                    if self.options["verbose"]:
-                        print(f"Episode end reason: {episode_end_reason}")
-                    np.save(
-                        join(self._result_folder_path, "episode_end_reason.npy"),
-                        self._episode_end_reasons,
-                    )
+        Note:
+        - With run_down_the_clock "step", one NOOP is stepped at a time until the episode ends.
+        - With "analytic", a single NOOP is stepped to measure the per-step reward and health decrement, and the reward of
+          the remaining steps is credited without stepping them. The episode is left unfinished in the environment, which
+          the environment manager resets or closes anyway.
+        - With "verify", the analytic estimate is compared against stepping the episode to its end, whose reward is used.
+          A warning is raised if they differ by more than half a step's reward, i.e. if they count different steps.
+        - An arena without a time limit never runs out of health, so there is no clock to run down.
+        """
+        # TODO: Remove hardcoded 0 and handle multi arena configs
+        if get_arena_time_limit(config_path, 0) == 0:
+            if self.options["verbose"]:
+                print("The arena has no time limit: ending the episode without running down the clock")
+            return 0
+        mode = self.options.get("run_down_the_clock", "step")
+        if mode == "step":
+            return self._step_down_the_clock(env, behavior)
+
+        dec, _ = env.get_steps(behavior)
+        health = env.get_obs_dict(dec.obs)["health"]
+        env.set_actions(behavior, action=action_name_to_action_tuple["NOOP"])
+        env.step()
+        dec, term = env.get_steps(behavior)
+        step_reward = get_change_in_total_reward(dec, term)
+        if len(term.reward) > 0:
+            return step_reward
+        remaining_health = env.get_obs_dict(dec.obs)["health"]
+        health_decrement = health - remaining_health
+        if health_decrement <= 0:
+            # Health is not draining (e.g. it was just replenished), so the remaining steps cannot be predicted
+            return step_reward + self._step_down_the_clock(env, behavior)
+        # The final step's decrement is paid in the terminal reward, like every other step's
+        analytic_reward = step_reward * (1 + math.ceil(remaining_health / health_decrement))
+        if mode == "analytic":
+            return analytic_reward
+
+        stepped_reward = step_reward + self._step_down_the_clock(env, behavior)
+        print(f"Running down the clock: analytic reward {analytic_reward}, stepped reward {stepped_reward}, "
+              f"difference {analytic_reward - stepped_reward}")
+        if not math.isclose(analytic_reward, stepped_reward, abs_tol=abs(step_reward) / 2):
+            warnings.warn(f"The analytic reward of running down the clock on {config_path} ({analytic_reward}) "
+                          f"diverges from the stepped reward ({stepped_reward})")
+        return stepped_reward
+
+    @staticmethod
+    def _step_down_the_clock(env: AnimalAIEnvironment, behavior: str) -> float:
+        total_reward = 0
+        done = False
+        while not done:
+            env.set_actions(behavior, action=action_name_to_action_tuple["NOOP"])
+            env.step()
+            dec, term = env.get_steps(behavior)
+            done = len(term.reward) > 0
+            total_reward += get_change_in_total_reward(dec, term)
+        return total_reward
+
+    @staticmethod
+    def _append_end_of_episode_message(message: PROMPT_CONTENTS,
+                                       total_reward: float,
+                                       config_path: str,
+                                       episode_end_reason: EpisodeEndReasons,
+                                       ) -> PROMPT_CONTENTS:
+        if episode_end_reason not in EPISODE_END_FAILURE_REASONS:
+            return message
+        # TODO: Remove hardcoded 0 and handle multi arena configs
+        ep_pass = check_episode_pass(total_reward, config_path, 0)
+        message = append_text_to_prompt(message, MISC["end_of_episode_message"](ep_pass))
+        if not ep_pass:
+            message = append_text_to_prompt(message, EPISODE_END_FAILURE_REASONS[episode_end_reason])
+        return message
+
+    def _load_previous_results(self) -> Dict[int, ArenaResult]:
+        """Loads the results recorded by a previous, interrupted run of this experiment, keyed by job index."""
+        previous_results = self._results_store.get_experiment_results(self.options["output_folder_path"])
+        result_paths = [join(self._result_folder_path, file_name) for file_name in RESULT_FILE_NAMES]
+        if len(previous_results) == 0 and all(isfile(result_path) for result_path in result_paths):
+            # The suite predates the results store
+            self._results_store.import_npy(self.options["output_folder_path"],
+                                           self._result_folder_path,
+                                           seed=self.options["aai_seeds"],
+                                           llm_family=self.options["llm_family"],
+                                           llm_model=self.options["llm_model"],
+                                           loop_indices=[loop_index for loop_index, _, _ in self._get_arena_jobs()])
+            previous_results = self._results_store.get_experiment_results(self.options["output_folder_path"])
+        return previous_results
+
+    def _get_completed_results(self) -> Dict[int, ArenaResult]:
+        """Finds the arena runs that a previous run of this experiment completed, keyed by job index.
 
-            # TODO: Discuss whether this is the best way.
-            if not self.options["learn_across_arenas"]:
-                session.write_to_file(path=self.options["output_folder_path"])
+        Note:
+        - An arena run is complete if its result was recorded, it did not end in a runtime error (e.g. an API outage or a
+          Unity crash) and its history was saved.
+        - When learning across arenas, only an unbroken sequence of complete runs from the first one can be skipped,
+          since every later arena depends on the conversation so far.
+        """
+        completed_results = {}
+        for job_index, (loop_index, _, config_path) in enumerate(self._get_arena_jobs()):
+            previous_result = self._previous_results.get(job_index)
+            complete = (
+                previous_result is not None
+                and previous_result.arena_name == self._get_config_name(config_path)
+                and previous_result.episode_end_reason != "RUNTIME_ERROR"
+                and self._get_latest_history_path(self._get_config_output_path(config_path, loop_index)) is not None
+            )
+            if complete:
+                completed_results[job_index] = previous_result
+            elif self.options["learn_across_arenas"]:
+                break
+        return completed_results
+
+    @staticmethod
+    def _get_latest_history_path(config_output_path: str) -> Optional[str]:
+        if not os.path.isdir(config_output_path):
+            return None
+        # History file names end in a timestamp, so the latest one sorts last
+        history_file_names = sorted(
+            file_name for file_name in listdir(config_output_path)
+            if file_name.startswith(HISTORY_FILE_NAME_PREFIX) and file_name.endswith(".pkl")
+        )
+        if len(history_file_names) == 0:
+            return None
+        return join(config_output_path, history_file_names[-1])
+
+    def _get_arena_jobs(self) -> List[tuple[int, int, str]]:
+        """Lists the (loop_index, config_index, config_path) of every arena run, indexed by job index."""
+        return [
+            (loop_index, config_index, config_path)
+            for loop_index in range(self.options["num_arena_loops"])
+            for config_index, config_path in enumerate(self._arena_config_paths)
+        ]
+
+    def _get_environment_kwargs(self, port_offset: int) -> Dict:
+        return dict(
+            seed=self.options["aai_seeds"],
+            play=self.options["play"],
+            inference=self.options["watch_agent_interact"],
+            resolution=self.options["resolution"],
+            base_port=5005 + (self.options["aai_seeds"] % 100) + port_offset,
+        )
+
+    @staticmethod
+    def _get_config_name(config_path: str) -> str:
+        return os.path.basename(config_path).split(".")[-2]
+
+    def _get_config_output_path(self, config_path: str, loop_index: int) -> str:
+        # Only add a suffix to the arena folder name if there is more than one loop to perform over the arenas.
+        if self.options["num_arena_loops"] > 1:
+            return join(
+                self.options["output_folder_path"],
+                self._get_config_name(config_path) + ARENA_LOOP_SUFFIX(loop_index),
+            )
+        return join(
+            self.options["output_folder_path"], self._get_config_name(config_path)
+        )
+
+    def _create_vision_system(self) -> CameraSystem:
+        uses_compression = (
+            self.options.get("image_token_budget") is not None
+            or self.options.get("jpeg_quality", DEFAULT_JPEG_QUALITY) != DEFAULT_JPEG_QUALITY
+            or self.options.get("grayscale_observations", False)
+        )
+        camera_kwargs = dict(
+            num_frames=self.options.get("num_frames_per_observation", 1),
+            unchanged_observation_threshold=self.options.get("unchanged_observation_threshold"),
+            jpeg_encoder=self.options.get("jpeg_encoder", "pil"),
+        )
+        if not uses_compression:
+            return CameraSystem(**camera_kwargs)
+        return CameraSystem(**camera_kwargs, compressor=ObservationCompressor(
+            # The family that is billed for the images
+            llm_family=self.options["llm_family"] if self.options["llm_family_switch"] is None
+            else self.options["llm_family_switch"],
+            image_token_budget=self.options.get("image_token_budget"),
+            jpeg_quality=self.options.get("jpeg_quality", DEFAULT_JPEG_QUALITY),
+            grayscale=self.options.get("grayscale_observations", False),
+            verbose=self.options["verbose"],
+        ))
+
+    def _create_background_prompt(self, vision_system: CameraSystem) -> str:
+        return create_background_prompt(
+            preamble=PREAMBLES[self.options["preamble"]],
+            observation=vision_system.observation_prompt,  # TODO: see discussion in VisionSystem.
+            goal=GOALS[self.options["goal"]],
+            commands=COMMANDS[self.options["commands"]](self.options["max_conversation_turns"]),
+            chain_of_thought=CHAINS_OF_THOUGHT[self.options["chain_of_thought"]],
+            misc=MISC[self.options["misc"]],
+        )
 
-    def _get_llm_session(self):
+    def _get_llm_session(self) -> LLMSession:
+        # Only clients created after the settings change use them, so sessions in a process share their clients
+        configure_client_pool(HttpClientSettings(
+            max_connections=self.options.get("llm_http_max_connections", 20),
+            max_keepalive_connections=self.options.get("llm_http_max_keepalive_connections", 10),
+            timeout_seconds=self.options.get("llm_http_timeout_seconds", 600),
+        ))
+        session = self._create_llm_session()
+        if self._latency_tracker is not None:
+            session = HedgedSession(session, self._create_hedge_replica, self._latency_tracker)
+        session.set_history_policy(HistoryPolicy(
+            max_images=self.options.get("history_max_images"),
+            current_arena_only=self.options.get("history_current_arena_images_only", False),
+        ))
+        session.set_prompt_caching(self.options.get("prompt_caching", False))
+        if self._response_cache is not None:
+            session = CachedSession(session,
+                                    model=self.options["llm_model"],
+                                    response_cache=self._response_cache,
+                                    mode=self.options["response_cache_mode"])
+        return session
+
+    def _create_llm_session(self) -> LLMSession:
         if self.options["llm_family_switch"] is not None:
             return LLMSessionFactory.create_llm_session(
                 name=self.options["llm_family"],
                 api_key=self._api_key,
                 model=self.options["llm_model"],
-                switch_session=LLMSessionFactory.create_llm_session(
-                    name=self.options["llm_family_switch"],
-                    api_key=self._api_key,
-                    model=self.options["llm_model_switch"],
+                switch_session=self._limit_rate(
+                    LLMSessionFactory.create_llm_session(
+                        name=self.options["llm_family_switch"],
+                        api_key=self._api_key,
+                        model=self.options["llm_model_switch"],
+                    ),
+                    llm_family=self.options["llm_family_switch"],
+                    llm_model=self.options["llm_model_switch"],
                 ),
             )
-        return LLMSessionFactory.create_llm_session(
-            name=self.options["llm_family"],
-            api_key=self._api_key,
-            model=self.options["llm_model"],
+        return self._limit_rate(
+            LLMSessionFactory.create_llm_session(
+                name=self.options["llm_family"],
+                api_key=self._api_key,
+                model=self.options["llm_model"],
+            ),
+            llm_family=self.options["llm_family"],
+            llm_model=self.options["llm_model"],
         )
 
+    def _create_hedge_replica(self, replica_index: int) -> LLMSession:
+        """Creates a session for one request of a hedged prompt, on the secondary endpoint for the secondary replica."""
+        llm_family = self.options["llm_family"]
+        api_key = self._api_key
+        endpoint_kwargs = {}
+        if replica_index == SECONDARY_REPLICA and self.options.get("hedge_endpoint") is not None:
+            api_key = hedge_api_key or self._api_key
+            endpoint_kwargs = {"base_url" if llm_family == "claude" else "endpoint": self.options["hedge_endpoint"]}
+        return self._limit_rate(
+            LLMSessionFactory.create_llm_session(
+                name=llm_family,
+                api_key=api_key,
+                model=self.options["llm_model"],
+                **endpoint_kwargs,
+            ),
+            llm_family=llm_family,
+            llm_model=self.options["llm_model"],
+        )
+
+    def _limit_rate(self, session: LLMSession, llm_family: str, llm_model: str) -> LLMSession:
+        """Makes the session wait for the limits shared by all the sessions of the model on this host, if any."""
+        requests_per_minute = self.options.get("rate_limit_requests_per_minute")
+        tokens_per_minute = self.options.get("rate_limit_tokens_per_minute")
+        if (requests_per_minute is None and tokens_per_minute is None) or llm_family not in ["claude", "gpt", "gemini"]:
+            return session
+        return RateLimitedSession(session, llm_family, RateLimiter(
+            llm_family,
+            llm_model,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            state_folder_path=self.options.get("rate_limit_state_path") or DEFAULT_RATE_LIMIT_STATE_FOLDER_PATH,
+        ))
+
     def _generate_arena_config_paths(self) -> List[str]:
         if (
                 ".yaml" in self.options["aai_config_path"]
@@ -345,20 +884,38 @@ class Experiment1(Experiment):
             wait: bool = True
     ) -> tuple[PROMPT_CONTENTS, bool, float]:
         message = append_text_to_prompt(message, YIELD_OBS_MESSAGE)
-        _, visual_obs_b64 = vision_system.get_observation(
+        # Note we don't include the reward from the current get_steps; we assume this has already been counted
+        total_reward = 0
+        frames: Optional[List[np.ndarray]] = None
+        _, term = env.get_steps(behavior)
+        done = len(term.reward) > 0
+        if vision_system.num_frames > 1 and wait and not done:
+            # Multi-frame observations are captured over the wait; without one (e.g. after the last command of a
+            # script), the current frame is repeated instead
+            frames, done, total_reward = self._capture_frames_during_wait(env, vision_system, behavior)
+        observation_text, visual_obs_b64 = vision_system.get_observation(
             env=env,
-            save=self.options["save_observations"],
+            # Deduplicated observations are saved to the observation store instead
+            save=self.options["save_observations"] and self._observation_store is None,
             save_path=save_path,
             show=self.options["show_observations"],
+            writer=self._background_writer,
+            frames=frames,
         )
-        message += [
-            (PromptElement.Image, visual_obs_b64)
-        ]
-        # Note we don't include the reward from the current get_steps; we assume this has already been counted
-        total_reward = 0
-        _, term = env.get_steps(behavior)
-        if len(term.reward) > 0:
-            return message, True, total_reward
+        if visual_obs_b64 is None:
+            # The observation was skipped as unchanged
+            message = append_text_to_prompt(message, observation_text)
+        else:
+            if self.options["save_observations"] and self._observation_store is not None:
+                if self._background_writer is None:
+                    self._store_observation(save_path, visual_obs_b64)
+                else:
+                    self._background_writer.submit(self._store_observation, save_path, visual_obs_b64)
+            message += [
+                (PromptElement.Image, visual_obs_b64)
+            ]
+        if done or frames is not None:
+            return message, done, total_reward
         if wait:
             for _ in range(FRAMES_BETWEEN_OBS):
                 env.set_actions(behavior_name=behavior, action=action_name_to_action_tuple["NOOP"])
@@ -369,6 +926,37 @@ class Experiment1(Experiment):
                     return message, True, total_reward
         return message, False, total_reward
 
+    @staticmethod
+    def _capture_frames_during_wait(env: AnimalAIEnvironment,
+                                    vision_system: CameraSystem,
+                                    behavior: str,
+                                    ) -> tuple[List[np.ndarray], bool, float]:
+        """Captures the current frame and num_frames - 1 more, evenly spaced over FRAMES_BETWEEN_OBS NOOP steps.
+
+        Returns the frames, whether the episode ended and the reward accrued while waiting.
+        """
+        num_frames = vision_system.num_frames
+        capture_steps = [round(index * FRAMES_BETWEEN_OBS / (num_frames - 1)) for index in range(1, num_frames)]
+        frames = [vision_system.capture_frame(env)]
+        total_reward = 0
+        for step in range(1, FRAMES_BETWEEN_OBS + 1):
+            env.set_actions(behavior_name=behavior, action=action_name_to_action_tuple["NOOP"])
+            env.step()
+            dec, term = env.get_steps(behavior)
+            total_reward += get_change_in_total_reward(dec, term)
+            if len(term.reward) > 0:
+                # Repeat the last frame before the episode ended, so that every observation has the same layout
+                return frames + [frames[-1]] * (num_frames - len(frames)), True, total_reward
+            frames += [vision_system.capture_frame(env)] * capture_steps.count(step)
+        return frames, False, total_reward
+
+    def _store_observation(self, save_path: str, visual_obs_b64: str) -> None:
+        """Stores the observation once per suite and indexes it under the file name it would have been saved as."""
+        digest = self._observation_store.put(base64.b64decode(visual_obs_b64))
+        populate_csv(join(os.path.dirname(save_path), OBSERVATION_INDEX_FILE_NAME),
+                     OBSERVATION_INDEX_COLUMN_LABELS,
+                     [os.path.basename(save_path), digest])
+
     def _create_initial_message(self, background_prompt: str) -> PROMPT_CONTENTS:
         n_shot_path = self.options["n_shot_examples_path"]
         """Creates the initial message that is passed to the LLM, prior to any interaction with the LLM.
@@ -384,8 +972,7 @@ class Experiment1(Experiment):
             message += [
                 (PromptElement.Text, N_SHOT["example_prefix"])
             ]
-            with open(pickle_history_path, "rb") as file:
-                n_shot_example: list[LLMMessageParam] = pickle.load(file)
+            n_shot_example: list[LLMMessageParam] = load_history_file(pickle_history_path)
 
             for index, message_param in enumerate(n_shot_example):
                 if index == 0:
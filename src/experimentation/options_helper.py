@@ -4,6 +4,10 @@ from typing import Dict, List
 
 import yaml
 
+from src.definitions.constants import FRAMES_BETWEEN_OBS
+from src.llms.response_cache import RESPONSE_CACHE_MODES
+from src.vision.compression import JPEG_ENCODERS
+
 def load_options(options_path: str) -> Dict:
     with open(options_path, "r") as file:
         options = yaml.safe_load(file)
@@ -69,6 +73,73 @@ def check_options(options: Dict) -> bool:
     else:
         assert isinstance(options["num_arena_loops"], int)
 
+    assert options.get("scheduler", "local") in ["local", "queue"]
+    resume_from = options.get("resume_from")
+    assert resume_from is None or (isinstance(resume_from, str) and os.path.isdir(resume_from))
+    assert isinstance(options.get("reuse_environment", False), bool)
+    assert isinstance(options.get("prewarm_next_environment", False), bool)
+    assert options.get("run_down_the_clock", "step") in ["step", "analytic", "verify"]
+    assert isinstance(options.get("background_writes", False), bool)
+    assert isinstance(options.get("deduplicate_observations", False), bool)
+    # Both can be swept over by passing lists
+    image_token_budgets = options.get("image_token_budget")
+    for image_token_budget in image_token_budgets if isinstance(image_token_budgets, list) else [image_token_budgets]:
+        assert image_token_budget is None or (isinstance(image_token_budget, int) and image_token_budget > 0)
+    jpeg_qualities = options.get("jpeg_quality", 75)
+    for jpeg_quality in jpeg_qualities if isinstance(jpeg_qualities, list) else [jpeg_qualities]:
+        assert isinstance(jpeg_quality, int) and 1 <= jpeg_quality <= 95
+    assert isinstance(options.get("grayscale_observations", False), bool)
+    assert options.get("jpeg_encoder", "pil") in JPEG_ENCODERS
+    num_frames_per_observation = options.get("num_frames_per_observation", 1)
+    # Every frame after the first is captured on a different step of the wait between observations
+    assert isinstance(num_frames_per_observation, int) and 1 <= num_frames_per_observation <= FRAMES_BETWEEN_OBS + 1
+    unchanged_observation_threshold = options.get("unchanged_observation_threshold")
+    assert unchanged_observation_threshold is None or (
+            isinstance(unchanged_observation_threshold, int) and unchanged_observation_threshold >= 0
+    )
+    history_max_images = options.get("history_max_images")
+    assert history_max_images is None or (isinstance(history_max_images, int) and history_max_images >= 0)
+    assert isinstance(options.get("history_current_arena_images_only", False), bool)
+    compaction_token_threshold = options.get("compaction_token_threshold")
+    if compaction_token_threshold is not None:
+        assert isinstance(compaction_token_threshold, int) and compaction_token_threshold > 0
+        assert options["learn_across_arenas"], "Only a history shared across arenas can be compacted"
+        # The summary is prompted from the model that answers the session's prompts
+        summary_llm_family = options["llm_family"] if options["llm_family_switch"] is None \
+            else options["llm_family_switch"]
+        assert summary_llm_family not in ["human", "recording"]
+    assert options.get("compaction_llm_model") is None or isinstance(options["compaction_llm_model"], str)
+    assert isinstance(options.get("prompt_caching", False), bool)
+    assert isinstance(options.get("stream_actions", False), bool)
+    for http_client_setting in ["llm_http_max_connections", "llm_http_max_keepalive_connections"]:
+        assert isinstance(options.get(http_client_setting, 1), int) and options.get(http_client_setting, 1) >= 1
+    assert isinstance(options.get("llm_http_timeout_seconds", 600), (int, float))
+    for rate_limit in ["rate_limit_requests_per_minute", "rate_limit_tokens_per_minute"]:
+        assert options.get(rate_limit) is None or (isinstance(options[rate_limit], int) and options[rate_limit] > 0)
+    assert options.get("rate_limit_state_path") is None or isinstance(options["rate_limit_state_path"], str)
+    response_cache_mode = options.get("response_cache_mode", "bypass")
+    assert response_cache_mode in RESPONSE_CACHE_MODES
+    if response_cache_mode != "bypass":
+        # Responses are only reproducible from API sessions, which all prompt at temperature 0
+        assert options["llm_family"] in ["claude", "gpt", "gemini"]
+        assert isinstance(options["response_cache_path"], str)
+        assert isinstance(options.get("response_cache_max_megabytes", 1024), int)
+    if options.get("hedge_requests", False):
+        assert isinstance(options["hedge_requests"], bool)
+        # Hedged prompts are answered by fresh sessions of the same API model
+        assert options["llm_family"] in ["claude", "gpt", "gemini"] and options["llm_family_switch"] is None
+        assert 0 <= options.get("hedge_latency_percentile", 95) <= 100
+        assert isinstance(options.get("hedge_initial_deadline_seconds", 30), (int, float))
+        assert options.get("hedge_endpoint") is None or options["llm_family"] in ["claude", "gpt"]
+
+    max_parallel_arenas = options.get("max_parallel_arenas", 1)
+    assert isinstance(max_parallel_arenas, int) and max_parallel_arenas >= 1
+    if max_parallel_arenas > 1:
+        # Parallel arenas each get their own session, so they cannot share a conversation or wait on a human
+        assert not options["learn_across_arenas"], "Arenas can only be run in parallel if not learning across arenas"
+        assert not options["manually_prompt_llm"]
+        assert options["llm_family"] != "human"
+
     assert isinstance(options["n_shot_examples_path"], str) or options["n_shot_examples_path"] is None
     if isinstance(options["n_shot_examples_path"], str):
         assert os.path.exists(options["n_shot_examples_path"])
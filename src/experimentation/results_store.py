@@ -0,0 +1,131 @@
+import sqlite3
+from contextlib import contextmanager
+from os.path import join
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+RESULTS_STORE_FILE_NAME = "results.sqlite"
+RESULT_FILE_NAMES = ["arena_names.npy", "episode_rewards.npy", "episode_end_reason.npy"]
+# Value of the metrics that were not recorded, e.g. for results imported from .npy files
+UNKNOWN_METRIC = -1
+_SQL_TYPES = {int: "INTEGER", float: "REAL", str: "TEXT"}
+
+
+class ArenaResult(NamedTuple):
+    job_index: int
+    arena_name: str
+    loop_index: int
+    total_reward: float
+    episode_end_reason: str
+    turns: int
+    input_tokens: int
+    output_tokens: int
+    wall_time: float
+    seed: int
+    llm_family: str
+    llm_model: str
+
+
+class ResultsStore:
+    """An append-only table with one row per arena run, shared by all the experiments (and workers) of a suite.
+
+    Note:
+    - The store is a SQLite database with the default rollback journal, so, like the work queue, it can be shared by
+      writers on several hosts through a filesystem that supports file locking (write-ahead logging needs the memory
+      of a single host). Aggregating a whole suite is a single query (see read_all).
+    - Re-running an arena (e.g. when resuming a suite) appends a new row; the latest row of a job supersedes the
+      earlier ones.
+    - The .npy layout used before the store existed can be exported per experiment (see export_npy).
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        with self._connect() as connection:
+            # Also converts stores created in write-ahead-logging mode, which persists in the database file
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.execute(
+                f"""CREATE TABLE IF NOT EXISTS arena_results (
+                    row_id INTEGER PRIMARY KEY,
+                    experiment_folder_path TEXT NOT NULL,
+                    {", ".join(f"{field} {_SQL_TYPES[field_type]} NOT NULL"
+                               for field, field_type in ArenaResult.__annotations__.items())}
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS experiment_index ON arena_results (experiment_folder_path, job_index)"
+            )
+
+    def append(self, experiment_folder_path: str, result: ArenaResult) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                f"INSERT INTO arena_results (experiment_folder_path, {', '.join(ArenaResult._fields)}) "
+                f"VALUES (?, {', '.join('?' for _ in ArenaResult._fields)})",
+                (experiment_folder_path, *result),
+            )
+
+    def get_experiment_results(self, experiment_folder_path: str) -> Dict[int, ArenaResult]:
+        """Returns the latest result of every job of an experiment, keyed (and ordered) by job index."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(ArenaResult._fields)} FROM arena_results WHERE experiment_folder_path = ? "
+                "ORDER BY job_index, row_id",
+                (experiment_folder_path,),
+            ).fetchall()
+        # Later rows of the same job overwrite earlier ones
+        return {row[0]: ArenaResult(*row) for row in rows}
+
+    def read_all(self) -> List[Tuple[str, ArenaResult]]:
+        """Returns the latest result of every job of every experiment, as (experiment folder path, result) pairs."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT experiment_folder_path, {', '.join(ArenaResult._fields)} FROM arena_results "
+                "WHERE row_id IN (SELECT MAX(row_id) FROM arena_results GROUP BY experiment_folder_path, job_index) "
+                "ORDER BY experiment_folder_path, job_index"
+            ).fetchall()
+        return [(row[0], ArenaResult(*row[1:])) for row in rows]
+
+    def export_npy(self, experiment_folder_path: str, result_folder_path: str) -> None:
+        """Writes an experiment's results in the legacy results/*.npy layout, in job order."""
+        results = list(self.get_experiment_results(experiment_folder_path).values())
+        columns = [
+            np.array([result.arena_name for result in results]),
+            np.array([result.total_reward for result in results]),
+            np.array([result.episode_end_reason for result in results]),
+        ]
+        for file_name, column in zip(RESULT_FILE_NAMES, columns):
+            np.save(join(result_folder_path, file_name), column)
+
+    def import_npy(self, experiment_folder_path: str, result_folder_path: str, seed: int, llm_family: str,
+                   llm_model: str, loop_indices: List[int]) -> None:
+        """Imports results saved in the legacy results/*.npy layout, e.g. by a suite that predates the store."""
+        arena_names, episode_rewards, episode_end_reasons = [
+            np.load(join(result_folder_path, file_name)) for file_name in RESULT_FILE_NAMES
+        ]
+        for job_index, (arena_name, episode_reward, episode_end_reason, loop_index) in enumerate(
+                zip(arena_names, episode_rewards, episode_end_reasons, loop_indices)
+        ):
+            self.append(experiment_folder_path, ArenaResult(
+                job_index=job_index,
+                arena_name=str(arena_name),
+                loop_index=loop_index,
+                total_reward=float(episode_reward),
+                episode_end_reason=str(episode_end_reason),
+                turns=UNKNOWN_METRIC,
+                input_tokens=UNKNOWN_METRIC,
+                output_tokens=UNKNOWN_METRIC,
+                wall_time=UNKNOWN_METRIC,
+                seed=seed,
+                llm_family=llm_family,
+                llm_model=llm_model,
+            ))
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self._db_path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
@@ -9,6 +9,10 @@ from datetime import datetime
 import yaml
 
 from src.experimentation.experiments.experiment_factory import ExperimentFactory
+from src.experimentation.results_store import RESULTS_STORE_FILE_NAME
+from src.experimentation.work_queue import WorkQueue
+from src.experimentation.worker import get_work_queue_path, run_worker
+from src.utilities.observation_store import OBSERVATION_STORE_FOLDER_NAME
 from src.utilities.utils import try_mkdir
 
 
@@ -17,18 +21,25 @@ class ExperimentSuite:
         self.options = options
         self.timestamped_folder_path = self._create_output_directory()
         self.arena_config_paths = self._generate_list_of_arena_config_paths()
-        self._save_options_to_output_directory(output_dir=self.timestamped_folder_path)
+        if not self._is_resuming():
+            # Keep the options the suite was originally launched with
+            self._save_options_to_output_directory(output_dir=self.timestamped_folder_path)
 
-    def run(self, sleep_duration: float = 3):
+    def run(self, sleep_duration: float = 0):
         """Runs the experiment suite by iterating over the iterable params and running one experiment per set of args.
 
         Note:
             - Iterating over the arena configurations is part of the core experiment and is thus not in this method.
+            - With the "queue" scheduler, the experiments' arena runs are queued in the suite folder and this process
+              becomes one of the workers draining the queue (more can be started with scripts.worker).
         """
         # Extract the list options that are meant to be iterated over
         iterable_options = {k: v for k, v in self.options.items() if isinstance(v, list)}
         non_iterable_options = {k: v for k, v in self.options.items() if not isinstance(v, list)}
         keys, values = zip(*iterable_options.items())
+        work_queue = WorkQueue(get_work_queue_path(self.timestamped_folder_path)) if self._uses_work_queue() else None
+        if work_queue is not None and self._is_resuming():
+            work_queue.requeue_unsuccessful()
 
         # Run one experiment per set of iterable params within the cartesian product of the options with itself
         # But, must update src/experimentation/options_helper.py check_options method to allow for new iterable params
@@ -39,6 +50,16 @@ class ExperimentSuite:
             experiment_folder_name = "_".join(f"{k}_{v}" for k, v in experiment_options.items() if k in iterable_options)
             experiment_folder_path = join(self.timestamped_folder_path, experiment_folder_name)
             experiment_options["output_folder_path"] = experiment_folder_path
+            experiment_options["results_store_path"] = join(self.timestamped_folder_path, RESULTS_STORE_FILE_NAME)
+            experiment_options["observation_store_path"] = join(self.timestamped_folder_path,
+                                                                 OBSERVATION_STORE_FOLDER_NAME)
+
+            if work_queue is not None:
+                experiment = ExperimentFactory().create_experiment(name=experiment_options["experiment_name"],
+                                                                   options=experiment_options)
+                print(f"Queueing experiment with options{experiment_options}")
+                work_queue.enqueue(experiment_folder_path, experiment_options, experiment.get_arena_job_indices())
+                continue
 
             try:
                 experiment = ExperimentFactory().create_experiment(name=experiment_options["experiment_name"],
@@ -49,9 +70,23 @@ class ExperimentSuite:
                 print(f"Experiment failed with error: {e}")
                 print(traceback.format_exc())
             finally:
-                time.sleep(sleep_duration)  # Required for process not to crash
+                # Environments only hand back their port once its socket is free again (see PortAllocator.release),
+                # so experiments no longer need to be spaced out; a sleep can still be requested here
+                time.sleep(sleep_duration)
+
+        if work_queue is not None:
+            run_worker(get_work_queue_path(self.timestamped_folder_path))
+
+    def _is_resuming(self) -> bool:
+        return self.options.get("resume_from") is not None
+
+    def _uses_work_queue(self) -> bool:
+        return self.options.get("scheduler", "local") == "queue"
 
     def _create_output_directory(self) -> str:
+        if self._is_resuming():
+            # Experiments found in the folder only re-run the arenas they did not complete
+            return self.options["resume_from"]
         try_mkdir(self.options["output_folder_path"])
         now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         timestamped_folder_path = join(self.options["output_folder_path"], now)
@@ -0,0 +1,217 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import yaml
+
+# Job index of a work item that runs a whole experiment, used when the arenas of an experiment depend on each other
+WHOLE_EXPERIMENT_JOB_INDEX = -1
+
+
+class WorkItem(NamedTuple):
+    item_id: int
+    experiment_folder_path: str
+    experiment_options: Dict
+    job_index: int
+    attempts: int
+
+
+class WorkItemResult(NamedTuple):
+    job_index: int
+    status: str
+    total_reward: Optional[float]
+    episode_end_reason: Optional[str]
+
+
+class WorkQueue:
+    """A durable queue of (experiment options x arena) work items, drained by any number of worker processes.
+
+    Note:
+    - The queue is a SQLite database, so workers on several hosts can share it through a filesystem that supports
+      file locking.
+    - A worker leases an item for lease_duration seconds and must renew the lease (see heartbeat) while it runs it.
+      Items whose lease expired (e.g. because the worker crashed) are handed out again, up to max_attempts times.
+    - Once all items of an experiment are finished, exactly one worker is told to collate its results
+      (see claim_finished_experiments).
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3) -> None:
+        self._db_path = db_path
+        self._max_attempts = max_attempts
+        with self._connect() as connection:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS work_items (
+                    item_id INTEGER PRIMARY KEY,
+                    experiment_folder_path TEXT NOT NULL,
+                    experiment_options TEXT NOT NULL,
+                    job_index INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expiry REAL,
+                    total_reward REAL,
+                    episode_end_reason TEXT,
+                    UNIQUE (experiment_folder_path, job_index)
+                )"""
+            )
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS experiments (
+                    experiment_folder_path TEXT PRIMARY KEY,
+                    experiment_options TEXT NOT NULL,
+                    collated INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+
+    def enqueue(self, experiment_folder_path: str, experiment_options: Dict, job_indices: List[int]) -> None:
+        """Adds one item per job index. Items that are already queued (e.g. when resuming) keep their state, but take
+        the given options, so that requeued items run with the options of the resumed suite (e.g. its resume_from).
+        """
+        serialised_options = yaml.dump(experiment_options, default_flow_style=False)
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR IGNORE INTO experiments (experiment_folder_path, experiment_options) VALUES (?, ?)",
+                (experiment_folder_path, serialised_options),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO work_items (experiment_folder_path, experiment_options, job_index) "
+                "VALUES (?, ?, ?)",
+                [(experiment_folder_path, serialised_options, job_index) for job_index in job_indices],
+            )
+            connection.execute(
+                "UPDATE experiments SET experiment_options = ? WHERE experiment_folder_path = ?",
+                (serialised_options, experiment_folder_path),
+            )
+            connection.execute(
+                "UPDATE work_items SET experiment_options = ? WHERE experiment_folder_path = ?",
+                (serialised_options, experiment_folder_path),
+            )
+
+    def requeue_unsuccessful(self) -> None:
+        """Hands failed items, and items that ended in a runtime error, back to the queue with fresh attempts.
+
+        Whole-experiment items are always handed back, since they may contain arenas that ended in runtime errors;
+        once enqueued again with the resumed suite's options, the experiment skips the arenas that were completed.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE work_items SET status = 'pending', attempts = 0, lease_owner = NULL, lease_expiry = NULL "
+                "WHERE status = 'failed' OR (status = 'done' AND (episode_end_reason = 'RUNTIME_ERROR' "
+                "OR job_index = ?))",
+                (WHOLE_EXPERIMENT_JOB_INDEX,),
+            )
+            connection.execute(
+                "UPDATE experiments SET collated = 0 WHERE EXISTS (SELECT 1 FROM work_items WHERE "
+                "work_items.experiment_folder_path = experiments.experiment_folder_path AND status = 'pending')"
+            )
+
+    def lease(self, owner: str, lease_duration: float) -> Optional[WorkItem]:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            # Give up on items whose worker died while running their final attempt
+            connection.execute(
+                "UPDATE work_items SET status = 'failed', lease_owner = NULL, lease_expiry = NULL "
+                "WHERE status = 'leased' AND lease_expiry < ? AND attempts >= ?",
+                (now, self._max_attempts),
+            )
+            row = connection.execute(
+                "SELECT item_id, experiment_folder_path, experiment_options, job_index, attempts FROM work_items "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expiry < ?) "
+                "ORDER BY item_id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            item_id, experiment_folder_path, experiment_options, job_index, attempts = row
+            connection.execute(
+                "UPDATE work_items SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expiry = ? "
+                "WHERE item_id = ?",
+                (owner, now + lease_duration, item_id),
+            )
+        return WorkItem(
+            item_id=item_id,
+            experiment_folder_path=experiment_folder_path,
+            experiment_options=yaml.safe_load(experiment_options),
+            job_index=job_index,
+            attempts=attempts + 1,
+        )
+
+    def heartbeat(self, item: WorkItem, owner: str, lease_duration: float) -> bool:
+        """Renews the lease on an item; returns False if the lease was lost to another worker."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE work_items SET lease_expiry = ? WHERE item_id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + lease_duration, item.item_id, owner),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self,
+                 item: WorkItem,
+                 owner: str,
+                 total_reward: Optional[float],
+                 episode_end_reason: Optional[str],
+                 ) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE work_items SET status = 'done', total_reward = ?, episode_end_reason = ?, lease_owner = NULL, "
+                "lease_expiry = NULL WHERE item_id = ? AND status = 'leased' AND lease_owner = ?",
+                (total_reward, episode_end_reason, item.item_id, owner),
+            )
+
+    def fail(self, item: WorkItem, owner: str) -> None:
+        """Hands a failed item back to the queue, or marks it as failed once it has used up its attempts."""
+        status = "failed" if item.attempts >= self._max_attempts else "pending"
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE work_items SET status = ?, lease_owner = NULL, lease_expiry = NULL "
+                "WHERE item_id = ? AND status = 'leased' AND lease_owner = ?",
+                (status, item.item_id, owner),
+            )
+
+    def claim_finished_experiments(self) -> List[Dict]:
+        """Returns the options of the experiments whose items have all finished and which nobody has collated yet.
+
+        The experiments are marked as collated, so every finished experiment is returned to exactly one caller.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT experiment_folder_path, experiment_options FROM experiments WHERE collated = 0 "
+                "AND NOT EXISTS (SELECT 1 FROM work_items WHERE work_items.experiment_folder_path = "
+                "experiments.experiment_folder_path AND status IN ('pending', 'leased'))"
+            ).fetchall()
+            connection.executemany(
+                "UPDATE experiments SET collated = 1 WHERE experiment_folder_path = ?",
+                [(experiment_folder_path,) for experiment_folder_path, _ in rows],
+            )
+        return [yaml.safe_load(experiment_options) for _, experiment_options in rows]
+
+    def get_results(self, experiment_folder_path: str) -> List[WorkItemResult]:
+        """Returns the state of every item of an experiment, in job order."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT job_index, status, total_reward, episode_end_reason FROM work_items "
+                "WHERE experiment_folder_path = ? ORDER BY job_index",
+                (experiment_folder_path,),
+            ).fetchall()
+        return [WorkItemResult(*row) for row in rows]
+
+    def is_drained(self) -> bool:
+        with self._connect() as connection:
+            (num_unfinished,) = connection.execute(
+                "SELECT COUNT(*) FROM work_items WHERE status IN ('pending', 'leased')"
+            ).fetchone()
+        return num_unfinished == 0
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Autocommit mode, so that BEGIN IMMEDIATE can take the write lock before reading
+        connection = sqlite3.connect(self._db_path, timeout=60, isolation_level=None)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
@@ -0,0 +1,102 @@
+import os
+import socket
+import threading
+import time
+import traceback
+from os.path import join
+from typing import Dict
+
+from src.environment.env_manager import EnvironmentManager
+from src.experimentation.experiments.experiment import ArenaJobStopped
+from src.experimentation.experiments.experiment_factory import ExperimentFactory
+from src.experimentation.work_queue import WHOLE_EXPERIMENT_JOB_INDEX, WorkItem, WorkQueue
+
+WORK_QUEUE_FILE_NAME = "work_queue.sqlite"
+
+
+def get_work_queue_path(suite_folder_path: str) -> str:
+    return join(suite_folder_path, WORK_QUEUE_FILE_NAME)
+
+
+def run_worker(queue_path: str, lease_duration: float = 600, poll_interval: float = 10) -> None:
+    """Drains a suite's work queue, returning once no item is pending or being run by another worker.
+
+    Any number of workers can drain the same queue, on this host or on others sharing the suite folder.
+    """
+    queue = WorkQueue(queue_path)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    # Environments can only be reused between items whose experiments allow it
+    environment_managers: Dict[bool, EnvironmentManager] = {}
+    try:
+        while True:
+            item = queue.lease(owner=owner, lease_duration=lease_duration)
+            if item is None:
+                _collate_finished_experiments(queue)
+                if queue.is_drained():
+                    return
+                # Other workers are still running items, which may yet be handed back to the queue
+                time.sleep(poll_interval)
+                continue
+
+            reuse_environment = item.experiment_options.get("reuse_environment", False)
+            if reuse_environment not in environment_managers:
+                environment_managers[reuse_environment] = EnvironmentManager(reuse=reuse_environment)
+            _run_work_item(queue, item, owner, lease_duration, environment_managers[reuse_environment])
+            _collate_finished_experiments(queue)
+    finally:
+        for environment_manager in environment_managers.values():
+            environment_manager.close_all()
+
+
+def _run_work_item(queue: WorkQueue,
+                   item: WorkItem,
+                   owner: str,
+                   lease_duration: float,
+                   environment_manager: EnvironmentManager,
+                   ) -> None:
+    """Runs a leased item, which is stopped without recording its result if the lease is lost to another worker."""
+    stop_heartbeat = threading.Event()
+    lease_lost = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop_heartbeat.wait(lease_duration / 3):
+            if not queue.heartbeat(item, owner, lease_duration):
+                print(f"Lost the lease on work item {item.item_id}, stopping it")
+                lease_lost.set()
+                return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        print(f"Running job {item.job_index} (attempt {item.attempts}) of {item.experiment_folder_path}")
+        experiment = ExperimentFactory().create_experiment(name=item.experiment_options["experiment_name"],
+                                                           options=item.experiment_options)
+        if item.job_index == WHOLE_EXPERIMENT_JOB_INDEX:
+            # The experiment records its own results
+            experiment.run(stop_event=lease_lost)
+            queue.complete(item, owner, total_reward=None, episode_end_reason=None)
+        else:
+            total_reward, episode_end_reason = experiment.run_arena_job(item.job_index, environment_manager,
+                                                                        stop_event=lease_lost)
+            queue.complete(item, owner, total_reward=total_reward, episode_end_reason=episode_end_reason)
+    except ArenaJobStopped:
+        # The item is now another worker's, which records its result
+        print(f"Stopped work item {item.item_id}")
+    except Exception as e:
+        print(f"Work item failed with error: {e}")
+        print(traceback.format_exc())
+        queue.fail(item, owner)
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+
+
+def _collate_finished_experiments(queue: WorkQueue) -> None:
+    for experiment_options in queue.claim_finished_experiments():
+        results = queue.get_results(experiment_options["output_folder_path"])
+        if any(result.job_index == WHOLE_EXPERIMENT_JOB_INDEX for result in results):
+            continue
+        experiment = ExperimentFactory().create_experiment(name=experiment_options["experiment_name"],
+                                                           options=experiment_options)
+        # Arena runs append their own results to the suite's results store; items that failed every attempt have none
+        experiment.save_arena_results()
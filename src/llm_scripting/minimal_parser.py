@@ -94,3 +94,50 @@ def minimal_parser(script: str) -> Union[
                 return False, f"Non matching command found {command_string}"
             actions += _get_aai_commands_from_script_values(command_match.group(1), int(command_match.group(2)))
         return True, actions
+
+
+class IncrementalParser:
+    """Parses a script as it streams in, emitting the actions of each command as soon as its ";" arrives.
+
+    Note:
+    - Commands are checked one at a time, so an invalid command is only found once it has arrived, after the actions
+      of the commands before it were emitted. minimal_parser rejects such scripts as a whole.
+    - finish gives the same verdict on the whole script as minimal_parser does.
+    """
+
+    def __init__(self) -> None:
+        # The whole script, as streamed in
+        self.script = ""
+        # The part of the script after its last complete command, without irrelevant characters
+        self._pending = ""
+        self._num_commands = 0
+        self._failed = False
+
+    def feed(self, chunk: str) -> list[ActionTuple]:
+        """Adds a chunk of the script and returns the actions of the commands it completed."""
+        self.script += chunk
+        if self._failed:
+            return []
+        self._pending += chunk.replace(" ", "").replace("\n", "")
+        actions: list[ActionTuple] = []
+        # Every command ends in ")" followed by ";", and thoughts may not contain ")"
+        while (command_end := self._pending.find(")") + 2) > 1 and command_end <= len(self._pending):
+            command_string, self._pending = self._pending[:command_end], self._pending[command_end:]
+            if re.fullmatch(rf"({minimal_parser_act_spec}|{minimal_parser_think_spec});", command_string) is None:
+                self._failed = True
+                return actions
+            self._num_commands += 1
+            command_match = re.match(minimal_parser_act_spec, command_string)
+            # Skip any think actions
+            if command_match is not None:
+                actions += _get_aai_commands_from_script_values(command_match.group(1), int(command_match.group(2)))
+        return actions
+
+    def finish(self) -> Union[
+        tuple[Literal[False], str],
+        tuple[Literal[True], list[ActionTuple]]
+    ]:
+        """Checks the whole script once it has streamed in; all its actions have already been emitted by feed."""
+        if self._failed or self._num_commands == 0 or len(self._pending) > 0:
+            return False, minimal_parser_fail_message + self.script.replace(" ", "").replace("\n", "")
+        return True, []
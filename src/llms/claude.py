@@ -1,5 +1,5 @@
 # https://docs.anthropic.com/claude/docs/quickstart-guide
-from typing import List, Literal, Optional, Union
+from typing import Iterator, List, Literal, Optional, Union
 
 import anthropic
 import numpy as np
@@ -11,6 +11,12 @@ import pickle
 
 import user_settings
 from src.llms.llm import BASE64_STRING, LLMAPI, LLMSession, PromptElement, PROMPT_CONTENTS
+from src.llms.client_pool import CLIENT_POOL
+from src.llms.history import OMITTED_IMAGE_PLACEHOLDER
+from src.llms.prompt_caching import ANTHROPIC_PROMPT_CACHING_BETA, add_anthropic_cache_breakpoints
+from src.llms.retry import CONNECTION_RETRY_POLICY, RetryPolicy, call_with_retries, \
+    get_http_retry_policy
+from src.utilities.observation_store import load_history_file
 
 SupportedAnthropicModels = Literal[
     "claude-3-opus-20240229",
@@ -24,14 +30,23 @@ class AnthropicSession(LLMSession):
 
     # Stops generation beyond these
     stop_sequences = ["<EOS>"]
+    max_tokens = 1024
+
+    _history_content_key = "content"
+    _image_placeholder_block = TextBlockParam(type="text", text=OMITTED_IMAGE_PLACEHOLDER)
 
     def __init__(self,
                  api_key: str,
                  # https://docs.anthropic.com/claude/docs/models-overview
                  model: SupportedAnthropicModels,
+                 # Another region or gateway serving the API, e.g. for hedged requests (see src/llms/hedging.py)
+                 base_url: Optional[str] = None,
                  ) -> None:
         super().__init__()
-        self._client = anthropic.Anthropic(api_key=api_key)
+        self._api_key = api_key
+        self._base_url = base_url
+        # Shared by the sessions of this process (see ClientPool)
+        self._client = CLIENT_POOL.get_client(("anthropic", base_url, api_key), self._create_client)
         self._history: list[MessageParam] = []
         self._model = model
 
@@ -39,22 +54,72 @@ class AnthropicSession(LLMSession):
                 prompt_contents: PROMPT_CONTENTS,
                 resp_prefix: Optional[str] = None
             ):
+        self._add_prompt_to_history(prompt_contents, resp_prefix)
+        message = call_with_retries(
+            lambda: self._client.messages.create(**self._get_request_kwargs()),
+            self._get_retry_policy,
+            self.retry_budget_seconds,
+        )
+        return self._handle_response(message, resp_prefix)
+
+    def stream_prompt(self,
+                      prompt_contents: PROMPT_CONTENTS,
+                      resp_prefix: Optional[str] = None
+                      ) -> Iterator[str]:
+        self._add_prompt_to_history(prompt_contents, resp_prefix)
+        stream_manager = self._client.messages.stream(**self._get_request_kwargs())
+        # Entering the stream manager sends the request
+        with call_with_retries(stream_manager.__enter__, self._get_retry_policy, self.retry_budget_seconds) as stream:
+            yield from stream.text_stream
+            message = stream.get_final_message()
+        self._handle_response(message, resp_prefix)
+
+    def _create_client(self, http_client: httpx.Client) -> anthropic.Anthropic:
+        # Failed requests are retried by call_with_retries rather than the client
+        return anthropic.Anthropic(api_key=self._api_key, base_url=self._base_url, max_retries=0,
+                                   timeout=http_client.timeout, http_client=http_client)
+
+    def _add_prompt_to_history(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str]) -> None:
         prompt = self._prompt_contents_to_prompt(prompt_contents)
 
         self._history.append(MessageParam(role='user', content=prompt))
         if resp_prefix is not None:
             self._history.append(MessageParam(role='assistant', content=resp_prefix))
-        message = self._client.messages.create(
+
+    def _get_request_kwargs(self) -> dict:
+        request_kwargs = dict(
             model=self._model,
-            max_tokens=1024,
+            max_tokens=AnthropicSession.max_tokens,
             temperature=0.0,
-            messages=self._history,
+            messages=self._get_request_history(),
             stop_sequences=AnthropicSession.stop_sequences
         )
+        if self.prompt_caching:
+            request_kwargs["messages"] = add_anthropic_cache_breakpoints(request_kwargs["messages"],
+                                                                         self.shared_prefix_length)
+            request_kwargs["extra_headers"] = {"anthropic-beta": ANTHROPIC_PROMPT_CACHING_BETA}
+        return request_kwargs
+
+    @staticmethod
+    def _get_retry_policy(e: Exception) -> Optional[RetryPolicy]:
+        if isinstance(e, anthropic.APIConnectionError):
+            # Includes timeouts
+            return CONNECTION_RETRY_POLICY
+        if isinstance(e, anthropic.APIStatusError):
+            return get_http_retry_policy(e.status_code)
+        return None
+
+    def _handle_response(self, message: anthropic.types.Message, resp_prefix: Optional[str]) -> str:
         response_content = message.content
 
-        self.input_costs = np.append(self.input_costs, message.usage.input_tokens)
+        # Anthropic's input tokens leave out the tokens read from and written to the cache
+        cache_read_tokens = getattr(message.usage, "cache_read_input_tokens", None) or 0
+        cache_write_tokens = getattr(message.usage, "cache_creation_input_tokens", None) or 0
+        self.input_costs = np.append(self.input_costs,
+                                     message.usage.input_tokens + cache_read_tokens + cache_write_tokens)
         self.output_costs = np.append(self.output_costs, message.usage.output_tokens)
+        self.cache_read_costs = np.append(self.cache_read_costs, cache_read_tokens)
+        self.cache_write_costs = np.append(self.cache_write_costs, cache_write_tokens)
 
         if len(response_content) > 1:
             # TODO: When do we get multiple responses?
@@ -90,16 +155,17 @@ class AnthropicSession(LLMSession):
                                file: str) -> None:
         print("Resetting Claude history for file load")
         assert file[-4:] == ".pkl", "File must be a pickle (.pkl)"
-        with open(file, "rb") as f:
-            try:
-                self._history = pickle.load(f)
-            finally:
-                f.close()
+        # Resolves the observations of histories saved with deduplicate_observations
+        self._history = load_history_file(file)
 
     @property
     def history(self) -> list[MessageParam]:
         return [message for message in self._history]
 
+    @staticmethod
+    def _is_image_block(block) -> bool:
+        return isinstance(block, dict) and block.get("type") == "image"
+
     @staticmethod
     def _prompt_contents_to_prompt(
         prompt_contents: PROMPT_CONTENTS
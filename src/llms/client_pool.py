@@ -0,0 +1,58 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, NamedTuple, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+
+class HttpClientSettings(NamedTuple):
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    # The Anthropic and OpenAI clients' default
+    timeout_seconds: float = 600.0
+
+
+class ClientPool:
+    """Provider clients shared by every session of a process, so that sessions reuse each other's connections.
+
+    Note:
+    - Clients are keyed by what identifies them (e.g. provider, endpoint and key) and by the pool's settings, so
+      changing the settings only affects the clients created afterwards.
+    - A forked process starts with an empty pool, rather than sharing its parent's sockets.
+    """
+
+    def __init__(self, settings: HttpClientSettings = HttpClientSettings()) -> None:
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients: Dict[Hashable, Any] = {}
+
+    def get_client(self, key: Hashable, create_client: Callable[[httpx.Client], T]) -> T:
+        """Returns the pool's client for the key, creating it around a pooled http client if needed."""
+        with self._lock:
+            self._reset_if_forked()
+            key = (key, self.settings)
+            if key not in self._clients:
+                self._clients[key] = create_client(httpx.Client(**self._get_http_client_kwargs()))
+            return self._clients[key]
+
+    def _get_http_client_kwargs(self) -> dict:
+        return dict(
+            limits=httpx.Limits(max_connections=self.settings.max_connections,
+                                max_keepalive_connections=self.settings.max_keepalive_connections),
+            timeout=httpx.Timeout(self.settings.timeout_seconds),
+        )
+
+    def _reset_if_forked(self) -> None:
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._clients = {}
+
+
+CLIENT_POOL = ClientPool()
+
+
+def configure_client_pool(settings: HttpClientSettings) -> None:
+    CLIENT_POOL.settings = settings
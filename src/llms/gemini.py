@@ -1,11 +1,10 @@
 import pickle
 import warnings
-from time import sleep
 
 import google.api_core.exceptions
 
 import user_settings
-from typing import List, Literal, Optional, Union
+from typing import Iterator, List, Literal, Optional, Union
 
 import google.generativeai as genai
 from google.generativeai.types.content_types import (
@@ -15,7 +14,11 @@ from google.generativeai.types.content_types import (
 )
 import numpy as np
 
+from src.llms.history import OMITTED_IMAGE_PLACEHOLDER
 from src.llms.llm import LLMAPI, PROMPT_CONTENTS, LLMSession, PromptElement
+from src.llms.retry import MALFORMED_RESPONSE_RETRY_POLICY, RetryPolicy, call_with_retries, \
+    get_http_retry_policy
+from src.utilities.observation_store import load_history_file
 
 SupportedGeminiModels = Literal["gemini-1.5-flash", "gemini-1.5-pro"]
 
@@ -32,6 +35,10 @@ assistant_role: SupportedGeminiRoles = "model"
 
 class GeminiSession(LLMSession):
     stop_sequences = ["<EOS>"]
+    max_tokens = 1024
+
+    _history_content_key = "parts"
+    _image_placeholder_block = OMITTED_IMAGE_PLACEHOLDER
 
     def __init__(self, api_key: str, model: SupportedGeminiModels) -> None:
         super().__init__()
@@ -44,6 +51,33 @@ class GeminiSession(LLMSession):
         prompt_contents: PROMPT_CONTENTS,
         resp_prefix: Optional[str] = None,
     ) -> str:
+        self._add_prompt_to_history(prompt_contents, resp_prefix)
+        message = call_with_retries(
+            lambda: self._client.generate_content(**self._get_request_kwargs()),
+            self._get_retry_policy,
+            self.retry_budget_seconds,
+        )
+        return self._handle_response(message, resp_prefix)
+
+    def stream_prompt(
+        self,
+        prompt_contents: PROMPT_CONTENTS,
+        resp_prefix: Optional[str] = None,
+    ) -> Iterator[str]:
+        self._add_prompt_to_history(prompt_contents, resp_prefix)
+        message = call_with_retries(
+            lambda: self._client.generate_content(**self._get_request_kwargs(), stream=True),
+            self._get_retry_policy,
+            self.retry_budget_seconds,
+        )
+        for chunk in message:
+            # Chunks without text parts (e.g. one carrying only the finish reason) raise on .text
+            if chunk.parts:
+                yield chunk.text
+        # Once iterated, the message holds the whole response and its usage
+        self._handle_response(message, resp_prefix)
+
+    def _add_prompt_to_history(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str]) -> None:
         # Confirm we have at least one text element
         assert (
             len([True for contents_type, _ in prompt_contents if contents_type.value == PromptElement.Text.value]) > 0
@@ -53,50 +87,37 @@ class GeminiSession(LLMSession):
         if resp_prefix is not None:
             self._history.append(ContentDict(role=assistant_role, parts=[resp_prefix]))
 
-        sleep_time_between_prompt_tries = 20
-        try:
-            message = self._client.generate_content(
-                contents=self._history,
-                generation_config=genai.types.GenerationConfig(
-                    stop_sequences=GeminiSession.stop_sequences,
-                    candidate_count=1,
-                    max_output_tokens=1024,
-                    temperature=0.0,
-                )
+    def _get_request_kwargs(self) -> dict:
+        return dict(
+            contents=self._get_request_history(),
+            generation_config=genai.types.GenerationConfig(
+                stop_sequences=GeminiSession.stop_sequences,
+                candidate_count=1,
+                max_output_tokens=GeminiSession.max_tokens,
+                temperature=0.0,
             )
-        except google.api_core.exceptions.InternalServerError as e:
-            # Retry once on internal errors
-            print(str(e))
-            print(f"wait {sleep_time_between_prompt_tries} seconds and retry")
-            sleep(sleep_time_between_prompt_tries)
-            message = self._client.generate_content(
-                contents=self._history,
-                generation_config=genai.types.GenerationConfig(
-                    stop_sequences=GeminiSession.stop_sequences,
-                    candidate_count=1,
-                    max_output_tokens=1024,
-                    temperature=0.0,
-                )
-            )
-        except Exception as e:
-            if "Unknown field for Candidate" in str(e):
-                print(str(e))
-                print(f"wait {sleep_time_between_prompt_tries} seconds and retry")
-                sleep(sleep_time_between_prompt_tries)
-                message = self._client.generate_content(
-                    contents=self._history,
-                    generation_config=genai.types.GenerationConfig(
-                        stop_sequences=GeminiSession.stop_sequences,
-                        candidate_count=1,
-                        max_output_tokens=1024,
-                        temperature=0.0,
-                    ),
-                )
-            else:
-                raise e
+        )
+
+    @staticmethod
+    def _is_image_block(block) -> bool:
+        return isinstance(block, dict) and "mime_type" in block
 
+    @staticmethod
+    def _get_retry_policy(e: Exception) -> Optional[RetryPolicy]:
+        if isinstance(e, google.api_core.exceptions.GoogleAPICallError):
+            return get_http_retry_policy(e.code)
+        if "Unknown field for Candidate" in str(e):
+            return MALFORMED_RESPONSE_RETRY_POLICY
+        return None
+
+    def _handle_response(self, message: genai.types.GenerateContentResponse, resp_prefix: Optional[str]) -> str:
         self.input_costs = np.append(self.input_costs, message.usage_metadata.prompt_token_count)
         self.output_costs = np.append(self.output_costs, message.usage_metadata.candidates_token_count)
+        # Gemini reports implicitly cached tokens as part of the prompt tokens
+        self.cache_read_costs = np.append(
+            self.cache_read_costs, getattr(message.usage_metadata, "cached_content_token_count", None) or 0
+        )
+        self.cache_write_costs = np.append(self.cache_write_costs, 0)
 
         response_content = message.text
 
@@ -118,11 +139,8 @@ class GeminiSession(LLMSession):
 
     def load_from_history_file(self, file: str) -> None:
         assert file.endswith(".pkl"), "File must be a pickle (.pkl)"
-        with open(file, "rb") as f:
-            try:
-                self._history = pickle.load(f)
-            finally:
-                f.close()
+        # Resolves the observations of histories saved with deduplicate_observations
+        self._history = load_history_file(file)
 
     @staticmethod
     def _prompt_contents_to_prompt(prompt_contents: PROMPT_CONTENTS) -> List[PartType]:
@@ -1,7 +1,7 @@
 import warnings
-from typing import List, Literal, Optional, Union
-from time import sleep
+from typing import Iterator, List, Literal, Optional, Union
 
+import httpx
 import numpy as np
 import pickle
 import openai
@@ -15,12 +15,18 @@ from openai.types.chat.chat_completion_content_part_image_param import (
 from openai.types.chat.chat_completion_content_part_text_param import (
     ChatCompletionContentPartTextParam,
 )
+from openai.types.chat.chat_completion import ChatCompletion
+from openai.types.completion_usage import CompletionUsage
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 from openai.types.chat.chat_completion_user_message_param import (
     ChatCompletionUserMessageParam,
 )
 
+from src.llms.client_pool import CLIENT_POOL
+from src.llms.history import OMITTED_IMAGE_PLACEHOLDER
 from src.llms.llm import LLMAPI, PROMPT_CONTENTS, LLMSession, PromptElement
+from src.llms.retry import CONNECTION_RETRY_POLICY, RetryPolicy, call_with_retries, \
+    get_http_retry_policy
 from user_settings import GPT_API_KEY, GPT_API_ENDPOINT
 
 # https://platform.openai.com/docs/models/gpt-4o
@@ -29,14 +35,25 @@ SupportedGPTModels = Literal["gpt-4o-2024-05-13", "gpt-4o-mini-2024-07-18", "gpt
 
 class GPTSession(LLMSession):
     stop_sequences = ["<EOS>"]
+    max_tokens = 1024
 
-    def __init__(self, api_key: str, model: SupportedGPTModels) -> None:
+    _history_content_key = "content"
+    _image_placeholder_block = ChatCompletionContentPartTextParam(type="text", text=OMITTED_IMAGE_PLACEHOLDER)
+
+    def __init__(self,
+                 api_key: str,
+                 model: SupportedGPTModels,
+                 # Another Azure deployment of the model, e.g. for hedged requests (see src/llms/hedging.py)
+                 endpoint: str = GPT_API_ENDPOINT,
+                 ) -> None:
         print(f"Starting new GPT session.")
         super().__init__()
-        self._client = openai.AzureOpenAI(
-            azure_endpoint=GPT_API_ENDPOINT, # TODO: Fix inconsistency with this vs api key
-            api_key=api_key,
-            api_version="2024-05-01-preview",
+        self._api_key = api_key
+        self._endpoint = endpoint
+        # Shared by the sessions of this process (see ClientPool)
+        self._client = CLIENT_POOL.get_client(
+            ("azure_openai", endpoint, api_key),
+            lambda http_client: openai.AzureOpenAI(**self._get_client_kwargs(http_client)),
         )
         self._history: List[ChatCompletionMessageParam] = []
         self._model = model
@@ -46,6 +63,74 @@ class GPTSession(LLMSession):
         prompt_contents: PROMPT_CONTENTS,
         resp_prefix: Optional[str] = None,
     ) -> str:
+        self._add_prompt_to_history(prompt_contents, resp_prefix)
+        completion = call_with_retries(
+            lambda: self._client.chat.completions.create(**self._get_request_kwargs()),
+            self._get_retry_policy,
+            self.retry_budget_seconds,
+        )
+        return self._handle_completion(completion, resp_prefix)
+
+    def stream_prompt(
+        self,
+        prompt_contents: PROMPT_CONTENTS,
+        resp_prefix: Optional[str] = None,
+    ) -> Iterator[str]:
+        self._add_prompt_to_history(prompt_contents, resp_prefix)
+        stream = call_with_retries(
+            lambda: self._client.chat.completions.create(
+                **self._get_request_kwargs(),
+                stream=True,
+                # The usage is sent in a final chunk without choices
+                stream_options={"include_usage": True},
+            ),
+            self._get_retry_policy,
+            self.retry_budget_seconds,
+        )
+        response_chunks = []
+        finish_reason = None
+        with stream:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    self._record_usage(chunk.usage)
+                if len(chunk.choices) == 0:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                if chunk.choices[0].delta.content:
+                    response_chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        self._add_response_to_history("".join(response_chunks), finish_reason, resp_prefix)
+
+    def _get_client_kwargs(self, http_client: httpx.Client) -> dict:
+        return dict(
+            http_client=http_client,
+            timeout=http_client.timeout,
+            azure_endpoint=self._endpoint, # TODO: Fix inconsistency with this vs api key
+            api_key=self._api_key,
+            api_version="2024-05-01-preview",
+            # Failed requests are retried by call_with_retries rather than the client
+            max_retries=0,
+        )
+
+    def _get_request_kwargs(self) -> dict:
+        return dict(
+            model=self._model,
+            max_tokens=GPTSession.max_tokens,
+            temperature=0.0,
+            messages=self._get_request_history(),
+            stop=GPTSession.stop_sequences,
+        )
+
+    @staticmethod
+    def _get_retry_policy(e: Exception) -> Optional[RetryPolicy]:
+        if isinstance(e, openai.APIConnectionError):
+            # Includes timeouts
+            return CONNECTION_RETRY_POLICY
+        if isinstance(e, openai.APIStatusError):
+            return get_http_retry_policy(e.status_code)
+        return None
+
+    def _add_prompt_to_history(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str]) -> None:
         assert (
             len([True for prompt_type, _ in prompt_contents if prompt_type.value == PromptElement.Text.value]) > 0
         ), "Must have at least 1 " "text element"
@@ -60,39 +145,36 @@ class GPTSession(LLMSession):
                     role="assistant", content=resp_prefix
                 )
             )
-        try:
-            completion = self._client.chat.completions.create(
-                model=self._model,
-                max_tokens=1024,
-                temperature=0.0,
-                messages=self._history,
-                stop=GPTSession.stop_sequences,
-            )
-        except openai.APIStatusError as e:
-            # Retry once on these errors since we see them occasionally
-            print(f"---- caught an APIStatusError error: waiting 1 minute and trying again ----\n error: {e}")
-            sleep(60)
-            completion = self._client.chat.completions.create(
-                model=self._model,
-                max_tokens=1024,
-                temperature=0.0,
-                messages=self._history,
-                stop=GPTSession.stop_sequences,
-            )
-        self.input_costs = np.append(self.input_costs, completion.usage.prompt_tokens)
-        self.output_costs = np.append(
-            self.output_costs, completion.usage.completion_tokens
-        )
 
+    def _handle_completion(self, completion: ChatCompletion, resp_prefix: Optional[str]) -> str:
+        self._record_usage(completion.usage)
         # Note: For GPT API, the message content is provided as an optional string alone rather
         # than a List[ContentBlock] as it is the case for Claude API. See completion response format:
         # https://platform.openai.com/docs/guides/chat-completions/response-format
         choice = completion.choices[0]
-        response_content = choice.message.content
+        return self._add_response_to_history(choice.message.content, choice.finish_reason, resp_prefix)
+
+    def _record_usage(self, usage: CompletionUsage) -> None:
+        self.input_costs = np.append(self.input_costs, usage.prompt_tokens)
+        self.output_costs = np.append(
+            self.output_costs, usage.completion_tokens
+        )
+        # OpenAI caches the prefixes of long prompts without being asked, and includes cache reads in the prompt tokens
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        self.cache_read_costs = np.append(
+            self.cache_read_costs, getattr(prompt_tokens_details, "cached_tokens", None) or 0
+        )
+        self.cache_write_costs = np.append(self.cache_write_costs, 0)
+
+    def _add_response_to_history(self,
+                                 response_content: Optional[str],
+                                 finish_reason: Optional[str],
+                                 resp_prefix: Optional[str],
+                                 ) -> str:
         if response_content is None:
             raise ValueError(f"Unexpected empty response.")
-        if completion.choices[0].finish_reason != "stop":
-            warnings.warn(f"Non-standard completion finish reason: {choice.finish_reason}")
+        if finish_reason != "stop":
+            warnings.warn(f"Non-standard completion finish reason: {finish_reason}")
         if resp_prefix is not None:
             self._history.pop()
             self._history.append(
@@ -109,6 +191,10 @@ class GPTSession(LLMSession):
             )
         return response_content
 
+    @staticmethod
+    def _is_image_block(block) -> bool:
+        return isinstance(block, dict) and block.get("type") == "image_url"
+
     def artificial_prompt(
         self,
         prompt_contents: PROMPT_CONTENTS,
@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, as_completed, wait
+from os.path import join
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from src.llms.llm import DelegatingSession, LLMSession, PROMPT_CONTENTS
+from src.utilities.background_writer import BackgroundWriter, save_array
+
+# Indices of the replicas that requests are sent to
+PRIMARY_REPLICA = 0
+SECONDARY_REPLICA = 1
+HEDGE_WINNERS_FILE_NAME = "hedge_winners.npy"
+# The tokens of the losing requests, which the cost arrays leave out
+HEDGE_LOSER_INPUT_COSTS_FILE_NAME = "costs_hedge_loser_input.npy"
+HEDGE_LOSER_OUTPUT_COSTS_FILE_NAME = "costs_hedge_loser_output.npy"
+
+
+class LatencyTracker:
+    """The latencies of recent responses, whose percentile sets how long a request may take before it is hedged.
+
+    Note:
+    - Until enough responses have been timed, requests are hedged after initial_deadline_seconds.
+    - Trackers are meant to outlive sessions, so that each arena's session starts from the latencies seen so far. A
+      pickled tracker (e.g. in a parallel arena's worker) carries on from a copy of those latencies.
+    """
+
+    def __init__(self,
+                 percentile: float = 95,
+                 window: int = 100,
+                 min_samples: int = 10,
+                 initial_deadline_seconds: float = 30.0,
+                 ) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_deadline_seconds = initial_deadline_seconds
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # Experiments, and the trackers they keep, are pickled to the processes running parallel arenas
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, latency_seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(latency_seconds)
+
+    @property
+    def deadline_seconds(self) -> float:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_deadline_seconds
+            return float(np.percentile(self._latencies, self.percentile))
+
+
+class HedgedSession(DelegatingSession):
+    """Sends each prompt to the primary replica and, if no response has arrived by the latency tracker's deadline (or
+    the primary fails), sends it again to the secondary replica; the first successful response is kept.
+
+    Note:
+    - Each request is made by a replica session from create_replica (given the replica's index), started from the
+      wrapped session's history, costs and settings. The winner's history and costs are then copied to the wrapped
+      session, so a losing request that is still running never changes the conversation.
+    - Replicas are created once and reused by the later requests to their index; another replica is only created while
+      a losing request is still running on the idle one. Replicas that limit their rate (see RateLimitedSession) are
+      thereby charged for every request, including the losing ones.
+    - Losing requests are left to finish in the background. Their tokens are kept apart from the cost arrays, in
+      loser_input_costs and loser_output_costs, and are saved next to them together with the index of the replica that
+      answered each prompt.
+    """
+
+    def __init__(self,
+                 session: LLMSession,
+                 create_replica: Callable[[int], LLMSession],
+                 latency_tracker: LatencyTracker,
+                 ) -> None:
+        super().__init__(session)
+        self.create_replica = create_replica
+        self.latency_tracker = latency_tracker
+        self.winners: List[int] = []
+        self.num_hedged_prompts = 0
+        # Appended to by the losing requests' threads as they finish
+        self.loser_input_costs: List[int] = []
+        self.loser_output_costs: List[int] = []
+        self._idle_replicas: Dict[int, List[LLMSession]] = {PRIMARY_REPLICA: [], SECONDARY_REPLICA: []}
+        self._replicas_lock = threading.Lock()
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        start_time = time.monotonic()
+        requests = [self._start_request(PRIMARY_REPLICA, prompt_contents, resp_prefix)]
+        wait(requests, timeout=self.latency_tracker.deadline_seconds)
+        if not requests[0].done() or requests[0].exception() is not None:
+            self.num_hedged_prompts += 1
+            requests.append(self._start_request(SECONDARY_REPLICA, prompt_contents, resp_prefix))
+        winning_request = self._get_first_response(requests)
+        self.latency_tracker.record(time.monotonic() - start_time)
+        for request in requests:
+            if request is not winning_request:
+                request.add_done_callback(self._record_loser_costs)
+
+        replica_index, history, costs, response = winning_request.result()
+        self.session.reset_history(history, self._arena_start_index)
+        self.input_costs = np.append(self.input_costs, costs[0])
+        self.output_costs = np.append(self.output_costs, costs[1])
+        self.cache_read_costs = np.append(self.cache_read_costs, costs[2])
+        self.cache_write_costs = np.append(self.cache_write_costs, costs[3])
+        self.winners.append(replica_index)
+        return response
+
+    def stream_prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> Iterator[str]:
+        # Responses are only known to have won once complete
+        yield self.prompt(prompt_contents, resp_prefix)
+
+    def save_cost_arrays(self, cost_folder_path: str = "./", writer: Optional[BackgroundWriter] = None):
+        super().save_cost_arrays(cost_folder_path, writer)
+        winners = np.array(self.winners)
+        if writer is None:
+            save_array(join(cost_folder_path, HEDGE_WINNERS_FILE_NAME), winners)
+        else:
+            writer.submit(save_array, join(cost_folder_path, HEDGE_WINNERS_FILE_NAME), winners)
+        for file_name, costs in [(HEDGE_LOSER_INPUT_COSTS_FILE_NAME, np.array(self.loser_input_costs)),
+                                 (HEDGE_LOSER_OUTPUT_COSTS_FILE_NAME, np.array(self.loser_output_costs))]:
+            if writer is None:
+                save_array(join(cost_folder_path, file_name), costs)
+            else:
+                writer.submit(save_array, join(cost_folder_path, file_name), costs)
+
+    def _start_request(self, replica_index: int, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str]) -> Future:
+        """Sends the prompt from an idle replica, whose result is its index, history, last costs and response."""
+        with self._replicas_lock:
+            idle_replicas = self._idle_replicas[replica_index]
+            replica = idle_replicas.pop() if len(idle_replicas) > 0 else self.create_replica(replica_index)
+        replica.reset_history(self.history, self._arena_start_index)
+        # So that the replica's rate limiter estimates the request from the conversation's last request
+        replica.input_costs = self.input_costs
+        replica.output_costs = self.output_costs
+        replica.cache_read_costs = self.cache_read_costs
+        replica.cache_write_costs = self.cache_write_costs
+        replica.set_history_policy(self.history_policy)
+        replica.set_prompt_caching(self.prompt_caching, self.shared_prefix_length)
+        request = Future()
+
+        def run_request() -> None:
+            try:
+                response = replica.prompt(prompt_contents, resp_prefix)
+                costs = (replica.input_costs[-1], replica.output_costs[-1],
+                         replica.cache_read_costs[-1], replica.cache_write_costs[-1])
+                result = (replica_index, replica.history, costs, response)
+            except BaseException as e:
+                self._release_replica(replica_index, replica)
+                request.set_exception(e)
+                return
+            # Released before the result is set, so that the next prompt finds the replica idle
+            self._release_replica(replica_index, replica)
+            request.set_result(result)
+
+        # Daemon threads, so that a losing request never delays the process's exit
+        threading.Thread(target=run_request, daemon=True).start()
+        return request
+
+    def _release_replica(self, replica_index: int, replica: LLMSession) -> None:
+        with self._replicas_lock:
+            self._idle_replicas[replica_index].append(replica)
+
+    def _record_loser_costs(self, request: Future) -> None:
+        if request.exception() is None:
+            _, _, costs, _ = request.result()
+            self.loser_input_costs.append(int(costs[0]))
+            self.loser_output_costs.append(int(costs[1]))
+
+    @staticmethod
+    def _get_first_response(requests: List[Future]) -> Future:
+        """Returns the first successful request, or raises the primary's error if every request failed."""
+        for request in as_completed(requests):
+            if request.exception() is None:
+                return request
+        raise requests[0].exception()
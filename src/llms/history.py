@@ -0,0 +1,58 @@
+from typing import Any, Callable, List, NamedTuple, Optional
+
+# Replaces the images that a history policy leaves out of a request
+OMITTED_IMAGE_PLACEHOLDER = "[earlier observation omitted]"
+
+
+class HistoryPolicy(NamedTuple):
+    """Which images of a session's history are resent with every prompt; text is always resent.
+
+    Note:
+    - max_images keeps only the most recent images (None keeps all of them).
+    - current_arena_only drops the images of the arenas before the current one (see LLMSession.mark_arena_start).
+    - The session's own history is never modified, so saved histories still contain every image.
+    - Pruning changes earlier messages as the window slides, which defeats provider-side prompt caching of them.
+    """
+    max_images: Optional[int] = None
+    current_arena_only: bool = False
+
+    @property
+    def keeps_all_images(self) -> bool:
+        return self.max_images is None and not self.current_arena_only
+
+
+def prune_history_images(history: List[Any],
+                         policy: HistoryPolicy,
+                         arena_start_index: int,
+                         content_key: str,
+                         is_image_block: Callable[[Any], bool],
+                         placeholder_block: Any,
+                         ) -> List[Any]:
+    """Returns a copy of the history in which the images that the policy leaves out are replaced by placeholders.
+
+    Messages are dicts whose content_key holds either a list of blocks or, e.g. for plain text, any other value.
+    """
+    if policy.keeps_all_images:
+        return history
+    first_index_with_images = arena_start_index if policy.current_arena_only else 0
+    num_images_kept = 0
+    pruned_history = []
+    # Walk backwards, so that the most recent images are the ones kept
+    for index in reversed(range(len(history))):
+        message = history[index]
+        content = message.get(content_key)
+        if not isinstance(content, list) or not any(is_image_block(block) for block in content):
+            pruned_history.append(message)
+            continue
+        pruned_content = []
+        for block in reversed(content):
+            keep = (
+                not is_image_block(block)
+                or (index >= first_index_with_images
+                    and (policy.max_images is None or num_images_kept < policy.max_images))
+            )
+            if is_image_block(block) and keep:
+                num_images_kept += 1
+            pruned_content.append(block if keep else placeholder_block)
+        pruned_history.append({**message, content_key: list(reversed(pruned_content))})
+    return list(reversed(pruned_history))
@@ -21,6 +21,8 @@ class HumanSession(LLMSession):
         self._history: List[LLMMessageParam] = []
         self.input_costs = []
         self.output_costs = []
+        self.cache_read_costs = []
+        self.cache_write_costs = []
 
     def prompt(
         self,
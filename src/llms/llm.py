@@ -1,14 +1,21 @@
 from os.path import join
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Optional, Union, Literal, TypedDict, List
+from typing import Iterator, Optional, Union, Literal, TypedDict, List
 from enum import Enum
 import pickle
 
 import numpy as np
 from numpy.typing import NDArray
 
+from src.llms.history import HistoryPolicy, prune_history_images
+from src.llms.prompt_caching import get_cache_hit_rate
+from src.llms.retry import DEFAULT_RETRY_BUDGET_SECONDS
+from src.utilities.background_writer import BackgroundWriter, save_array
+from src.utilities.observation_store import ObservationStore
+
 BASE64_STRING = str
+HISTORY_FILE_NAME_PREFIX = "llm_session_history_"
 
 
 
@@ -31,10 +38,26 @@ class LLMSession(ABC):
     General interface for a single session with an LLM
     """
 
+    # How requests are pruned by the history policy (see src/llms/history.py): the key of a history message's blocks,
+    # how to recognise image blocks and what to replace them with. Sessions without a key are never pruned.
+    _history_content_key: Optional[str] = None
+    _image_placeholder_block = None
+    # Time a prompt may spend waiting to retry failed requests (see src/llms/retry.py)
+    retry_budget_seconds = DEFAULT_RETRY_BUDGET_SECONDS
+
     def __init__(self):
         self.input_costs: NDArray[int] = np.array([])
         self.output_costs: NDArray[int] = np.array([])
+        # The parts of the input costs read from and written to the provider's prompt cache
+        self.cache_read_costs: NDArray[int] = np.array([])
+        self.cache_write_costs: NDArray[int] = np.array([])
+        self.prompt_caching = False
+        # The number of blocks at the start of the first message that every conversation starts with
+        self.shared_prefix_length: Optional[int] = None
         self._history = None
+        self.history_policy = HistoryPolicy()
+        # Index in the history of the first message of the current arena
+        self._arena_start_index = 0
 
     @abstractmethod
     def prompt(
@@ -44,6 +67,65 @@ class LLMSession(ABC):
     ) -> str:
         pass
 
+    def stream_prompt(
+            self,
+            prompt_contents: PROMPT_CONTENTS,
+            resp_prefix: Optional[str] = None,
+    ) -> Iterator[str]:
+        """Streaming version of prompt, yielding the response's text as it arrives.
+
+        The response is added to the history once it has been read to the end. Sessions without a streaming client
+        yield the whole response at once.
+        """
+        yield self.prompt(prompt_contents, resp_prefix)
+
+    def reset_history(self, history: Optional[list] = None, arena_start_index: int = 0) -> None:
+        """Replaces the conversation, by default with an empty one; the costs recorded so far are kept."""
+        self._history = [] if history is None else list(history)
+        self._arena_start_index = arena_start_index
+
+    def set_history_policy(self, history_policy: HistoryPolicy) -> None:
+        self.history_policy = history_policy
+
+    def set_prompt_caching(self, prompt_caching: bool, shared_prefix_length: Optional[int] = None) -> None:
+        """Asks the provider to cache the prefix that the session's requests share, where it needs to be asked.
+
+        The shared prefix, if its length is given, is cached on its own too, for the other conversations that start
+        with it.
+        """
+        self.prompt_caching = prompt_caching
+        self.shared_prefix_length = shared_prefix_length
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return get_cache_hit_rate(self.input_costs, self.cache_read_costs)
+
+    @property
+    def last_request_input_tokens(self) -> int:
+        """The input tokens of the last request, which carried the whole history, so they estimate the history's size."""
+        return int(self.input_costs[-1]) if len(self.input_costs) > 0 else 0
+
+    def mark_arena_start(self) -> None:
+        """Marks the start of a new arena, whose images are the only ones kept by a current_arena_only policy."""
+        self._arena_start_index = len(self.history)
+
+    def _get_request_history(self) -> list:
+        """Returns the history to send with the next request, with the images left out by the history policy."""
+        if self._history_content_key is None:
+            return self._history
+        return prune_history_images(
+            self._history,
+            self.history_policy,
+            self._arena_start_index,
+            self._history_content_key,
+            self._is_image_block,
+            self._image_placeholder_block,
+        )
+
+    @staticmethod
+    def _is_image_block(block) -> bool:
+        return False
+
     @abstractmethod
     def artificial_prompt(
         self,
@@ -63,25 +145,52 @@ class LLMSession(ABC):
         self._history = value
 
     def write_to_file(self,
-                      file_name: str = "llm_session_history_",
+                      file_name: str = HISTORY_FILE_NAME_PREFIX,
                       path: str = "./",
-                      write_from_index: int = 0) -> None:
+                      write_from_index: int = 0,
+                      writer: Optional[BackgroundWriter] = None,
+                      observation_store: Optional[ObservationStore] = None) -> None:
+        """Writes the history as text (from write_from_index) and as a pickle, on the writer's thread if given.
+
+        With an observation store, the written history refers to its images by hash (see ObservationStore).
+        """
         time = datetime.now().strftime("%Y%m%d%H%M%S")
         print(f"Saving conversation history to {path + file_name + time}.txt")
-        with open(f"{path + file_name + time}.txt", "a") as f:
+        # Snapshot the history, since the session may carry on while the writer is busy
+        history = list(self.history)
+        if writer is None:
+            self._write_history(history, path + file_name + time, write_from_index, observation_store)
+        else:
+            writer.submit(self._write_history, history, path + file_name + time, write_from_index, observation_store)
+
+    @staticmethod
+    def _write_history(history: list,
+                       file_path_without_extension: str,
+                       write_from_index: int,
+                       observation_store: Optional[ObservationStore]) -> None:
+        if observation_store is not None:
+            history = observation_store.reference_history(history)
+        with open(f"{file_path_without_extension}.txt", "a") as f:
             try:
-                f.write("\n".join([str(message) for message in self.history[write_from_index:]]))
+                f.write("\n".join([str(message) for message in history[write_from_index:]]))
             finally:
                 f.close()
-        with open(f"{path + file_name + time}.pkl", "wb") as f:
+        with open(f"{file_path_without_extension}.pkl", "wb") as f:
             try:
-                pickle.dump(self.history, f)
+                pickle.dump(history, f)
             finally:
                 f.close()
 
-    def save_cost_arrays(self, cost_folder_path: str = "./"):
-        np.save(join(cost_folder_path, "costs_input.npy"), self.input_costs)
-        np.save(join(cost_folder_path, "costs_output.npy"), self.output_costs)
+    def save_cost_arrays(self, cost_folder_path: str = "./", writer: Optional[BackgroundWriter] = None):
+        # Cost arrays are replaced rather than modified when prompting, so the current ones can be written later
+        for file_name, costs in [("costs_input.npy", self.input_costs),
+                                 ("costs_output.npy", self.output_costs),
+                                 ("costs_cache_read.npy", self.cache_read_costs),
+                                 ("costs_cache_write.npy", self.cache_write_costs)]:
+            if writer is None:
+                save_array(join(cost_folder_path, file_name), costs)
+            else:
+                writer.submit(save_array, join(cost_folder_path, file_name), costs)
 
     @abstractmethod
     def load_from_history_file(self,
@@ -93,6 +202,80 @@ class LLMSession(ABC):
         pass
 
 
+def _delegated_attribute(name: str) -> property:
+    return property(lambda self: getattr(self.session, name), lambda self, value: setattr(self.session, name, value))
+
+
+class DelegatingSession(LLMSession):
+    """A session that passes every call on to the session it wraps; subclasses override the calls they change.
+
+    The wrapped session keeps the history, costs and settings, which are read through the wrapper.
+    """
+
+    # Cost arrays are replaced rather than modified, which must happen on the wrapped session
+    input_costs = _delegated_attribute("input_costs")
+    output_costs = _delegated_attribute("output_costs")
+    cache_read_costs = _delegated_attribute("cache_read_costs")
+    cache_write_costs = _delegated_attribute("cache_write_costs")
+
+    def __init__(self, session: LLMSession) -> None:
+        self.session = session
+
+    def __getattr__(self, name: str):
+        # Only called for attributes the wrapper lacks, e.g. input_costs
+        if name == "session":
+            raise AttributeError(name)
+        return getattr(self.session, name)
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        return self.session.prompt(prompt_contents, resp_prefix)
+
+    def stream_prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> Iterator[str]:
+        yield from self.session.stream_prompt(prompt_contents, resp_prefix)
+
+    def artificial_prompt(self, prompt_contents: PROMPT_CONTENTS, response_contents: PROMPT_CONTENTS) -> None:
+        self.session.artificial_prompt(prompt_contents, response_contents)
+
+    def reset_history(self, history: Optional[list] = None, arena_start_index: int = 0) -> None:
+        self.session.reset_history(history, arena_start_index)
+
+    def set_history_policy(self, history_policy: HistoryPolicy) -> None:
+        self.session.set_history_policy(history_policy)
+
+    def set_prompt_caching(self, prompt_caching: bool, shared_prefix_length: Optional[int] = None) -> None:
+        self.session.set_prompt_caching(prompt_caching, shared_prefix_length)
+
+    def mark_arena_start(self) -> None:
+        self.session.mark_arena_start()
+
+    @property
+    def last_request_input_tokens(self) -> int:
+        return self.session.last_request_input_tokens
+
+    @property
+    def history(self) -> list:
+        return self.session.history
+
+    def save_cost_arrays(self, cost_folder_path: str = "./", writer: Optional[BackgroundWriter] = None):
+        # Wrappers that save more than the costs (e.g. HedgedSession) still do so when wrapped themselves
+        self.session.save_cost_arrays(cost_folder_path, writer)
+
+    def load_from_history_file(self, file: str) -> None:
+        self.session.load_from_history_file(file)
+
+    @property
+    def innermost_session(self) -> LLMSession:
+        """The provider session at the bottom of the stack of wrappers, e.g. for its class's request settings."""
+        session = self.session
+        while isinstance(session, DelegatingSession):
+            session = session.session
+        return session
+
+    def get_assistant_commands_from_pkl_history(self, path_to_pkl: str) -> List[str]:
+        # Wrappers save their provider session's histories, so only an instance knows how to read them
+        return type(self.innermost_session).get_assistant_commands_from_pkl_history(path_to_pkl)
+
+
 class LLMAPI(ABC):
     """
     General interface for an LLM
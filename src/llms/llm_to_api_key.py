@@ -6,4 +6,6 @@ llm_to_api_key = {
     "gpt": user_settings.GPT_API_KEY,
     "gemini": user_settings.GEMINI_API_KEY,
     "recording": "place_holder_key"
-}
\ No newline at end of file
+}
+# The key of the hedge_endpoint option's deployment, if it differs from the primary one's
+hedge_api_key = getattr(user_settings, "HEDGE_API_KEY", None)
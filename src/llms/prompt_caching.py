@@ -0,0 +1,46 @@
+from typing import List, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+# https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+ANTHROPIC_PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def add_anthropic_cache_breakpoints(messages: List[dict], shared_prefix_length: Optional[int] = None) -> List[dict]:
+    """Returns a copy of the messages with cache breakpoints after the shared prefix and the last user message.
+
+    Note:
+    - The shared prefix is the first shared_prefix_length blocks of the first message, i.e. the background prompt and
+      n-shot examples that every conversation starts with, so that other conversations (e.g. the next arena's) read it
+      from the cache. Without a length, the whole first message is taken to be shared.
+    - The breakpoint after the last user message lets the next request read the whole conversation so far from the cache.
+    - Prefixes shorter than the model's minimum cacheable length are simply not cached.
+    """
+    user_message_indices = [
+        index for index, message in enumerate(messages)
+        if message["role"] == "user" and isinstance(message["content"], list) and len(message["content"]) > 0
+    ]
+    if len(user_message_indices) == 0:
+        return messages
+    first_content_length = len(messages[user_message_indices[0]]["content"])
+    breakpoints = [(user_message_indices[-1], -1)]
+    if shared_prefix_length is None or shared_prefix_length >= first_content_length:
+        breakpoints.append((user_message_indices[0], -1))
+    elif shared_prefix_length > 0:
+        breakpoints.append((user_message_indices[0], shared_prefix_length - 1))
+    marked_messages = list(messages)
+    for index, block_index in breakpoints:
+        content = list(marked_messages[index]["content"])
+        content[block_index] = {**content[block_index], "cache_control": ANTHROPIC_CACHE_CONTROL}
+        marked_messages[index] = {**messages[index], "content": content}
+    return marked_messages
+
+
+def get_cache_hit_rate(input_costs: NDArray[int], cache_read_costs: NDArray[int]) -> float:
+    """Returns the fraction of the input tokens that were read from the provider's cache."""
+    total_input_tokens = np.sum(input_costs)
+    if total_input_tokens == 0:
+        return 0.0
+    return float(np.sum(cache_read_costs) / total_input_tokens)
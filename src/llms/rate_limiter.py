@@ -0,0 +1,171 @@
+import base64
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from os.path import join
+from typing import Iterator, Optional
+
+from PIL import Image
+
+from src.llms.llm import DelegatingSession, LLMSession, PROMPT_CONTENTS, PromptElement
+from src.vision.compression import estimate_image_tokens
+
+# Where the limiters of all the processes on a host keep their state, unless given another folder
+DEFAULT_RATE_LIMIT_STATE_FOLDER_PATH = join(tempfile.gettempdir(), "llm_rate_limits")
+# Text is estimated at about four characters per token for all providers
+CHARACTERS_PER_TOKEN = 4
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock_file(file) -> None:
+        # Locks the state file's first byte, retrying for about ten seconds, far longer than any holder keeps it
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock_file(file) -> None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(file) -> None:
+        fcntl.flock(file, fcntl.LOCK_EX)
+
+    def _unlock_file(file) -> None:
+        fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """Token buckets for the requests and input tokens per minute of a provider's model, shared by every process on the
+    host through a file-locked state file.
+
+    Note:
+    - Like the providers' own limits, each bucket holds up to a minute of quota and refills continuously, so requests
+      are admitted at a steady rate once the first minute's quota is spent.
+    - Requests are admitted on an estimate of their input tokens; record_usage corrects the bucket once their actual
+      usage is known, which may leave the bucket in debt.
+    """
+
+    def __init__(self,
+                 llm_family: str,
+                 model: str,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 state_folder_path: str = DEFAULT_RATE_LIMIT_STATE_FOLDER_PATH,
+                 ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        os.makedirs(state_folder_path, exist_ok=True)
+        self._state_path = join(state_folder_path, f"{llm_family}-{model}.json")
+
+    def acquire(self, estimated_tokens: int) -> None:
+        """Waits until a request of the estimated number of input tokens fits within the limits."""
+        while (wait_time := self._try_acquire(estimated_tokens)) > 0:
+            time.sleep(wait_time)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Charges (or refunds) the difference between a request's actual and estimated input tokens."""
+        with self._lock_state() as state:
+            state["tokens"] -= actual_tokens - self._cap_tokens(estimated_tokens)
+
+    def _try_acquire(self, estimated_tokens: int) -> float:
+        """Takes the request from the buckets if it fits and returns 0, or returns the time to wait until it fits."""
+        tokens = self._cap_tokens(estimated_tokens)
+        with self._lock_state() as state:
+            wait_times = [0.0]
+            if self.requests_per_minute is not None and state["requests"] < 1:
+                wait_times.append((1 - state["requests"]) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute is not None and state["tokens"] < tokens:
+                wait_times.append((tokens - state["tokens"]) * 60 / self.tokens_per_minute)
+            if max(wait_times) == 0:
+                state["requests"] -= 1
+                state["tokens"] -= tokens
+            return max(wait_times)
+
+    def _cap_tokens(self, tokens: int) -> int:
+        # Requests larger than the bucket are admitted once it is full, rather than never
+        return tokens if self.tokens_per_minute is None else min(tokens, self.tokens_per_minute)
+
+    def _lock_state(self) -> "_LockedState":
+        return _LockedState(self._state_path, self.requests_per_minute, self.tokens_per_minute)
+
+
+class _LockedState:
+    """The refilled state of a limiter's buckets, written back when the lock on its file is released."""
+
+    def __init__(self, state_path: str, requests_per_minute: Optional[int], tokens_per_minute: Optional[int]) -> None:
+        self._state_path = state_path
+        self._capacities = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+
+    def __enter__(self) -> dict:
+        self._file = open(self._state_path, "a+")
+        _lock_file(self._file)
+        self._file.seek(0)
+        contents = self._file.read()
+        now = time.time()
+        state = json.loads(contents) if contents else {"requests": math.inf, "tokens": math.inf, "updated": now}
+        for bucket, capacity in self._capacities.items():
+            # Unlimited buckets are kept full, in case another process does limit them
+            state[bucket] = math.inf if capacity is None else min(
+                capacity, state[bucket] + (now - state["updated"]) * capacity / 60
+            )
+        state["updated"] = now
+        self._state = state
+        return state
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            self._file.seek(0)
+            self._file.truncate()
+            json.dump(self._state, self._file)
+            self._file.flush()
+        finally:
+            _unlock_file(self._file)
+            self._file.close()
+
+
+class RateLimitedSession(DelegatingSession):
+    """Waits for the rate limiter to admit each request before prompting the session it wraps."""
+
+    def __init__(self, session: LLMSession, llm_family: str, rate_limiter: RateLimiter) -> None:
+        super().__init__(session)
+        self.llm_family = llm_family
+        self.rate_limiter = rate_limiter
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        estimated_tokens = self._estimate_request_tokens(prompt_contents)
+        self.rate_limiter.acquire(estimated_tokens)
+        response = self.session.prompt(prompt_contents, resp_prefix)
+        self.rate_limiter.record_usage(estimated_tokens, int(self.input_costs[-1]))
+        return response
+
+    def stream_prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> Iterator[str]:
+        estimated_tokens = self._estimate_request_tokens(prompt_contents)
+        self.rate_limiter.acquire(estimated_tokens)
+        yield from self.session.stream_prompt(prompt_contents, resp_prefix)
+        self.rate_limiter.record_usage(estimated_tokens, int(self.input_costs[-1]))
+
+    def _estimate_request_tokens(self, prompt_contents: PROMPT_CONTENTS) -> int:
+        # Requests resend the history, which the previous request and its response add up to
+        history_tokens = 0
+        if len(self.history) > 0 and len(self.input_costs) > 0:
+            history_tokens = int(self.input_costs[-1] + self.output_costs[-1])
+        return history_tokens + estimate_prompt_tokens(self.llm_family, prompt_contents)
+
+
+def estimate_prompt_tokens(llm_family: str, prompt_contents: PROMPT_CONTENTS) -> int:
+    """Estimates the input tokens of a prompt, with its images estimated from their size as llm_family bills them."""
+    tokens = 0
+    for element_type, content in prompt_contents:
+        if element_type.value == PromptElement.Image.value:
+            # Only the jpeg's header is decoded to find its size
+            width, height = Image.open(io.BytesIO(base64.b64decode(content))).size
+            tokens += estimate_image_tokens(llm_family, width, height)
+        else:
+            tokens += math.ceil(len(content) / CHARACTERS_PER_TOKEN)
+    return tokens
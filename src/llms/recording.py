@@ -1,5 +1,6 @@
 from typing import Optional, Union, List
 from src.llm_scripting.minimal_parser import minimal_parser
+from src.llms.history import HistoryPolicy
 from src.llms.llm import LLMAPI, LLMSession, BASE64_STRING, PROMPT_CONTENTS, PromptElement, LLMMessageParam
 import pickle
 import numpy as np
@@ -27,6 +28,8 @@ class RecordingSession(LLMSession):
         self._history: list[LLMMessageParam] = []
         self.input_costs = np.array([])
         self.output_costs = np.array([])
+        self.cache_read_costs = np.array([])
+        self.cache_write_costs = np.array([])
         self.responses = load_responses(os.environ.get('RECORDING_LOCATION')) if os.environ.get(
             'RECORDING_LOCATION') is not None else load_responses(DEFAULT_RECORDING_LOCATION)
         self.switch_session = switch_session
@@ -88,6 +91,26 @@ class RecordingSession(LLMSession):
             return self.switch_session.history
         return [block for block in self._history]
 
+    def reset_history(self, history: Optional[list] = None, arena_start_index: int = 0) -> None:
+        super().reset_history(history, arena_start_index)
+        if self.switch_session is not None:
+            self.switch_session.reset_history(history, arena_start_index)
+
+    def set_history_policy(self, history_policy: HistoryPolicy) -> None:
+        super().set_history_policy(history_policy)
+        if self.switch_session is not None:
+            self.switch_session.set_history_policy(history_policy)
+
+    def set_prompt_caching(self, prompt_caching: bool, shared_prefix_length: Optional[int] = None) -> None:
+        super().set_prompt_caching(prompt_caching, shared_prefix_length)
+        if self.switch_session is not None:
+            self.switch_session.set_prompt_caching(prompt_caching, shared_prefix_length)
+
+    def mark_arena_start(self) -> None:
+        super().mark_arena_start()
+        if self.switch_session is not None:
+            self.switch_session.mark_arena_start()
+
     def _current_tokens_in_history(self) -> int:
         tokens_per_block = [
             self._get_tokens_str(prompt_block) if block_type == PromptElement.Text else self._get_tokens_img(prompt_block) for block_type, prompt_block in self._history
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from os.path import join
+from typing import Any, Iterator, List, Literal, NamedTuple, Optional
+
+import numpy as np
+
+from src.llms.llm import DelegatingSession, LLMSession, PROMPT_CONTENTS, PromptElement
+from src.utilities.background_writer import BackgroundWriter, save_array
+from src.utilities.observation_store import BASE64_JPEG_PREFIX, JPEG_DATA_URL_PREFIX
+
+ResponseCacheMode = Literal["read_through", "write_only", "bypass"]
+RESPONSE_CACHE_MODES = ["read_through", "write_only", "bypass"]
+RESPONSE_CACHE_HITS_FILE_NAME = "response_cache_hits.npy"
+
+
+class CachedResponse(NamedTuple):
+    response: str
+    input_tokens: int
+    output_tokens: int
+    cache_read_tokens: int
+    cache_write_tokens: int
+
+
+class ResponseCache:
+    """LLM responses keyed by the request that produced them, in a SQLite database evicted least recently used first.
+
+    Note:
+    - Responses are only reused by sessions prompted at temperature 0, where the same request gets the same response.
+    - Once the responses add up to more than max_size_bytes, the least recently used ones are evicted.
+    - Like the results store, the database keeps SQLite's rollback journal, so parallel arenas and workers on other
+      hosts can share it through a filesystem that supports file locking.
+    """
+
+    def __init__(self, db_path: str, max_size_bytes: int) -> None:
+        self._db_path = db_path
+        self.max_size_bytes = max_size_bytes
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    request_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    input_tokens INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL,
+                    cache_read_tokens INTEGER NOT NULL,
+                    cache_write_tokens INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS last_used_index ON responses (last_used)")
+
+    def get(self, request_key: str) -> Optional[CachedResponse]:
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(CachedResponse._fields)} FROM responses WHERE request_key = ?",
+                (request_key,),
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE responses SET last_used = ? WHERE request_key = ?",
+                                   (time.time(), request_key))
+        return None if row is None else CachedResponse(*row)
+
+    def put(self, request_key: str, cached_response: CachedResponse) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO responses (request_key, {', '.join(CachedResponse._fields)}, size, last_used) "
+                f"VALUES (?, {', '.join('?' for _ in CachedResponse._fields)}, ?, ?)",
+                (request_key, *cached_response, len(cached_response.response.encode("utf-8")), time.time()),
+            )
+            self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        for request_key, size in connection.execute("SELECT request_key, size FROM responses ORDER BY last_used"):
+            connection.execute("DELETE FROM responses WHERE request_key = ?", (request_key,))
+            total_size -= size
+            if total_size <= self.max_size_bytes:
+                return
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self._db_path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+class CachedSession(DelegatingSession):
+    """Answers prompts from a response cache when the wrapped session would be sent a request it was sent before.
+
+    Note:
+    - A request is keyed by the session's provider, model, stop sequences, max_tokens and history policy, and by its
+      history and prompt, with images replaced by their hashes.
+    - With read_through, cached responses are added to the history (see artificial_prompt) instead of prompting. No
+      tokens are spent, so zeros are appended to the cost arrays; which prompts were answered from the cache is saved
+      next to them. The input tokens recorded when a response was cached still stand for the size of the history (see
+      last_request_input_tokens), so that a re-run compacts its history where the cached run did.
+    - With write_only, every prompt is sent and its response cached, refreshing the cache.
+    - With bypass, the cache is neither read nor written.
+    """
+
+    def __init__(self,
+                 session: LLMSession,
+                 model: str,
+                 response_cache: ResponseCache,
+                 mode: ResponseCacheMode = "read_through",
+                 ) -> None:
+        super().__init__(session)
+        self.model = model
+        self.response_cache = response_cache
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        # Whether each prompt was answered from the cache, in the order of the cost arrays
+        self.response_cache_hits: List[bool] = []
+        self._last_hit_input_tokens: Optional[int] = None
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        request_key = self._get_request_key(prompt_contents, resp_prefix)
+        response = self._get_cached_response(request_key, prompt_contents, resp_prefix)
+        if response is None:
+            response = self.session.prompt(prompt_contents, resp_prefix)
+            self._put_response(request_key, response)
+        return response
+
+    @property
+    def last_request_input_tokens(self) -> int:
+        if self._last_hit_input_tokens is not None:
+            return self._last_hit_input_tokens
+        return self.session.last_request_input_tokens
+
+    def save_cost_arrays(self, cost_folder_path: str = "./", writer: Optional[BackgroundWriter] = None):
+        super().save_cost_arrays(cost_folder_path, writer)
+        hits = np.array(self.response_cache_hits)
+        if writer is None:
+            save_array(join(cost_folder_path, RESPONSE_CACHE_HITS_FILE_NAME), hits)
+        else:
+            writer.submit(save_array, join(cost_folder_path, RESPONSE_CACHE_HITS_FILE_NAME), hits)
+
+    def stream_prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> Iterator[str]:
+        request_key = self._get_request_key(prompt_contents, resp_prefix)
+        response = self._get_cached_response(request_key, prompt_contents, resp_prefix)
+        if response is not None:
+            yield response
+            return
+        response_chunks = []
+        for chunk in self.session.stream_prompt(prompt_contents, resp_prefix):
+            response_chunks.append(chunk)
+            yield chunk
+        self._put_response(request_key, "".join(response_chunks))
+
+    def _get_cached_response(self,
+                             request_key: str,
+                             prompt_contents: PROMPT_CONTENTS,
+                             resp_prefix: Optional[str],
+                             ) -> Optional[str]:
+        self._last_hit_input_tokens = None
+        if self.mode != "read_through":
+            self.response_cache_hits.append(False)
+            return None
+        cached_response = self.response_cache.get(request_key)
+        self.response_cache_hits.append(cached_response is not None)
+        if cached_response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Sessions keep the response prefix as part of the assistant's message
+        self.session.artificial_prompt(
+            prompt_contents,
+            [(PromptElement.Text, (resp_prefix or "") + cached_response.response)],
+        )
+        self.session.input_costs = np.append(self.session.input_costs, 0)
+        self.session.output_costs = np.append(self.session.output_costs, 0)
+        self.session.cache_read_costs = np.append(self.session.cache_read_costs, 0)
+        self.session.cache_write_costs = np.append(self.session.cache_write_costs, 0)
+        self._last_hit_input_tokens = cached_response.input_tokens
+        return cached_response.response
+
+    def _put_response(self, request_key: str, response: str) -> None:
+        if self.mode == "bypass":
+            return
+        self.response_cache.put(request_key, CachedResponse(
+            response=response,
+            input_tokens=int(self.session.input_costs[-1]),
+            output_tokens=int(self.session.output_costs[-1]),
+            cache_read_tokens=int(self.session.cache_read_costs[-1]),
+            cache_write_tokens=int(self.session.cache_write_costs[-1]),
+        ))
+
+    def _get_request_key(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str]) -> str:
+        # The session may itself be wrapped (e.g. by a RateLimitedSession), whose class has no request settings
+        provider_session_type = type(self.innermost_session)
+        request = [
+            provider_session_type.__name__,
+            self.model,
+            provider_session_type.stop_sequences,
+            provider_session_type.max_tokens,
+            self.session.history_policy,
+            normalise_for_key(self.session.history),
+            [(element_type.name, _hash_image(content) if element_type.value == PromptElement.Image.value else content)
+             for element_type, content in prompt_contents],
+            resp_prefix,
+        ]
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def normalise_for_key(value: Any) -> Any:
+    """Returns a JSON-serialisable version of a history, with images replaced by their hashes.
+
+    SDK objects (e.g. Claude's response blocks) are replaced by their fields, so that they match the dicts that
+    artificial_prompt adds to the history in their place.
+    """
+    if isinstance(value, str):
+        return _hash_image(value) if _is_image(value) else value
+    if isinstance(value, dict):
+        return {str(key): normalise_for_key(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalise_for_key(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return normalise_for_key(value.model_dump(exclude_none=True))
+    if isinstance(value, (bytes, bytearray)):
+        return hashlib.sha256(value).hexdigest()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return repr(value)
+
+
+def _is_image(string: str) -> bool:
+    # Base64 jpegs, on their own (Claude, Gemini) or as data urls (GPT)
+    return string.startswith(BASE64_JPEG_PREFIX) or string.startswith(JPEG_DATA_URL_PREFIX)
+
+
+def _hash_image(image: str) -> str:
+    return "sha256:" + hashlib.sha256(image.encode("utf-8")).hexdigest()
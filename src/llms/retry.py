@@ -0,0 +1,101 @@
+import random
+import time
+from typing import Callable, NamedTuple, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Total time a single prompt may spend waiting between retries
+DEFAULT_RETRY_BUDGET_SECONDS = 600.0
+# Jitter has its own generator, so that retries do not change the experiments' seeded random numbers
+_JITTER_RANDOM = random.Random()
+
+
+class RetryPolicy(NamedTuple):
+    """How often, and how long apart, a request that failed with a given class of error is retried.
+
+    The n-th retry waits a random time of up to initial_delay * multiplier ** (n - 1), capped at max_delay ("full
+    jitter"), unless the provider asks for a longer wait with a retry-after header.
+    """
+    max_attempts: int
+    initial_delay: float
+    max_delay: float
+    multiplier: float = 2.0
+
+
+# Rate limits take a while to recover, so are retried for longer
+RATE_LIMIT_RETRY_POLICY = RetryPolicy(max_attempts=8, initial_delay=4.0, max_delay=60.0)
+# Includes Anthropic's 529 (overloaded) errors
+SERVER_ERROR_RETRY_POLICY = RetryPolicy(max_attempts=5, initial_delay=2.0, max_delay=30.0)
+CONNECTION_RETRY_POLICY = RetryPolicy(max_attempts=5, initial_delay=1.0, max_delay=30.0)
+# Responses that could not be parsed, which usually succeed when requested again
+MALFORMED_RESPONSE_RETRY_POLICY = RetryPolicy(max_attempts=2, initial_delay=5.0, max_delay=5.0)
+
+
+def get_http_retry_policy(status_code: Optional[int]) -> Optional[RetryPolicy]:
+    """Returns the policy for an error response with the given status code, or None if it is not worth retrying."""
+    if status_code == 429:
+        return RATE_LIMIT_RETRY_POLICY
+    if status_code in [408, 409] or (status_code is not None and status_code >= 500):
+        return SERVER_ERROR_RETRY_POLICY
+    return None
+
+
+def get_retry_after(e: Exception) -> Optional[float]:
+    """Returns the seconds to wait that the error's response asked for, if any."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if headers is None:
+        return None
+    for header, seconds_per_unit in [("retry-after-ms", 0.001), ("retry-after", 1.0)]:
+        try:
+            return float(headers.get(header)) * seconds_per_unit
+        except (TypeError, ValueError):
+            # Missing, or an HTTP date, which providers do not send
+            continue
+    return None
+
+
+def get_retry_delay(policy: RetryPolicy, attempt: int, retry_after: Optional[float] = None) -> float:
+    """Returns the time to wait before retrying a request that failed attempt times."""
+    delay = _JITTER_RANDOM.uniform(0, min(policy.max_delay, policy.initial_delay * policy.multiplier ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def call_with_retries(request: Callable[[], T],
+                      get_retry_policy: Callable[[Exception], Optional[RetryPolicy]],
+                      retry_budget_seconds: float = DEFAULT_RETRY_BUDGET_SECONDS,
+                      ) -> T:
+    """Calls the request until it succeeds, retrying the errors that get_retry_policy gives a policy for.
+
+    The last error is raised once its policy's attempts or the retry budget are used up.
+    """
+    attempt = 0
+    total_delay = 0.0
+    while True:
+        attempt += 1
+        try:
+            return request()
+        except Exception as e:
+            delay = _get_delay_before_retry(e, get_retry_policy, attempt, retry_budget_seconds - total_delay)
+            if delay is None:
+                raise
+            total_delay += delay
+            time.sleep(delay)
+
+
+def _get_delay_before_retry(e: Exception,
+                            get_retry_policy: Callable[[Exception], Optional[RetryPolicy]],
+                            attempt: int,
+                            remaining_budget_seconds: float,
+                            ) -> Optional[float]:
+    policy = get_retry_policy(e)
+    if policy is None or attempt >= policy.max_attempts:
+        return None
+    delay = get_retry_delay(policy, attempt, get_retry_after(e))
+    if delay > remaining_budget_seconds:
+        print(f"---- {type(e).__name__}: not retrying, as waiting {delay:.1f}s would exceed the retry budget ----")
+        return None
+    print(f"---- {type(e).__name__} (attempt {attempt} of {policy.max_attempts}): retrying in {delay:.1f}s ----\n"
+          f" error: {e}")
+    return delay
@@ -0,0 +1,75 @@
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+# Submitting blocks once this many writes are waiting, so that a slow disk slows the experiment down instead of
+# letting observations pile up in memory
+DEFAULT_MAX_PENDING_WRITES = 64
+
+
+class BackgroundWriter:
+    """Runs file writes on a single thread, in the order they are submitted.
+
+    Note:
+    - Writes must not depend on objects that the caller mutates afterwards; submit copies (or immutable values).
+    - flush is a barrier: it returns once every write submitted so far is done, and raises the first error that one of
+      them raised.
+    - The thread is only started by the first write, so an unused writer can still be pickled.
+    """
+
+    def __init__(self, max_pending_writes: int = DEFAULT_MAX_PENDING_WRITES) -> None:
+        self._max_pending_writes = max_pending_writes
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def submit(self, write: Callable[..., Any], *args: Any) -> None:
+        if self._thread is None:
+            self._queue = queue.Queue(maxsize=self._max_pending_writes)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put((write, args))
+
+    def flush(self) -> None:
+        if self._thread is not None:
+            self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None:
+                # A write of None stops the thread
+                self._queue.put(None)
+                self._thread.join()
+                self._queue = None
+                self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                write, args = item
+                write(*args)
+            except BaseException as e:
+                # Only the first error is kept; it is raised by the next flush
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+
+def write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def save_array(path: str, array: np.ndarray) -> None:
+    np.save(path, array)
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import os
+import pickle
+import tempfile
+from os.path import dirname, isdir, isfile, join
+from typing import Any, Callable, Optional
+
+OBSERVATION_STORE_FOLDER_NAME = "observations"
+OBSERVATION_INDEX_FILE_NAME = "observation_index.csv"
+OBSERVATION_INDEX_COLUMN_LABELS = ["file_name", "sha256"]
+# Replaces the base64 jpeg of an observation in saved histories
+OBSERVATION_REFERENCE_PREFIX = "sha256:"
+# Base64 jpegs start with the encoding of the jpeg start-of-image marker
+BASE64_JPEG_PREFIX = "/9j/"
+# GPT histories embed images as data urls
+JPEG_DATA_URL_PREFIX = "data:image/jpeg;base64,"
+
+
+class ObservationStore:
+    """A content-addressed folder of jpeg observations, shared by all the experiments of a suite.
+
+    Note:
+    - Every observation is stored once, as <folder>/<first two hex digits>/<sha256>.jpg, however many arena runs or
+      histories it appears in.
+    - Saved histories refer to observations by hash (see reference_history); load_history_file resolves them again.
+    """
+
+    def __init__(self, folder_path: str) -> None:
+        self.folder_path = folder_path
+        os.makedirs(folder_path, exist_ok=True)
+
+    def put(self, jpeg_bytes: bytes) -> str:
+        """Stores the observation if it is new and returns its hash."""
+        digest = hashlib.sha256(jpeg_bytes).hexdigest()
+        path = self.get_path(digest)
+        if not isfile(path):
+            os.makedirs(dirname(path), exist_ok=True)
+            # Write under a temporary name, so that a concurrent reader never sees a partial file
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=dirname(path), suffix=".tmp")
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(jpeg_bytes)
+            os.replace(temporary_path, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.get_path(digest), "rb") as file:
+            return file.read()
+
+    def get_path(self, digest: str) -> str:
+        return join(self.folder_path, digest[:2], f"{digest}.jpg")
+
+    def reference_history(self, history: Any) -> Any:
+        """Returns a copy of the history in which every base64 jpeg is stored and replaced by a reference to it."""
+        return _map_strings(history, self._reference)
+
+    def resolve_history(self, history: Any) -> Any:
+        """Returns a copy of the history in which every observation reference is replaced by its base64 jpeg."""
+        return _map_strings(history, self._resolve)
+
+    def _reference(self, string: str) -> str:
+        if string.startswith(BASE64_JPEG_PREFIX):
+            return OBSERVATION_REFERENCE_PREFIX + self.put(base64.b64decode(string))
+        if string.startswith(JPEG_DATA_URL_PREFIX + BASE64_JPEG_PREFIX):
+            return JPEG_DATA_URL_PREFIX + self._reference(string[len(JPEG_DATA_URL_PREFIX):])
+        return string
+
+    def _resolve(self, string: str) -> str:
+        if string.startswith(OBSERVATION_REFERENCE_PREFIX):
+            return base64.b64encode(self.get(string[len(OBSERVATION_REFERENCE_PREFIX):])).decode("utf-8")
+        if string.startswith(JPEG_DATA_URL_PREFIX + OBSERVATION_REFERENCE_PREFIX):
+            return JPEG_DATA_URL_PREFIX + self._resolve(string[len(JPEG_DATA_URL_PREFIX):])
+        return string
+
+
+def find_observation_store(path: str) -> Optional[ObservationStore]:
+    """Finds the observation store of the suite that a file or folder belongs to, if any."""
+    folder_path = os.path.abspath(path if isdir(path) else dirname(path))
+    while True:
+        if isdir(join(folder_path, OBSERVATION_STORE_FOLDER_NAME)):
+            return ObservationStore(join(folder_path, OBSERVATION_STORE_FOLDER_NAME))
+        parent_folder_path = dirname(folder_path)
+        if parent_folder_path == folder_path:
+            return None
+        folder_path = parent_folder_path
+
+
+def load_history_file(path: str) -> Any:
+    """Loads a pickled history, resolving observation references against the suite's observation store."""
+    with open(path, "rb") as file:
+        history = pickle.load(file)
+    if not _any_string(history, _is_reference):
+        return history
+    observation_store = find_observation_store(path)
+    if observation_store is None:
+        raise FileNotFoundError(f"No {OBSERVATION_STORE_FOLDER_NAME} folder found above {path} to resolve its observations")
+    return observation_store.resolve_history(history)
+
+
+def _is_reference(string: str) -> bool:
+    return (string.startswith(OBSERVATION_REFERENCE_PREFIX)
+            or string.startswith(JPEG_DATA_URL_PREFIX + OBSERVATION_REFERENCE_PREFIX))
+
+
+def _map_strings(value: Any, function: Callable[[str], str]) -> Any:
+    """Applies the function to every string nested in dicts, lists and tuples, returning a copy of the value.
+
+    Other objects (e.g. SDK response blocks) are kept as they are.
+    """
+    if isinstance(value, str):
+        return function(value)
+    if isinstance(value, dict):
+        return type(value)((key, _map_strings(item, function)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_strings(item, function) for item in value)
+    return value
+
+
+def _any_string(value: Any, predicate: Callable[[str], bool]) -> bool:
+    if isinstance(value, str):
+        return predicate(value)
+    if isinstance(value, dict):
+        return any(_any_string(item, predicate) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_any_string(item, predicate) for item in value)
+    return False
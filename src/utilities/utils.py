@@ -37,7 +37,7 @@ def populate_csv(results_csv_path: str,
             csv_write.writerow(column_labels)
         csv_write.writerow(column_data)
 
-def check_episode_pass(total_reward: float, config_path: str, arena_index: int) -> bool:
+def load_arena_config(config_path: str) -> Dict[str, Any]:
     class CustomLoader(yaml.SafeLoader):
         def ignore_unknown(self, node: yaml.Node) -> None:
             return None
@@ -65,8 +65,16 @@ def check_episode_pass(total_reward: float, config_path: str, arena_index: int)
 
     CustomLoader.add_multi_constructor('', CustomLoader.ignore_unknown)
     with open(config_path, 'r') as file:
-        data = yaml.load(file, Loader=CustomLoader)
+        return yaml.load(file, Loader=CustomLoader)
+
+
+def get_arena_time_limit(config_path: str, arena_index: int) -> float:
+    """Returns the arena's time limit in steps, where 0 means that the episode only ends on success or failure."""
+    return load_arena_config(config_path).get('arenas', [{}])[arena_index].get('t', 0)
 
+
+def check_episode_pass(total_reward: float, config_path: str, arena_index: int) -> bool:
+    data = load_arena_config(config_path)
     pass_mark: Optional[float] = data.get('arenas', [{}])[arena_index].get('passMark', None)
 
     if pass_mark is None:
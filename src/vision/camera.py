@@ -1,22 +1,55 @@
 import base64
 from io import BytesIO
+from typing import List, Optional
 
 from animalai import AnimalAIEnvironment
 from mlagents_envs.base_env import DecisionSteps
 from PIL import Image
 import numpy as np
 
+from src.definitions.prompts.observations import MULTI_FRAME_OBSERVATION_PROMPT, OBSERVATION_UNCHANGED_MESSAGE
 from src.definitions.prompts.prompts import OBSERVATIONS
 from src.definitions.cardinal_directions import action_name_to_action_tuple
+from src.utilities.background_writer import BackgroundWriter, write_bytes
+from src.vision.compression import DEFAULT_JPEG_QUALITY, JPEG_ENCODERS, ObservationCompressor
+from src.vision.perceptual_hash import difference_hash, hash_distance
 from src.vision.vision import AAIVisualObservation, VisionSystem
 
+try:
+    # Optional, faster jpeg encoder (libjpeg-turbo), only used when asked for
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
 
 class CameraSystem(VisionSystem):
-    def __init__(self):
+    def __init__(self,
+                 compressor: Optional[ObservationCompressor] = None,
+                 num_frames: int = 1,
+                 unchanged_observation_threshold: Optional[int] = None,
+                 jpeg_encoder: str = "pil",
+                 ):
         super().__init__()
+        assert jpeg_encoder in JPEG_ENCODERS
+        if jpeg_encoder == "simplejpeg" and simplejpeg is None:
+            raise ImportError("The simplejpeg jpeg encoder was asked for, but simplejpeg is not installed")
+        # Chosen explicitly, so that observations are encoded the same way on every machine
+        self.jpeg_encoder = jpeg_encoder
+        # Observations whose perceptual hash differs from the last sent one's by at most this many bits are replaced
+        # by a text marker; None sends every observation
+        self._unchanged_observation_threshold = unchanged_observation_threshold
+        self._last_sent_frame_hash: Optional[np.ndarray] = None
+        # Applied to every observation before it is encoded, if given
+        self._compressor = compressor
+        # Observations tile this many frames side by side, oldest first (see Experiment1._update_message_with_obs)
+        self.num_frames = num_frames
+        # White-bordered frame that observations are written into, reused while the resolution stays the same
+        self._frame_buffer: Optional[np.ndarray] = None
 
     @property
     def observation_prompt(self) -> str:
+        if self.num_frames > 1:
+            return OBSERVATIONS["paper"] + MULTI_FRAME_OBSERVATION_PROMPT(self.num_frames)
         return OBSERVATIONS["paper"]
 
 
@@ -27,28 +60,90 @@ class CameraSystem(VisionSystem):
                         save_path: str = "observation.jpg",
                         show: bool = False,
                         border_width: int = 2,
+                        writer: Optional[BackgroundWriter] = None,
+                        frames: Optional[List[np.ndarray]] = None,
                         ) -> AAIVisualObservation:
-        behavior = list(env.behavior_specs.keys())[0]  # by default should be AnimalAI?team=0
-        dec, _ = env.get_steps(behavior)
-        scaled_image_array = np.array(env.get_obs_dict(dec.obs)["camera"] * 255, dtype=np.uint8)
-        assert scaled_image_array.all() < 256
+        """Returns ("", base64 jpeg), or (OBSERVATION_UNCHANGED_MESSAGE, None) when skipping an unchanged observation.
+
+        Skipped observations are neither encoded nor saved.
+        """
+        frame = self._build_frame(env, border_width, frames)
+        if self._unchanged_observation_threshold is not None:
+            frame_hash = difference_hash(frame)
+            if (self._last_sent_frame_hash is not None
+                    and hash_distance(frame_hash, self._last_sent_frame_hash) <= self._unchanged_observation_threshold):
+                return OBSERVATION_UNCHANGED_MESSAGE, None
+            self._last_sent_frame_hash = frame_hash
+        jpeg_bytes = self._encode_frame(frame)
+        # The same encoded bytes are saved and sent to the LLM
+        if save and writer is not None:
+            writer.submit(write_bytes, save_path, jpeg_bytes)
+        elif save:
+            write_bytes(save_path, jpeg_bytes)
+        if show: Image.open(BytesIO(jpeg_bytes)).show()
+        base64_string = base64.b64encode(jpeg_bytes).decode('utf-8')
+        return "", base64_string
+
+    def reset(self) -> None:
+        """Forgets the previous observation, e.g. at the start of an episode, so that the next one is always sent."""
+        self._last_sent_frame_hash = None
+
+    def _build_frame(self,
+                     env: AnimalAIEnvironment,
+                     border_width: int,
+                     frames: Optional[List[np.ndarray]],
+                     ) -> np.ndarray:
+        """Returns the uint8 image of the observation, in a buffer that is reused by the next observation.
 
-        height, width, _ = scaled_image_array.shape
-        total_width = width * 1 + border_width * 2
-        image = Image.new('RGB', (total_width, height), color='white')
-        # Note: This adds two small white gutters to either side of the image, which were erroneously included when running the paper experiments
+        The image tiles the given frames (see capture_frame) or, if there are none, num_frames copies of the agent's
+        current camera frame.
+        """
+        if frames is None and self.num_frames > 1:
+            frames = [self.capture_frame(env)] * self.num_frames
+        # Note: This adds small white gutters to either side of each frame, which were erroneously included when running the paper experiments
         # They are maintained in this version of the code for consistency
-        image.paste(Image.fromarray(scaled_image_array), box=(border_width+0*(width+border_width), 0)) # Top most border is y=0
+        if frames is None:
+            camera_array = self._get_camera_array(env)
+            height, width, _ = camera_array.shape
+            frame = self._get_frame_buffer(height, width, border_width, 1)
+            # Scaling straight into the buffer truncates to uint8 like np.array(camera_array * 255, dtype=np.uint8) did
+            np.multiply(camera_array, 255, out=frame[:, border_width:border_width + width], casting="unsafe")
+        else:
+            height, width, _ = frames[0].shape
+            frame = self._get_frame_buffer(height, width, border_width, len(frames))
+            # View the buffer as one (frame, right gutter) slot per frame, so that all frames are copied in at once
+            slots = frame[:, border_width:].reshape(height, len(frames), width + border_width, 3)
+            slots[:, :, :width] = np.stack(frames, axis=1)
+        return frame
 
-        if save: image.save(save_path)
-        if show: image.show()
-        base64_string = self._convert_image_to_base64_string(image)
-        return "", base64_string
+    def _encode_frame(self, frame: np.ndarray) -> bytes:
+        if self._compressor is None:
+            return self._encode_jpeg(frame, DEFAULT_JPEG_QUALITY)
+        return self._encode_jpeg(self._compressor.compress(frame), self._compressor.jpeg_quality)
+
+    def capture_frame(self, env: AnimalAIEnvironment) -> np.ndarray:
+        """Returns a copy of the agent's current camera frame, scaled to uint8."""
+        return np.multiply(self._get_camera_array(env), 255).astype(np.uint8)
 
     @staticmethod
-    def _convert_image_to_base64_string(image: Image) -> str:
+    def _get_camera_array(env: AnimalAIEnvironment) -> np.ndarray:
+        behavior = list(env.behavior_specs.keys())[0]  # by default should be AnimalAI?team=0
+        dec, _ = env.get_steps(behavior)
+        return env.get_obs_dict(dec.obs)["camera"]
+
+    def _get_frame_buffer(self, height: int, width: int, border_width: int, num_frames: int) -> np.ndarray:
+        shape = (height, width * num_frames + border_width * (num_frames + 1), 3)
+        if self._frame_buffer is None or self._frame_buffer.shape != shape:
+            self._frame_buffer = np.full(shape, 255, dtype=np.uint8)
+        return self._frame_buffer
+
+    def _encode_jpeg(self, frame: np.ndarray, quality: int) -> bytes:
+        """Encodes an RGB (height, width, 3) or grayscale (height, width) frame."""
+        if self.jpeg_encoder == "simplejpeg":
+            if frame.ndim == 2:
+                return simplejpeg.encode_jpeg(frame[:, :, np.newaxis], quality=quality, colorspace="GRAY")
+            # PIL's chroma subsampling, rather than simplejpeg's default of none
+            return simplejpeg.encode_jpeg(frame, quality=quality, colorspace="RGB", colorsubsampling="420")
         buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        base64_encoded_data = base64.b64encode(buffered.getvalue())
-        base64_string = base64_encoded_data.decode('utf-8')
-        return base64_string
+        Image.fromarray(frame).save(buffered, format="JPEG", quality=quality)
+        return buffered.getvalue()
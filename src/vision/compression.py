@@ -0,0 +1,113 @@
+import math
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+# PIL's default jpeg quality, which the paper experiments' observations were encoded with
+DEFAULT_JPEG_QUALITY = 75
+# PIL, or simplejpeg (libjpeg-turbo), which is faster but an optional dependency (see CameraSystem)
+JPEG_ENCODERS = ["pil", "simplejpeg"]
+
+
+def _estimate_anthropic_image_tokens(width: int, height: int) -> int:
+    # https://docs.anthropic.com/en/docs/build-with-claude/vision: tokens = (width px * height px) / 750
+    return math.ceil(width * height / 750)
+
+
+def _estimate_openai_image_tokens(width: int, height: int) -> int:
+    # https://platform.openai.com/docs/guides/vision: high detail images are fitted within 2048x2048, then scaled so
+    # that their shortest side is at most 768px, and cost 85 tokens plus 170 per 512px tile
+    scale = min(1.0, 2048 / max(width, height), 768 / min(width, height))
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return 85 + 170 * tiles
+
+
+def _estimate_gemini_image_tokens(width: int, height: int) -> int:
+    # https://ai.google.dev/gemini-api/docs/tokens: images up to 384px in both dimensions cost 258 tokens, larger ones
+    # are cut into 768x768 tiles of 258 tokens each
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+# Keyed by llm_family; human and recording sessions are estimated as Claude, like RecordingSession's costs
+IMAGE_TOKEN_ESTIMATORS: Dict[str, Callable[[int, int], int]] = {
+    "claude": _estimate_anthropic_image_tokens,
+    "gpt": _estimate_openai_image_tokens,
+    "gemini": _estimate_gemini_image_tokens,
+    "human": _estimate_anthropic_image_tokens,
+    "recording": _estimate_anthropic_image_tokens,
+}
+
+
+def estimate_image_tokens(llm_family: str, width: int, height: int) -> int:
+    return IMAGE_TOKEN_ESTIMATORS[llm_family](width, height)
+
+
+class ObservationCompressor:
+    """Trades observation fidelity for input tokens before observations are encoded.
+
+    Note:
+    - With an image_token_budget, observations are downscaled (keeping their aspect ratio) to the largest size that the
+      llm_family's provider is estimated to bill at most that many tokens for.
+    - Grayscale observations are encoded with a single channel, which shrinks the payload but not the token estimate.
+    """
+
+    def __init__(self,
+                 llm_family: str,
+                 image_token_budget: Optional[int] = None,
+                 jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+                 grayscale: bool = False,
+                 verbose: bool = False,
+                 ) -> None:
+        if image_token_budget is not None and image_token_budget < estimate_image_tokens(llm_family, 1, 1):
+            raise ValueError(f"No {llm_family} image fits in a budget of {image_token_budget} tokens")
+        self.llm_family = llm_family
+        self.image_token_budget = image_token_budget
+        self.jpeg_quality = jpeg_quality
+        self.grayscale = grayscale
+        self.verbose = verbose
+        # The frame sizes seen so far and the size they are compressed to
+        self._target_sizes: Dict[tuple[int, int], tuple[int, int]] = {}
+
+    def compress(self, frame: np.ndarray) -> np.ndarray:
+        """Returns the (possibly downscaled and grayscale) frame to encode."""
+        height, width = frame.shape[:2]
+        target_width, target_height = self._get_target_size(width, height)
+        if (target_width, target_height) == (width, height) and not self.grayscale:
+            return frame
+        image = Image.fromarray(frame)
+        if self.grayscale:
+            image = image.convert("L")
+        if (target_width, target_height) != (width, height):
+            image = image.resize((target_width, target_height), Image.BILINEAR)
+        return np.asarray(image)
+
+    def _get_target_size(self, width: int, height: int) -> tuple[int, int]:
+        if (width, height) not in self._target_sizes:
+            target_width, target_height = width, height
+            if self.image_token_budget is not None:
+                target_width, target_height = self._fit_to_budget(width, height)
+            self._target_sizes[(width, height)] = (target_width, target_height)
+            if self.verbose:
+                print(f"Observations of {width}x{height} are sent as {target_width}x{target_height}, estimated at "
+                      f"{estimate_image_tokens(self.llm_family, target_width, target_height)} {self.llm_family} "
+                      f"tokens each")
+        return self._target_sizes[(width, height)]
+
+    def _fit_to_budget(self, width: int, height: int) -> tuple[int, int]:
+        def scaled_size(target_width: int) -> tuple[int, int]:
+            return target_width, max(1, round(height * target_width / width))
+
+        if estimate_image_tokens(self.llm_family, width, height) <= self.image_token_budget:
+            return width, height
+        # Estimates grow with the size, so binary search the largest width within the budget
+        low, high = 1, width
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_image_tokens(self.llm_family, *scaled_size(middle)) <= self.image_token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        return scaled_size(low)
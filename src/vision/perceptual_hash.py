@@ -0,0 +1,23 @@
+import numpy as np
+from PIL import Image
+
+# Bits per side of the hash; frames are compared on a (HASH_SIZE, HASH_SIZE + 1) grayscale thumbnail
+HASH_SIZE = 16
+
+
+def difference_hash(frame: np.ndarray, hash_size: int = HASH_SIZE) -> np.ndarray:
+    """Returns the difference hash of an RGB or grayscale uint8 frame, as hash_size * hash_size bits.
+
+    Each bit tells whether a cell of the frame's grayscale thumbnail is brighter than its right neighbour, so the hash
+    ignores small changes in brightness and jpeg noise but not a change of view.
+    """
+    image = Image.fromarray(frame)
+    if image.mode != "L":
+        image = image.convert("L")
+    thumbnail = np.asarray(image.resize((hash_size + 1, hash_size), Image.BOX), dtype=np.int16)
+    return (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+
+
+def hash_distance(first_hash: np.ndarray, second_hash: np.ndarray) -> int:
+    """Returns the number of differing bits between two hashes."""
+    return int(np.count_nonzero(first_hash != second_hash))
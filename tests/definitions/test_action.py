@@ -0,0 +1,9 @@
+from src.definitions.action import AAIActions
+
+
+def test_actions_should_have_one_row_per_agent():
+    actions = AAIActions(no_agents=3)
+    for action in actions.allActions:
+        assert action.action_tuple.discrete.shape == (3, 2)
+        assert action.action_tuple.continuous.shape == (3, 0)
+    assert (actions.FORWARDSLEFT.action_tuple.discrete == [[1, 2]] * 3).all()
@@ -0,0 +1,63 @@
+import os
+import socket
+
+from src.environment.ports import PortAllocator, is_port_free
+
+BASE_PORT = 47005
+
+
+def test_lease_should_not_hand_out_the_same_port_twice(tmp_path):
+    first_allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    second_allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    first_port = first_allocator.lease(BASE_PORT)
+    second_port = second_allocator.lease(BASE_PORT)
+    assert first_port != second_port
+
+
+def test_released_port_should_be_leased_again(tmp_path):
+    allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    port = allocator.lease(BASE_PORT)
+    assert allocator.release(port, timeout=1)
+    assert allocator.lease(BASE_PORT) == port
+
+
+def test_lease_should_skip_ports_bound_outside_of_the_allocator(tmp_path):
+    allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("localhost", BASE_PORT))
+        assert not is_port_free(BASE_PORT)
+        assert allocator.lease(BASE_PORT) != BASE_PORT
+    finally:
+        s.close()
+
+
+def test_release_should_report_a_port_that_is_still_bound(tmp_path):
+    allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    port = allocator.lease(BASE_PORT)
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("localhost", port))
+        assert not allocator.release(port, timeout=0.2)
+    finally:
+        s.close()
+
+
+def test_lease_of_a_dead_process_should_be_reclaimed(tmp_path):
+    allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    # Pids are far below this on every platform we run on
+    with open(os.path.join(tmp_path, f"{BASE_PORT}.lease"), "w") as lease_file:
+        lease_file.write(str(2 ** 30))
+    assert allocator.lease(BASE_PORT) == BASE_PORT
+
+
+def test_a_reclaimed_lease_should_not_be_reclaimed_again(tmp_path):
+    first_allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    second_allocator = PortAllocator(lease_folder_path=str(tmp_path))
+    with open(os.path.join(tmp_path, f"{BASE_PORT}.lease"), "w") as lease_file:
+        lease_file.write(str(2 ** 30))
+    # The second allocator finds the lease stale, but the first one reclaims it before the second can
+    assert second_allocator._is_lease_stale(BASE_PORT)
+    assert first_allocator.lease(BASE_PORT) == BASE_PORT
+    assert not second_allocator._reclaim_lease(BASE_PORT)
+    assert second_allocator.lease(BASE_PORT) != BASE_PORT
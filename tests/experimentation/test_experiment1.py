@@ -0,0 +1,271 @@
+import os
+import threading
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pytest
+
+from src.definitions.constants import FRAMES_BETWEEN_OBS
+from src.definitions.prompts.observations import PREVIOUS_RESPONSE_IS_INVALID, PREVIOUS_RESPONSE_IS_PARTLY_INVALID
+from src.definitions.prompts.prompts import NUM_INITIAL_OBS
+from src.experimentation.experiments import experiment1
+from src.experimentation.experiments.experiment import ArenaJobStopped
+from src.experimentation.experiments.experiment1 import Experiment1
+from src.llms.llm import HISTORY_FILE_NAME_PREFIX, LLMMessageParam, LLMSession, PROMPT_CONTENTS, PromptElement
+
+BEHAVIOR = "AnimalAI?team=0"
+ARENA_CONFIG = """!ArenaConfig
+arenas:
+  0: !Arena
+    t: 0
+"""
+# The steps taken by the initial observations, after which the first command of a script ends the episode
+STEPS_BEFORE_FIRST_COMMAND = NUM_INITIAL_OBS * FRAMES_BETWEEN_OBS
+
+
+class FakeSteps(NamedTuple):
+    reward: np.ndarray
+    obs: Optional[list] = None
+
+
+class FakeEnvironment:
+    """An episode whose terminal reward is the arena's number, which ends once its steps run out."""
+
+    behavior_specs = {BEHAVIOR: None}
+
+    def __init__(self, config_path: str, num_steps: int = STEPS_BEFORE_FIRST_COMMAND + 1) -> None:
+        self.terminal_reward = float(os.path.basename(config_path).split(".")[0].split("_")[-1])
+        self.num_steps = num_steps
+        self.steps_taken = 0
+
+    def get_steps(self, behavior: str) -> tuple:
+        if self.steps_taken < self.num_steps:
+            return FakeSteps(np.array([0.0]), obs=[]), FakeSteps(np.array([]))
+        return FakeSteps(np.array([]), obs=[]), FakeSteps(np.array([self.terminal_reward]))
+
+    def get_obs_dict(self, obs: list) -> dict:
+        return {"health": 100.0, "camera": np.zeros((8, 8, 3), dtype=np.float32)}
+
+    def set_actions(self, behavior_name: str, action) -> None:
+        pass
+
+    def step(self) -> None:
+        self.steps_taken += 1
+
+
+class FakeEnvironmentManager:
+
+    def __init__(self, reuse: bool = False) -> None:
+        pass
+
+    def acquire(self, config_path: str, **environment_kwargs) -> FakeEnvironment:
+        return FakeEnvironment(config_path)
+
+    def release(self, env: FakeEnvironment, healthy: bool = True) -> None:
+        pass
+
+    def close_all(self) -> None:
+        pass
+
+
+class ScriptedSession(LLMSession):
+    """Responds to every prompt with the same script."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._history: List[LLMMessageParam] = []
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        self.artificial_prompt(prompt_contents, [(PromptElement.Text, "Go(1)")])
+        for costs_name in ["input_costs", "output_costs", "cache_read_costs", "cache_write_costs"]:
+            setattr(self, costs_name, np.append(getattr(self, costs_name), 0))
+        return "Go(1)"
+
+    def artificial_prompt(self, prompt_contents: PROMPT_CONTENTS, response_contents: PROMPT_CONTENTS) -> None:
+        self._history.append(LLMMessageParam(role="user", content=prompt_contents))
+        self._history.append(LLMMessageParam(role="assistant", content=response_contents))
+
+    @property
+    def history(self) -> list:
+        return list(self._history)
+
+    def load_from_history_file(self, file: str) -> None:
+        raise NotImplementedError()
+
+    @staticmethod
+    def get_assistant_commands_from_pkl_history(path_to_pkl: str) -> List[str]:
+        raise NotImplementedError()
+
+
+class ScriptedExperiment(Experiment1):
+
+    def _get_llm_session(self) -> LLMSession:
+        return ScriptedSession()
+
+
+def _create_experiment(tmp_path, num_arenas: int, **options) -> Experiment1:
+    arena_config_folder_path = tmp_path / "arenas"
+    arena_config_folder_path.mkdir(parents=True)
+    for arena_number in range(1, num_arenas + 1):
+        (arena_config_folder_path / f"arena_{arena_number}.yaml").write_text(ARENA_CONFIG)
+    return ScriptedExperiment({
+        "aai_config_path": str(arena_config_folder_path),
+        "aai_seeds": 0,
+        "output_folder_path": f"{tmp_path / 'experiment'}/",
+        "max_conversation_turns": 5,
+        "manually_prompt_llm": False,
+        "save_observations": False,
+        "show_observations": False,
+        "play": False,
+        "watch_agent_interact": False,
+        "verbose": False,
+        "llm_family": "human",
+        "llm_model": "human",
+        "llm_family_switch": None,
+        "llm_model_switch": None,
+        "resolution": 8,
+        "num_arena_loops": 1,
+        "learn_across_arenas": False,
+        "n_shot_examples_path": None,
+        "preamble": "paper",
+        "goal": "paper",
+        "commands": "paper",
+        "chain_of_thought": "paper",
+        "misc": "paper",
+        **options,
+    })
+
+
+def _get_history_file_names(folder_path: str) -> List[str]:
+    return [file_name for file_name in os.listdir(folder_path)
+            if file_name.startswith(HISTORY_FILE_NAME_PREFIX) and file_name.endswith(".pkl")]
+
+
+def test_parallel_arenas_should_merge_their_results_in_arena_order(tmp_path, monkeypatch):
+    # Pool workers are forked, so they create the fake environment managers too
+    monkeypatch.setattr(experiment1, "EnvironmentManager", FakeEnvironmentManager)
+    experiment = _create_experiment(tmp_path, num_arenas=4, max_parallel_arenas=2)
+    experiment.run()
+
+    result_folder_path = tmp_path / "experiment" / "results"
+    assert list(np.load(result_folder_path / "arena_names.npy")) == ["arena_1", "arena_2", "arena_3", "arena_4"]
+    assert list(np.load(result_folder_path / "episode_rewards.npy")) == [1.0, 2.0, 3.0, 4.0]
+    assert set(np.load(result_folder_path / "episode_end_reason.npy")) == {"NON_ZERO_TERMINAL_REWARD"}
+
+
+def test_parallel_arenas_should_write_their_histories_like_sequential_ones(tmp_path, monkeypatch):
+    monkeypatch.setattr(experiment1, "EnvironmentManager", FakeEnvironmentManager)
+    experiment = _create_experiment(tmp_path, num_arenas=2, max_parallel_arenas=2)
+    experiment.run()
+
+    experiment_folder_path = tmp_path / "experiment"
+    for arena_name in ["arena_1", "arena_2"]:
+        assert len(_get_history_file_names(experiment_folder_path / arena_name)) == 1
+    # The last arena's history is also written to the experiment folder
+    assert len(_get_history_file_names(experiment_folder_path)) == 1
+
+
+def test_stopped_arena_jobs_should_neither_record_nor_write_anything(tmp_path):
+    experiment = _create_experiment(tmp_path, num_arenas=1)
+    stop_event = threading.Event()
+    stop_event.set()
+    with pytest.raises(ArenaJobStopped):
+        experiment.run_arena_job(0, FakeEnvironmentManager(), stop_event=stop_event)
+    assert len(experiment._results_store.get_experiment_results(experiment.options["output_folder_path"])) == 0
+    assert _get_history_file_names(tmp_path / "experiment" / "arena_1") == []
+
+
+class StreamingSession(ScriptedSession):
+    """Streams a script whose first command is valid and whose second is not, and records the prompts it is sent."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.prompts: List[PROMPT_CONTENTS] = []
+
+    def stream_prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None):
+        self.prompts.append(prompt_contents)
+        self.artificial_prompt(prompt_contents, [(PromptElement.Text, "Go(1); Fly(2);")])
+        yield from ["Go(1);", " Fly(2);"]
+
+
+def test_partly_invalid_streamed_responses_should_be_reported_as_partly_carried_out(tmp_path):
+    session = StreamingSession()
+    experiment = _create_experiment(tmp_path, num_arenas=1, stream_actions=True, max_conversation_turns=2)
+    experiment._get_llm_session = lambda: session
+    environment_manager = FakeEnvironmentManager()
+    environment_manager.acquire = lambda config_path, **environment_kwargs: FakeEnvironment(config_path, num_steps=1000)
+    experiment.run_arena_job(0, environment_manager)
+    assert PREVIOUS_RESPONSE_IS_PARTLY_INVALID in session.prompts[1][0][1]
+    assert PREVIOUS_RESPONSE_IS_INVALID not in session.prompts[1][0][1]
+
+
+def _count_steps_taken(tmp_path, num_frames: int) -> int:
+    """Returns the steps taken by an arena with a single conversation turn, whose episode outlasts it."""
+    envs = []
+
+    def acquire(config_path: str, **environment_kwargs) -> FakeEnvironment:
+        envs.append(FakeEnvironment(config_path, num_steps=1000))
+        return envs[-1]
+
+    experiment = _create_experiment(tmp_path, num_arenas=1, max_conversation_turns=1,
+                                    num_frames_per_observation=num_frames)
+    environment_manager = FakeEnvironmentManager()
+    environment_manager.acquire = acquire
+    experiment.run_arena_job(0, environment_manager)
+    return envs[0].steps_taken
+
+
+def test_multi_frame_observations_should_take_as_many_steps_as_single_frame_ones(tmp_path):
+    assert _count_steps_taken(tmp_path / "single", num_frames=1) == \
+           _count_steps_taken(tmp_path / "multi", num_frames=3)
+
+
+class DrainingEnvironment:
+    """An episode that ends once its health, drained by the given decrements (the last repeating), runs out."""
+
+    def __init__(self, health: float, health_decrements: List[float], step_reward: float = -0.01) -> None:
+        self.health = health
+        self.health_decrements = health_decrements
+        self.step_reward = step_reward
+        self.steps_taken = 0
+
+    def get_steps(self, behavior: str) -> tuple:
+        if self.health > 0:
+            return FakeSteps(np.array([self.step_reward]), obs=[]), FakeSteps(np.array([]))
+        return FakeSteps(np.array([]), obs=[]), FakeSteps(np.array([self.step_reward]))
+
+    def get_obs_dict(self, obs: list) -> dict:
+        return {"health": self.health}
+
+    def set_actions(self, behavior_name: str, action) -> None:
+        pass
+
+    def step(self) -> None:
+        self.health -= self.health_decrements[min(self.steps_taken, len(self.health_decrements) - 1)]
+        self.steps_taken += 1
+
+
+def _run_down_the_clock(tmp_path, mode: str, env: DrainingEnvironment) -> float:
+    experiment = _create_experiment(tmp_path, num_arenas=1, run_down_the_clock=mode)
+    config_path = tmp_path / "timed_arena.yaml"
+    config_path.write_text(ARENA_CONFIG.replace("t: 0", "t: 100"))
+    return experiment._run_down_the_clock(env, BEHAVIOR, str(config_path))
+
+
+@pytest.mark.parametrize("health, health_decrement", [(100, 1), (100, 3), (50, 0.7), (1, 1)])
+def test_the_analytic_reward_should_match_stepping_down_the_clock(tmp_path, health, health_decrement):
+    stepped_env = DrainingEnvironment(health, [health_decrement])
+    stepped_reward = _run_down_the_clock(tmp_path / "step", "step", stepped_env)
+    analytic_env = DrainingEnvironment(health, [health_decrement])
+    analytic_reward = _run_down_the_clock(tmp_path / "analytic", "analytic", analytic_env)
+    assert analytic_reward == pytest.approx(stepped_reward)
+    assert stepped_reward == pytest.approx(-0.01 * stepped_env.steps_taken)
+    assert analytic_env.steps_taken == 1
+
+
+def test_verifying_the_analytic_reward_should_warn_when_it_diverges(tmp_path):
+    # The health drains faster after the measured step, so the analytic reward counts too many steps
+    env = DrainingEnvironment(100, [1, 2])
+    with pytest.warns(UserWarning, match="diverges"):
+        stepped_reward = _run_down_the_clock(tmp_path, "verify", env)
+    assert stepped_reward == pytest.approx(-0.01 * 51)
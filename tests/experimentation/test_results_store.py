@@ -0,0 +1,57 @@
+import numpy as np
+
+from src.experimentation.results_store import ArenaResult, ResultsStore, RESULT_FILE_NAMES, UNKNOWN_METRIC
+
+EXPERIMENT_FOLDER_PATH = "outputs/suite/aai_seeds_0"
+
+
+def _create_result(job_index: int, total_reward: float = 1.0, episode_end_reason: str = "NON_ZERO_TERMINAL_REWARD"):
+    return ArenaResult(
+        job_index=job_index,
+        arena_name=f"arena_{job_index}",
+        loop_index=0,
+        total_reward=total_reward,
+        episode_end_reason=episode_end_reason,
+        turns=3,
+        input_tokens=100,
+        output_tokens=20,
+        wall_time=1.5,
+        seed=0,
+        llm_family="claude",
+        llm_model="claude-3-5-sonnet-20240620",
+    )
+
+
+def test_results_should_be_returned_in_job_order(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.append(EXPERIMENT_FOLDER_PATH, _create_result(1))
+    store.append(EXPERIMENT_FOLDER_PATH, _create_result(0))
+    store.append("outputs/suite/aai_seeds_1", _create_result(0))
+    assert list(store.get_experiment_results(EXPERIMENT_FOLDER_PATH)) == [0, 1]
+    assert len(store.read_all()) == 3
+
+
+def test_latest_result_of_a_job_should_supersede_earlier_ones(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.append(EXPERIMENT_FOLDER_PATH, _create_result(0, total_reward=0.0, episode_end_reason="RUNTIME_ERROR"))
+    store.append(EXPERIMENT_FOLDER_PATH, _create_result(0, total_reward=2.0))
+    assert store.get_experiment_results(EXPERIMENT_FOLDER_PATH)[0].total_reward == 2.0
+    assert [result.total_reward for _, result in store.read_all()] == [2.0]
+
+
+def test_npy_export_should_round_trip(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.append(EXPERIMENT_FOLDER_PATH, _create_result(0, total_reward=1.0))
+    store.append(EXPERIMENT_FOLDER_PATH, _create_result(1, total_reward=-1.0, episode_end_reason="RUNTIME_ERROR"))
+    store.export_npy(EXPERIMENT_FOLDER_PATH, str(tmp_path))
+    arena_names, episode_rewards, episode_end_reasons = [np.load(tmp_path / name) for name in RESULT_FILE_NAMES]
+    assert list(arena_names) == ["arena_0", "arena_1"]
+    assert list(episode_rewards) == [1.0, -1.0]
+    assert list(episode_end_reasons) == ["NON_ZERO_TERMINAL_REWARD", "RUNTIME_ERROR"]
+
+    imported_store = ResultsStore(str(tmp_path / "imported_results.sqlite"))
+    imported_store.import_npy(EXPERIMENT_FOLDER_PATH, str(tmp_path), seed=0, llm_family="claude",
+                              llm_model="claude-3-5-sonnet-20240620", loop_indices=[0, 0])
+    imported_result = imported_store.get_experiment_results(EXPERIMENT_FOLDER_PATH)[1]
+    assert (imported_result.arena_name, imported_result.total_reward) == ("arena_1", -1.0)
+    assert imported_result.turns == UNKNOWN_METRIC
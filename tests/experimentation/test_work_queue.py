@@ -0,0 +1,89 @@
+from src.experimentation.work_queue import WHOLE_EXPERIMENT_JOB_INDEX, WorkQueue
+
+EXPERIMENT_FOLDER_PATH = "outputs/suite/aai_seeds_0"
+EXPERIMENT_OPTIONS = {"experiment_name": "experiment1", "output_folder_path": EXPERIMENT_FOLDER_PATH}
+
+
+def _create_queue(tmp_path, job_indices=(0, 1), max_attempts=3) -> WorkQueue:
+    queue = WorkQueue(str(tmp_path / "work_queue.sqlite"), max_attempts=max_attempts)
+    queue.enqueue(EXPERIMENT_FOLDER_PATH, EXPERIMENT_OPTIONS, list(job_indices))
+    return queue
+
+
+def test_items_should_be_leased_once_and_in_order(tmp_path):
+    queue = _create_queue(tmp_path)
+    first_item = queue.lease(owner="a", lease_duration=60)
+    second_item = queue.lease(owner="b", lease_duration=60)
+    assert (first_item.job_index, second_item.job_index) == (0, 1)
+    assert first_item.experiment_options == EXPERIMENT_OPTIONS
+    assert queue.lease(owner="c", lease_duration=60) is None
+
+
+def test_enqueueing_again_should_not_duplicate_items(tmp_path):
+    queue = _create_queue(tmp_path)
+    queue.enqueue(EXPERIMENT_FOLDER_PATH, EXPERIMENT_OPTIONS, [0, 1])
+    assert len(queue.get_results(EXPERIMENT_FOLDER_PATH)) == 2
+
+
+def test_resumed_items_should_run_with_the_resumed_options(tmp_path):
+    queue = _create_queue(tmp_path, job_indices=[WHOLE_EXPERIMENT_JOB_INDEX])
+    item = queue.lease(owner="a", lease_duration=60)
+    queue.complete(item, owner="a", total_reward=0.5, episode_end_reason="NON_ZERO_TERMINAL_REWARD")
+    queue.claim_finished_experiments()
+    queue.requeue_unsuccessful()
+    resumed_options = {**EXPERIMENT_OPTIONS, "resume_from": "outputs/suite"}
+    queue.enqueue(EXPERIMENT_FOLDER_PATH, resumed_options, [WHOLE_EXPERIMENT_JOB_INDEX])
+    item = queue.lease(owner="a", lease_duration=60)
+    assert item.experiment_options == resumed_options
+    queue.complete(item, owner="a", total_reward=0.5, episode_end_reason="NON_ZERO_TERMINAL_REWARD")
+    assert queue.claim_finished_experiments() == [resumed_options]
+
+
+def test_expired_lease_should_be_handed_out_again(tmp_path):
+    queue = _create_queue(tmp_path, job_indices=[0])
+    crashed_item = queue.lease(owner="a", lease_duration=-1)
+    retried_item = queue.lease(owner="b", lease_duration=60)
+    assert retried_item.item_id == crashed_item.item_id
+    assert retried_item.attempts == 2
+    # The crashed worker no longer owns the item
+    assert not queue.heartbeat(crashed_item, owner="a", lease_duration=60)
+    assert queue.heartbeat(retried_item, owner="b", lease_duration=60)
+
+
+def test_failed_item_should_be_retried_until_max_attempts(tmp_path):
+    queue = _create_queue(tmp_path, job_indices=[0], max_attempts=2)
+    queue.fail(queue.lease(owner="a", lease_duration=60), owner="a")
+    queue.fail(queue.lease(owner="a", lease_duration=60), owner="a")
+    assert queue.lease(owner="a", lease_duration=60) is None
+    assert queue.is_drained()
+    assert queue.get_results(EXPERIMENT_FOLDER_PATH)[0].status == "failed"
+
+
+def test_finished_experiment_should_be_claimed_exactly_once(tmp_path):
+    queue = _create_queue(tmp_path)
+    first_item = queue.lease(owner="a", lease_duration=60)
+    second_item = queue.lease(owner="b", lease_duration=60)
+    queue.complete(second_item, owner="b", total_reward=0.5, episode_end_reason="NON_ZERO_TERMINAL_REWARD")
+    assert queue.claim_finished_experiments() == []
+    queue.complete(first_item, owner="a", total_reward=-1.0, episode_end_reason="CONVERSATION_TURNS_EXCEEDED")
+    assert queue.claim_finished_experiments() == [EXPERIMENT_OPTIONS]
+    assert queue.claim_finished_experiments() == []
+    assert [result.total_reward for result in queue.get_results(EXPERIMENT_FOLDER_PATH)] == [-1.0, 0.5]
+
+
+def test_requeue_should_only_hand_back_unsuccessful_items(tmp_path):
+    queue = _create_queue(tmp_path, job_indices=[0, 1, 2], max_attempts=1)
+    successful_item = queue.lease(owner="a", lease_duration=60)
+    errored_item = queue.lease(owner="a", lease_duration=60)
+    failed_item = queue.lease(owner="a", lease_duration=60)
+    queue.complete(successful_item, owner="a", total_reward=1.0, episode_end_reason="NON_ZERO_TERMINAL_REWARD")
+    queue.complete(errored_item, owner="a", total_reward=0.0, episode_end_reason="RUNTIME_ERROR")
+    queue.fail(failed_item, owner="a")
+    assert queue.claim_finished_experiments() == [EXPERIMENT_OPTIONS]
+
+    queue.requeue_unsuccessful()
+    requeued_job_indices = [queue.lease(owner="b", lease_duration=60).job_index for _ in range(2)]
+    assert requeued_job_indices == [1, 2]
+    assert queue.lease(owner="b", lease_duration=60) is None
+    # The experiment has to be collated again once the requeued items finish
+    assert queue.claim_finished_experiments() == []
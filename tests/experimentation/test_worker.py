@@ -0,0 +1,44 @@
+import threading
+from typing import Optional
+
+from src.experimentation import worker
+from src.experimentation.experiments.experiment import ArenaJobStopped
+from src.experimentation.work_queue import WorkQueue
+
+EXPERIMENT_FOLDER_PATH = "outputs/suite/aai_seeds_0"
+EXPERIMENT_OPTIONS = {"experiment_name": "experiment1", "output_folder_path": EXPERIMENT_FOLDER_PATH}
+
+
+class StolenLeaseQueue(WorkQueue):
+    """A queue whose leases are always found to have been taken over by another worker."""
+
+    def heartbeat(self, item, owner: str, lease_duration: float) -> bool:
+        return False
+
+
+class StoppableExperiment:
+    """Runs until it is asked to stop."""
+
+    def __init__(self) -> None:
+        self.stop_event: Optional[threading.Event] = None
+
+    def run_arena_job(self, job_index: int, environment_manager, stop_event: Optional[threading.Event] = None):
+        self.stop_event = stop_event
+        if stop_event.wait(timeout=5):
+            raise ArenaJobStopped()
+        return 1.0, "NON_ZERO_TERMINAL_REWARD"
+
+
+def test_items_whose_lease_is_lost_should_be_stopped_without_a_result(tmp_path, monkeypatch):
+    experiment = StoppableExperiment()
+    monkeypatch.setattr(worker.ExperimentFactory, "create_experiment", lambda self, name, options: experiment)
+    queue = StolenLeaseQueue(str(tmp_path / "work_queue.sqlite"))
+    queue.enqueue(EXPERIMENT_FOLDER_PATH, EXPERIMENT_OPTIONS, [0])
+    item = queue.lease(owner="a", lease_duration=60)
+
+    worker._run_work_item(queue, item, owner="a", lease_duration=0.03, environment_manager=None)
+
+    assert experiment.stop_event.is_set()
+    [result] = queue.get_results(EXPERIMENT_FOLDER_PATH)
+    assert result.status == "leased"
+    assert result.total_reward is None
@@ -2,7 +2,8 @@
 import pytest
 from mlagents_envs.base_env import ActionTuple
 
-from src.llm_scripting.minimal_parser import minimal_parser_fail_message, minimal_parser, ScriptCommands
+from src.llm_scripting.minimal_parser import minimal_parser_fail_message, minimal_parser, ScriptCommands, \
+    IncrementalParser
 from src.definitions.constants import DEGREES_PER_ROTATE
 from src.definitions.cardinal_directions import action_name_to_action_tuple
 
@@ -153,3 +154,36 @@ def test_think_with_semicolon_should_be_valid():
     print(resp)
     assert okay
 # <<< Think command tests
+
+
+# >>> Incremental parser tests
+def _parse_in_chunks(script: str, chunk_size: int) -> tuple[list[ActionTuple], tuple]:
+    parser = IncrementalParser()
+    actions = []
+    for start in range(0, len(script), chunk_size):
+        actions += parser.feed(script[start:start + chunk_size])
+    return actions, parser.finish()
+
+
+@pytest.mark.parametrize("script", [
+    f"{ScriptCommands.Think.value}(I am thinking; I have decided to do x);Go(5);Turn(-{DEGREES_PER_ROTATE * 2});",
+    f" {ScriptCommands.Go.value}(1);\n{ScriptCommands.Go.value}(-2); ",
+    f"{ScriptCommands.Go.value}(10); If you have any more questions, please let me know",
+    f"{ScriptCommands.Go.value}(10)",
+    "",
+])
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_incremental_parser_should_agree_with_minimal_parser(script, chunk_size):
+    okay, expected_actions = minimal_parser(script)
+    actions, (incremental_okay, _) = _parse_in_chunks(script, chunk_size)
+    assert incremental_okay == okay
+    if okay:
+        assert actions == expected_actions
+
+
+def test_incremental_parser_should_emit_a_command_once_it_is_complete():
+    parser = IncrementalParser()
+    assert parser.feed(f"{ScriptCommands.Go.value}(2") == []
+    assert parser.feed(");Think(") == [action_name_to_action_tuple["FORWARDS"]] * 2
+    assert parser.feed("Go(1);") == []
+# <<< Incremental parser tests
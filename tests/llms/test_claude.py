@@ -0,0 +1,39 @@
+import json
+
+from src.llms.claude import AnthropicSession
+from src.llms.llm import PromptElement
+from src.llms.prompt_caching import ANTHROPIC_CACHE_CONTROL
+
+INITIAL_MESSAGE = [
+    (PromptElement.Text, "Background"),
+    (PromptElement.Image, "example"),
+    (PromptElement.Text, "\n"),
+]
+
+
+def _get_first_arena_request(observation: str, health: int) -> dict:
+    """Returns the first request of an arena's conversation, as laid out by Experiment1."""
+    session = AnthropicSession(api_key="key", model="claude-3-haiku-20240307")
+    session.set_prompt_caching(True, shared_prefix_length=len(INITIAL_MESSAGE))
+    message = INITIAL_MESSAGE[:-1] + [
+        (PromptElement.Text, INITIAL_MESSAGE[-1][1] + "A new level begins now.\nEnvironment observation captured:"),
+        (PromptElement.Image, observation),
+        (PromptElement.Text, f"Your health is {health}."),
+    ]
+    session._add_prompt_to_history(message, resp_prefix=None)
+    return session._get_request_kwargs()
+
+
+def test_the_cached_prefix_should_be_the_same_for_every_arena():
+    first_arena_request = _get_first_arena_request("first observation", health=100)
+    second_arena_request = _get_first_arena_request("second observation", health=50)
+
+    cached_prefixes = []
+    for request in [first_arena_request, second_arena_request]:
+        content = request["messages"][0]["content"]
+        breakpoints = [index for index, block in enumerate(content) if "cache_control" in block]
+        assert breakpoints == [len(INITIAL_MESSAGE) - 1, len(content) - 1]
+        assert content[breakpoints[0]]["cache_control"] == ANTHROPIC_CACHE_CONTROL
+        cached_prefixes.append(json.dumps(content[:breakpoints[0] + 1], sort_keys=True).encode())
+    assert cached_prefixes[0] == cached_prefixes[1]
+    assert first_arena_request["messages"] != second_arena_request["messages"]
@@ -0,0 +1,29 @@
+import httpx
+
+from src.llms.client_pool import ClientPool, HttpClientSettings
+
+
+def _create_client(http_client):
+    return http_client
+
+
+def test_clients_should_be_shared_per_key():
+    client_pool = ClientPool()
+    client = client_pool.get_client(("anthropic", "key"), _create_client)
+    assert client_pool.get_client(("anthropic", "key"), _create_client) is client
+    assert client_pool.get_client(("anthropic", "other key"), _create_client) is not client
+
+
+def test_clients_should_be_created_with_the_pool_settings():
+    client_pool = ClientPool(HttpClientSettings(timeout_seconds=5))
+    client = client_pool.get_client(("anthropic", "key"), _create_client)
+    assert client.timeout == httpx.Timeout(5)
+    client_pool.settings = HttpClientSettings(timeout_seconds=10)
+    assert client_pool.get_client(("anthropic", "key"), _create_client) is not client
+
+
+def test_a_forked_process_should_not_reuse_its_parents_clients():
+    client_pool = ClientPool()
+    client = client_pool.get_client(("anthropic", "key"), _create_client)
+    client_pool._pid = -1
+    assert client_pool.get_client(("anthropic", "key"), _create_client) is not client
@@ -0,0 +1,160 @@
+import pickle
+import time
+from typing import List, Optional
+
+import numpy as np
+import pytest
+
+from src.llms.hedging import HEDGE_LOSER_INPUT_COSTS_FILE_NAME, HedgedSession, LatencyTracker, PRIMARY_REPLICA, \
+    SECONDARY_REPLICA
+from src.llms.llm import LLMMessageParam, LLMSession, PROMPT_CONTENTS, PromptElement
+from src.llms.rate_limiter import RateLimitedSession, RateLimiter
+
+
+class ReplicaSession(LLMSession):
+    """Responds with its replica's name once its delay has passed, or fails if it has no response."""
+
+    def __init__(self, response: Optional[str], delay_seconds: float = 0) -> None:
+        super().__init__()
+        self._history: List[LLMMessageParam] = []
+        self.response = response
+        self.delay_seconds = delay_seconds
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        time.sleep(self.delay_seconds)
+        if self.response is None:
+            raise ConnectionError("replica unavailable")
+        self.artificial_prompt(prompt_contents, [(PromptElement.Text, self.response)])
+        self.input_costs = np.append(self.input_costs, 100 * len(self._history))
+        self.output_costs = np.append(self.output_costs, 10)
+        self.cache_read_costs = np.append(self.cache_read_costs, 0)
+        self.cache_write_costs = np.append(self.cache_write_costs, 0)
+        return self.response
+
+    def artificial_prompt(self, prompt_contents: PROMPT_CONTENTS, response_contents: PROMPT_CONTENTS) -> None:
+        self._history.append(LLMMessageParam(role="user", content=prompt_contents))
+        self._history.append(LLMMessageParam(role="assistant", content=response_contents))
+
+    @property
+    def history(self) -> list:
+        return list(self._history)
+
+    def load_from_history_file(self, file: str) -> None:
+        raise NotImplementedError()
+
+    @staticmethod
+    def get_assistant_commands_from_pkl_history(path_to_pkl: str) -> List[str]:
+        raise NotImplementedError()
+
+
+PROMPT = [(PromptElement.Text, "Background")]
+
+
+def _create_hedged_session(primary: LLMSession, secondary: LLMSession, deadline_seconds: float = 0.05):
+    return HedgedSession(ReplicaSession(None),
+                         create_replica=lambda replica_index: [primary, secondary][replica_index],
+                         latency_tracker=LatencyTracker(initial_deadline_seconds=deadline_seconds))
+
+
+def test_fast_responses_should_not_be_hedged():
+    secondary = ReplicaSession("Go(2)")
+    session = _create_hedged_session(ReplicaSession("Go(1)"), secondary)
+    assert session.prompt(PROMPT) == "Go(1)"
+    assert session.winners == [PRIMARY_REPLICA]
+    assert session.num_hedged_prompts == 0
+    assert len(secondary.history) == 0
+
+
+def test_slow_responses_should_be_answered_by_the_secondary_replica():
+    session = _create_hedged_session(ReplicaSession("Go(1)", delay_seconds=1), ReplicaSession("Go(2)"))
+    assert session.prompt(PROMPT) == "Go(2)"
+    assert session.winners == [SECONDARY_REPLICA]
+    assert session.history == [LLMMessageParam(role="user", content=PROMPT),
+                               LLMMessageParam(role="assistant", content=[(PromptElement.Text, "Go(2)")])]
+    assert np.array_equal(session.input_costs, [200])
+
+
+def test_failed_requests_should_be_hedged_and_raised_if_every_replica_fails():
+    session = _create_hedged_session(ReplicaSession(None), ReplicaSession("Go(2)"), deadline_seconds=10)
+    assert session.prompt(PROMPT) == "Go(2)"
+    session = _create_hedged_session(ReplicaSession(None), ReplicaSession(None))
+    with pytest.raises(ConnectionError):
+        session.prompt(PROMPT)
+
+
+def test_replicas_should_start_from_the_sessions_history():
+    replicas = []
+
+    def create_replica(replica_index: int) -> LLMSession:
+        replicas.append(ReplicaSession(f"Go({len(replicas) + 1})"))
+        return replicas[-1]
+
+    session = HedgedSession(ReplicaSession(None), create_replica, LatencyTracker())
+    session.prompt(PROMPT)
+    session.mark_arena_start()
+    session.prompt(PROMPT)
+    assert len(session.history) == 4
+    assert len(replicas) == 1
+    assert replicas[0]._arena_start_index == 2
+    assert np.array_equal(session.input_costs, [200, 400])
+
+
+def _wait_for_losing_requests(session: HedgedSession, num_losing_requests: int) -> None:
+    deadline = time.monotonic() + 5
+    while len(session.loser_input_costs) < num_losing_requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_a_replica_should_only_be_created_while_the_idle_one_is_still_running():
+    replicas = []
+
+    def create_replica(replica_index: int) -> LLMSession:
+        replicas.append(ReplicaSession("Go(1)" if replica_index == PRIMARY_REPLICA else "Go(2)",
+                                       delay_seconds=0.3 if replica_index == PRIMARY_REPLICA else 0))
+        return replicas[-1]
+
+    session = HedgedSession(ReplicaSession(None), create_replica, LatencyTracker(initial_deadline_seconds=0.05))
+    session.prompt(PROMPT)
+    session.prompt(PROMPT)
+    assert len(replicas) == 3
+    _wait_for_losing_requests(session, 2)
+    session.prompt(PROMPT)
+    assert len(replicas) == 3
+
+
+def test_losing_requests_should_be_costed_apart_from_the_conversation(tmp_path):
+    session = _create_hedged_session(ReplicaSession("Go(1)", delay_seconds=0.2), ReplicaSession("Go(2)"))
+    session.prompt(PROMPT)
+    _wait_for_losing_requests(session, 1)
+    assert np.array_equal(session.input_costs, [200])
+    assert session.loser_input_costs == [200]
+    assert session.loser_output_costs == [10]
+    session.save_cost_arrays(str(tmp_path))
+    assert np.array_equal(np.load(tmp_path / HEDGE_LOSER_INPUT_COSTS_FILE_NAME), [200])
+
+
+def test_hedged_requests_should_be_charged_to_the_rate_limiter(tmp_path):
+    rate_limiter = RateLimiter("claude", "model", requests_per_minute=2, state_folder_path=str(tmp_path))
+    primary = RateLimitedSession(ReplicaSession("Go(1)", delay_seconds=0.2), "claude", rate_limiter)
+    secondary = RateLimitedSession(ReplicaSession("Go(2)"), "claude", rate_limiter)
+    session = _create_hedged_session(primary, secondary)
+    session.prompt(PROMPT)
+    _wait_for_losing_requests(session, 1)
+    assert rate_limiter._try_acquire(0) > 0
+
+
+def test_the_deadline_should_follow_the_recent_latencies():
+    latency_tracker = LatencyTracker(percentile=50, min_samples=3, initial_deadline_seconds=30)
+    latency_tracker.record(1)
+    latency_tracker.record(2)
+    assert latency_tracker.deadline_seconds == 30
+    latency_tracker.record(3)
+    assert latency_tracker.deadline_seconds == 2
+
+
+def test_trackers_should_be_picklable_with_their_latencies():
+    latency_tracker = LatencyTracker(percentile=50, min_samples=1)
+    latency_tracker.record(2)
+    latency_tracker = pickle.loads(pickle.dumps(latency_tracker))
+    latency_tracker.record(4)
+    assert latency_tracker.deadline_seconds == 3
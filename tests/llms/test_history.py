@@ -0,0 +1,37 @@
+from src.llms.history import HistoryPolicy, prune_history_images
+
+PLACEHOLDER = {"type": "text", "text": "omitted"}
+
+
+def _is_image_block(block) -> bool:
+    return block.get("type") == "image"
+
+
+def _message(index: int) -> dict:
+    return {"role": "user", "content": [{"type": "text", "text": str(index)}, {"type": "image", "source": str(index)}]}
+
+
+HISTORY = [_message(index) for index in range(4)]
+
+
+def _kept_images(history: list) -> list:
+    return [block["source"] for message in history for block in message["content"] if _is_image_block(block)]
+
+
+def test_default_policy_should_keep_every_image():
+    assert prune_history_images(HISTORY, HistoryPolicy(), 0, "content", _is_image_block, PLACEHOLDER) is HISTORY
+
+
+def test_max_images_should_keep_the_most_recent_images_and_all_text():
+    pruned_history = prune_history_images(HISTORY, HistoryPolicy(max_images=2), 0, "content", _is_image_block,
+                                          PLACEHOLDER)
+    assert _kept_images(pruned_history) == ["2", "3"]
+    assert pruned_history[0]["content"] == [{"type": "text", "text": "0"}, PLACEHOLDER]
+    assert _kept_images(HISTORY) == ["0", "1", "2", "3"]
+
+
+def test_current_arena_only_should_drop_the_images_of_earlier_arenas():
+    pruned_history = prune_history_images(HISTORY, HistoryPolicy(current_arena_only=True), 3, "content",
+                                          _is_image_block, PLACEHOLDER)
+    assert _kept_images(pruned_history) == ["3"]
+    assert len(pruned_history) == len(HISTORY)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.llms.prompt_caching import ANTHROPIC_CACHE_CONTROL, add_anthropic_cache_breakpoints, get_cache_hit_rate
+
+MESSAGES = [
+    {"role": "user", "content": [{"type": "text", "text": "background"}, {"type": "image", "source": "example"}]},
+    {"role": "assistant", "content": "Go(10)"},
+    {"role": "user", "content": [{"type": "text", "text": "observation"}]},
+]
+
+
+def test_cache_breakpoints_should_follow_the_first_and_last_user_messages():
+    marked_messages = add_anthropic_cache_breakpoints(MESSAGES)
+    assert marked_messages[0]["content"][-1]["cache_control"] == ANTHROPIC_CACHE_CONTROL
+    assert "cache_control" not in marked_messages[0]["content"][0]
+    assert marked_messages[1] is MESSAGES[1]
+    assert marked_messages[2]["content"][-1]["cache_control"] == ANTHROPIC_CACHE_CONTROL
+    assert all("cache_control" not in block for message in MESSAGES[::2] for block in message["content"])
+
+
+def test_the_first_cache_breakpoint_should_end_the_shared_prefix():
+    marked_messages = add_anthropic_cache_breakpoints(MESSAGES, shared_prefix_length=1)
+    assert marked_messages[0]["content"][0]["cache_control"] == ANTHROPIC_CACHE_CONTROL
+    assert "cache_control" not in marked_messages[0]["content"][-1]
+    assert marked_messages[2]["content"][-1]["cache_control"] == ANTHROPIC_CACHE_CONTROL
+
+
+def test_cache_hit_rate_should_be_the_fraction_of_input_tokens_read_from_the_cache():
+    assert get_cache_hit_rate(np.array([1000, 1000]), np.array([0, 500])) == 0.25
+    assert get_cache_hit_rate(np.array([]), np.array([])) == 0.0
@@ -0,0 +1,38 @@
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+from src.llms.llm import PromptElement
+from src.llms.rate_limiter import RateLimiter, estimate_prompt_tokens
+
+
+def test_requests_beyond_the_limit_should_wait_for_the_bucket_to_refill(tmp_path):
+    rate_limiter = RateLimiter("claude", "model", requests_per_minute=60, state_folder_path=str(tmp_path))
+    for _ in range(60):
+        assert rate_limiter._try_acquire(100) == 0
+    assert 0 < rate_limiter._try_acquire(100) <= 1
+
+
+def test_limiters_of_the_same_model_should_share_their_buckets(tmp_path):
+    rate_limiter = RateLimiter("gpt", "model", tokens_per_minute=1000, state_folder_path=str(tmp_path))
+    other_rate_limiter = RateLimiter("gpt", "model", tokens_per_minute=1000, state_folder_path=str(tmp_path))
+    other_model_rate_limiter = RateLimiter("gpt", "other", tokens_per_minute=1000, state_folder_path=str(tmp_path))
+    assert rate_limiter._try_acquire(800) == 0
+    assert other_rate_limiter._try_acquire(800) > 0
+    assert other_model_rate_limiter._try_acquire(800) == 0
+
+
+def test_recorded_usage_should_correct_the_estimate(tmp_path):
+    rate_limiter = RateLimiter("gemini", "model", tokens_per_minute=1000, state_folder_path=str(tmp_path))
+    assert rate_limiter._try_acquire(100) == 0
+    rate_limiter.record_usage(estimated_tokens=100, actual_tokens=1000)
+    assert rate_limiter._try_acquire(100) > 0
+
+
+def test_image_tokens_should_be_estimated_from_the_image_size():
+    jpeg = io.BytesIO()
+    Image.fromarray(np.zeros((750, 100, 3), dtype=np.uint8)).save(jpeg, format="JPEG")
+    prompt_contents = [(PromptElement.Text, "12345678"), (PromptElement.Image, base64.b64encode(jpeg.getvalue()).decode())]
+    assert estimate_prompt_tokens("claude", prompt_contents) == 2 + 100
@@ -0,0 +1,110 @@
+from typing import List, Optional
+
+import numpy as np
+
+from src.llms.llm import LLMMessageParam, LLMSession, PROMPT_CONTENTS, PromptElement
+from src.llms.rate_limiter import RateLimitedSession, RateLimiter
+from src.llms.response_cache import CachedResponse, CachedSession, RESPONSE_CACHE_HITS_FILE_NAME, ResponseCache
+
+
+class CountingSession(LLMSession):
+    """Responds with the number of prompts it has been sent."""
+    stop_sequences = ["<EOS>"]
+    max_tokens = 1024
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._history: List[LLMMessageParam] = []
+        self.num_prompts = 0
+
+    def prompt(self, prompt_contents: PROMPT_CONTENTS, resp_prefix: Optional[str] = None) -> str:
+        self.num_prompts += 1
+        response = f"Go({self.num_prompts})"
+        self.artificial_prompt(prompt_contents, [(PromptElement.Text, response)])
+        for costs_name, cost in [("input_costs", 100), ("output_costs", 10), ("cache_read_costs", 0),
+                                 ("cache_write_costs", 0)]:
+            setattr(self, costs_name, np.append(getattr(self, costs_name), cost))
+        return response
+
+    def artificial_prompt(self, prompt_contents: PROMPT_CONTENTS, response_contents: PROMPT_CONTENTS) -> None:
+        self._history.append(LLMMessageParam(role="user", content=prompt_contents))
+        self._history.append(LLMMessageParam(role="assistant", content=response_contents))
+
+    @property
+    def history(self) -> list:
+        return list(self._history)
+
+    def load_from_history_file(self, file: str) -> None:
+        raise NotImplementedError()
+
+    @staticmethod
+    def get_assistant_commands_from_pkl_history(path_to_pkl: str) -> List[str]:
+        raise NotImplementedError()
+
+
+PROMPTS = [[(PromptElement.Text, "Background"), (PromptElement.Image, "/9j/observation")],
+           [(PromptElement.Text, "Health")]]
+
+
+def _run(session: LLMSession) -> List[str]:
+    return [session.prompt(prompt) for prompt in PROMPTS]
+
+
+def test_read_through_should_replay_a_previous_run_without_prompting(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size_bytes=2 ** 20)
+    first_session = CachedSession(CountingSession(), "model", response_cache)
+    second_session = CachedSession(CountingSession(), "model", response_cache)
+    assert _run(first_session) == _run(second_session)
+    assert second_session.session.num_prompts == 0
+    assert second_session.hits == 2
+    assert second_session.history == first_session.history
+
+
+def test_responses_from_the_cache_should_cost_nothing(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size_bytes=2 ** 20)
+    first_session = CachedSession(CountingSession(), "model", response_cache)
+    first_session.prompt(PROMPTS[0])
+    session = CachedSession(CountingSession(), "model", response_cache)
+    _run(session)
+    assert np.array_equal(session.input_costs, [0, 100])
+    assert np.array_equal(session.output_costs, [0, 10])
+    assert session.response_cache_hits == [True, False]
+    session.save_cost_arrays(str(tmp_path))
+    assert np.array_equal(np.load(tmp_path / RESPONSE_CACHE_HITS_FILE_NAME), [True, False])
+
+
+def test_responses_from_the_cache_should_still_measure_the_history(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size_bytes=2 ** 20)
+    first_session = CachedSession(CountingSession(), "model", response_cache)
+    first_session.prompt(PROMPTS[0])
+    session = CachedSession(CountingSession(), "model", response_cache)
+    session.prompt(PROMPTS[0])
+    assert session.last_request_input_tokens == first_session.last_request_input_tokens == 100
+
+
+def test_write_only_should_always_prompt(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size_bytes=2 ** 20)
+    _run(CachedSession(CountingSession(), "model", response_cache))
+    session = CachedSession(CountingSession(), "model", response_cache, mode="write_only")
+    _run(session)
+    assert session.session.num_prompts == 2
+
+
+def test_least_recently_used_responses_should_be_evicted_first(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size_bytes=8)
+    for request_key in ["a", "b"]:
+        response_cache.put(request_key, CachedResponse("Go(1)", 100, 10, 0, 0))
+    assert response_cache.get("a") is None
+    assert response_cache.get("b") is not None
+
+
+def test_wrapped_sessions_should_be_keyed_by_their_provider_session(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size_bytes=2 ** 20)
+    prompt = [(PromptElement.Text, "Background")]
+    CachedSession(CountingSession(), "model", response_cache).prompt(prompt)
+    rate_limited_session = RateLimitedSession(CountingSession(), "claude",
+                                              RateLimiter("claude", "model", state_folder_path=str(tmp_path)))
+    session = CachedSession(rate_limited_session, "model", response_cache)
+    assert session.prompt(prompt) == "Go(1)"
+    assert session.hits == 1
+    assert session.innermost_session is rate_limited_session.session
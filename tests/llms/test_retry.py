@@ -0,0 +1,71 @@
+from typing import Optional
+
+import pytest
+
+from src.llms.retry import RetryPolicy, call_with_retries, get_http_retry_policy, \
+    get_retry_after, get_retry_delay
+
+FAST_RETRY_POLICY = RetryPolicy(max_attempts=3, initial_delay=0.001, max_delay=0.001)
+
+
+class Response:
+    def __init__(self, headers: dict) -> None:
+        self.headers = headers
+
+
+class TransientError(Exception):
+    def __init__(self, headers: Optional[dict] = None) -> None:
+        super().__init__("transient")
+        self.response = Response(headers or {})
+
+
+def _get_retry_policy(e: Exception) -> Optional[RetryPolicy]:
+    return FAST_RETRY_POLICY if isinstance(e, TransientError) else None
+
+
+class FailingRequest:
+    def __init__(self, errors: list) -> None:
+        self.errors = errors
+        self.num_calls = 0
+
+    def __call__(self) -> str:
+        self.num_calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return "Go(10)"
+
+
+def test_transient_errors_should_be_retried_until_the_request_succeeds():
+    request = FailingRequest([TransientError(), TransientError()])
+    assert call_with_retries(request, _get_retry_policy) == "Go(10)"
+    assert request.num_calls == 3
+
+
+def test_other_errors_and_exhausted_attempts_should_be_raised():
+    request = FailingRequest([ValueError()])
+    with pytest.raises(ValueError):
+        call_with_retries(request, _get_retry_policy)
+    assert request.num_calls == 1
+    with pytest.raises(TransientError):
+        call_with_retries(FailingRequest([TransientError()] * 3), _get_retry_policy)
+
+
+def test_retries_should_stop_when_they_would_exceed_the_budget():
+    request = FailingRequest([TransientError({"retry-after": "10"})])
+    with pytest.raises(TransientError):
+        call_with_retries(request, _get_retry_policy, retry_budget_seconds=1)
+    assert request.num_calls == 1
+
+
+def test_retry_after_headers_should_set_the_minimum_delay():
+    assert get_retry_after(TransientError({"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(TransientError({"retry-after": "3"})) == 3
+    assert get_retry_after(TransientError()) is None
+    assert get_retry_delay(FAST_RETRY_POLICY, 1, retry_after=2) == 2
+    assert 0 <= get_retry_delay(RetryPolicy(max_attempts=5, initial_delay=1, max_delay=4), 10) <= 4
+
+
+def test_only_transient_status_codes_should_be_retried():
+    assert get_http_retry_policy(429) is not None
+    assert get_http_retry_policy(529) is not None
+    assert get_http_retry_policy(400) is None
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from src.utilities.background_writer import BackgroundWriter, write_bytes
+
+
+def test_writes_should_be_done_in_order_after_flush(tmp_path):
+    writer = BackgroundWriter()
+    written = []
+    for index in range(10):
+        writer.submit(written.append, index)
+    writer.submit(write_bytes, str(tmp_path / "file.bin"), b"data")
+    writer.flush()
+    assert written == list(range(10))
+    assert (tmp_path / "file.bin").read_bytes() == b"data"
+    writer.close()
+
+
+def test_flush_should_raise_the_first_write_error():
+    writer = BackgroundWriter()
+
+    def fail(message: str) -> None:
+        raise OSError(message)
+
+    writer.submit(fail, "first")
+    writer.submit(fail, "second")
+    with pytest.raises(OSError, match="first"):
+        writer.flush()
+    # The error is only raised once
+    writer.flush()
+    writer.close()
+
+
+def test_submit_should_block_when_the_queue_is_full():
+    writer = BackgroundWriter(max_pending_writes=1)
+    release = threading.Event()
+    writer.submit(release.wait)
+    # One write is running and one is pending, so a third one has to wait
+    writer.submit(lambda: None)
+    submitter = threading.Thread(target=writer.submit, args=(lambda: None,))
+    submitter.start()
+    submitter.join(timeout=0.2)
+    assert submitter.is_alive()
+    release.set()
+    submitter.join()
+    writer.close()
@@ -0,0 +1,40 @@
+import base64
+import pickle
+
+from src.llms.llm import PromptElement
+from src.utilities.observation_store import ObservationStore, OBSERVATION_STORE_FOLDER_NAME, \
+    OBSERVATION_REFERENCE_PREFIX, load_history_file
+
+# A jpeg start-of-image marker followed by arbitrary bytes
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + bytes(range(64))
+JPEG_B64 = base64.b64encode(JPEG_BYTES).decode("utf-8")
+
+
+def test_identical_observations_should_be_stored_once(tmp_path):
+    store = ObservationStore(str(tmp_path / OBSERVATION_STORE_FOLDER_NAME))
+    digest = store.put(JPEG_BYTES)
+    assert store.put(JPEG_BYTES) == digest
+    assert store.get(digest) == JPEG_BYTES
+    assert len(list((tmp_path / OBSERVATION_STORE_FOLDER_NAME).rglob("*.jpg"))) == 1
+
+
+def test_histories_should_round_trip_through_references(tmp_path):
+    store = ObservationStore(str(tmp_path / OBSERVATION_STORE_FOLDER_NAME))
+    history = [
+        {"role": "user", "content": [
+            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": JPEG_B64}},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{JPEG_B64}"}},
+            (PromptElement.Image, JPEG_B64),
+            (PromptElement.Text, "Go forwards"),
+        ]},
+    ]
+    referenced_history = store.reference_history(history)
+    assert JPEG_B64 not in str(referenced_history)
+    assert referenced_history[0]["content"][0]["source"]["data"].startswith(OBSERVATION_REFERENCE_PREFIX)
+    assert referenced_history[0]["content"][3] == (PromptElement.Text, "Go forwards")
+
+    arena_folder_path = tmp_path / "aai_seeds_0" / "arena"
+    arena_folder_path.mkdir(parents=True)
+    with open(arena_folder_path / "history.pkl", "wb") as file:
+        pickle.dump(referenced_history, file)
+    assert load_history_file(str(arena_folder_path / "history.pkl")) == history
@@ -0,0 +1,85 @@
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+from PIL.JpegImagePlugin import get_sampling
+
+from src.definitions.constants import FRAMES_BETWEEN_OBS
+from src.experimentation.experiments.experiment1 import Experiment1
+from src.vision.camera import CameraSystem
+
+WHITE = 255
+
+
+def _create_frame(value: int) -> np.ndarray:
+    return np.full((2, 3, 3), value, dtype=np.uint8)
+
+
+class CountingEnvironment:
+    """Steps with a reward of 0.1 per step, and ends the episode at end_step if given."""
+
+    def __init__(self, end_step: int = None) -> None:
+        self.num_steps = 0
+        self.end_step = end_step
+
+    def set_actions(self, behavior_name: str, action) -> None:
+        pass
+
+    def step(self) -> None:
+        self.num_steps += 1
+
+    def get_steps(self, behavior: str):
+        if self.num_steps == self.end_step:
+            return SimpleNamespace(reward=np.array([])), SimpleNamespace(reward=np.array([0.1]))
+        return SimpleNamespace(reward=np.array([0.1])), SimpleNamespace(reward=np.array([]))
+
+
+class StepCountingCamera:
+    """Captures frames filled with the number of steps taken so far."""
+
+    def __init__(self, num_frames: int) -> None:
+        self.num_frames = num_frames
+
+    def capture_frame(self, env: CountingEnvironment) -> np.ndarray:
+        return _create_frame(env.num_steps)
+
+
+def test_frames_should_be_tiled_between_white_gutters():
+    camera_system = CameraSystem(num_frames=3)
+    frame = camera_system._build_frame(None, border_width=2, frames=[_create_frame(value) for value in [10, 20, 30]])
+    assert frame.shape == (2, 3 * 3 + 2 * 4, 3)
+    assert [int(value) for value in frame[0, :, 0]] == [WHITE] * 2 + [10] * 3 + [WHITE] * 2 + [20] * 3 + \
+           [WHITE] * 2 + [30] * 3 + [WHITE] * 2
+    # The buffer is reused, with the next observation's frames written over the last one's
+    next_frame = camera_system._build_frame(None, border_width=2, frames=[_create_frame(value) for value in [1, 2, 3]])
+    assert next_frame is frame
+    assert [int(value) for value in frame[1, 2:17:5, 2]] == [1, 2, 3]
+
+
+def test_frames_should_be_captured_evenly_over_the_wait():
+    env = CountingEnvironment()
+    frames, done, total_reward = Experiment1._capture_frames_during_wait(env, StepCountingCamera(3), "behavior")
+    assert [int(frame[0, 0, 0]) for frame in frames] == [0, FRAMES_BETWEEN_OBS // 2, FRAMES_BETWEEN_OBS]
+    assert not done
+    assert np.isclose(total_reward, 0.1 * FRAMES_BETWEEN_OBS)
+
+
+def test_the_last_frame_should_be_repeated_when_the_episode_ends_during_the_wait():
+    env = CountingEnvironment(end_step=FRAMES_BETWEEN_OBS // 2 + 2)
+    frames, done, _ = Experiment1._capture_frames_during_wait(env, StepCountingCamera(3), "behavior")
+    assert [int(frame[0, 0, 0]) for frame in frames] == [0, FRAMES_BETWEEN_OBS // 2, FRAMES_BETWEEN_OBS // 2]
+    assert done
+
+
+def test_simplejpeg_should_encode_observations_like_pil():
+    pytest.importorskip("simplejpeg")
+    # A smooth gradient, whose colours do not change much between neighbouring pixels
+    frame = np.stack([*np.meshgrid(np.arange(64), np.arange(64)), np.full((64, 64), 32)], axis=-1)
+    frame = (frame * 4 % 256).astype(np.uint8)
+    pil_jpeg, simplejpeg_jpeg = [Image.open(BytesIO(CameraSystem(jpeg_encoder=jpeg_encoder)._encode_jpeg(frame, 75)))
+                                 for jpeg_encoder in ["pil", "simplejpeg"]]
+    assert get_sampling(simplejpeg_jpeg) == get_sampling(pil_jpeg)
+    difference = np.abs(np.asarray(simplejpeg_jpeg, dtype=int) - np.asarray(pil_jpeg, dtype=int))
+    assert difference.mean() < 1
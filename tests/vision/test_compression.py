@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from src.vision.compression import ObservationCompressor, estimate_image_tokens
+
+FRAME = np.zeros((512, 516, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("llm_family, expected_tokens", [("claude", 353), ("gpt", 425), ("gemini", 258)])
+def test_estimate_image_tokens(llm_family, expected_tokens):
+    assert estimate_image_tokens(llm_family, 516, 512) == expected_tokens
+
+
+@pytest.mark.parametrize("llm_family, image_token_budget", [("claude", 200), ("gpt", 255), ("gemini", 258)])
+def test_compressed_frame_should_fit_the_budget(llm_family, image_token_budget):
+    compressed = ObservationCompressor(llm_family, image_token_budget=image_token_budget).compress(FRAME)
+    height, width, _ = compressed.shape
+    assert estimate_image_tokens(llm_family, width, height) <= image_token_budget
+    # The aspect ratio is kept
+    assert abs(width / height - 516 / 512) < 0.01
+
+
+def test_frame_within_budget_should_be_unchanged():
+    assert ObservationCompressor("claude", image_token_budget=1000).compress(FRAME) is FRAME
+
+
+def test_grayscale_frame_should_have_one_channel():
+    assert ObservationCompressor("claude", grayscale=True).compress(FRAME).shape == (512, 516)
+
+
+def test_impossible_budget_should_be_rejected():
+    with pytest.raises(ValueError):
+        ObservationCompressor("gemini", image_token_budget=100)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from src.vision.perceptual_hash import difference_hash, hash_distance
+
+RANDOM_STATE = np.random.RandomState(0)
+FRAME = RANDOM_STATE.randint(0, 256, size=(64, 64, 3), dtype=np.uint8)
+
+
+def test_identical_frames_should_have_identical_hashes():
+    assert hash_distance(difference_hash(FRAME), difference_hash(FRAME.copy())) == 0
+
+
+def test_slight_noise_should_barely_change_the_hash():
+    noisy_frame = np.clip(FRAME.astype(np.int16) + RANDOM_STATE.randint(-2, 3, size=FRAME.shape), 0, 255)
+    assert hash_distance(difference_hash(FRAME), difference_hash(noisy_frame.astype(np.uint8))) < 16
+
+
+def test_a_different_view_should_change_the_hash():
+    assert hash_distance(difference_hash(FRAME), difference_hash(np.roll(FRAME, 8, axis=1))) > 64
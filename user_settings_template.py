@@ -5,4 +5,5 @@ ENV_PATH: str = ...  # Path to build executable (e.g. path/to/AnimalAI.app for M
 CLAUDE_API_KEY: str = ...
 GPT_API_KEY: str = ...
 GEMINI_API_KEY: str = ...
-LOG_FOLDER: str = ...
\ No newline at end of file
+LOG_FOLDER: str = ...
+HEDGE_API_KEY: str = ""  # Optional; key of the deployment given by the hedge_endpoint option, if it differs from the primary one's